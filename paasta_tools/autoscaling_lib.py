@@ -12,12 +12,17 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import heapq
+import logging
+import threading
+import time
 from contextlib import contextmanager
 from datetime import datetime
 from math import ceil
 
 import requests
 from kazoo.client import KazooClient
+from kazoo.client import KazooState
 from kazoo.exceptions import NoNodeError
 
 from paasta_tools.bounce_lib import LockHeldException
@@ -37,6 +42,8 @@ from paasta_tools.utils import get_services_for_cluster
 from paasta_tools.utils import load_system_paasta_config
 from paasta_tools.utils import ZookeeperPool
 
+log = logging.getLogger('__main__')
+
 _autoscaling_metrics_providers = {}
 _autoscaling_decision_policies = {}
 
@@ -45,6 +52,13 @@ METRICS_PROVIDER_KEY = 'metrics_provider'
 DECISION_POLICY_KEY = 'decision_policy'
 
 AUTOSCALING_DELAY = 300
+MIN_AUTOSCALING_INTERVAL = 30
+MAX_AUTOSCALING_INTERVAL = 600
+CONFIG_RELOAD_INTERVAL = 300
+# failed iterations of the long-running autoscaler are retried after MIN_AUTOSCALING_INTERVAL,
+# doubling with every consecutive failure up to MAX_AUTOSCALING_INTERVAL
+MAX_BACKOFF_DOUBLINGS = 5
+AUTOSCALING_LOCK_PATH = '/autoscaling/autoscaling.lock'
 
 
 def register_autoscaling_component(name, method_type):
@@ -252,12 +266,28 @@ def get_new_instance_count(current_instances, autoscaling_direction):
     return int(ceil((1 + float(autoscaling_direction) / 10) * current_instances))
 
 
+def get_autoscaling_interval(marathon_service_config):
+    """Returns how often, in seconds, a service instance should be evaluated by the autoscaler.
+    This is the ``interval`` key of the ``autoscaling`` dictionary, limited to between
+    MIN_AUTOSCALING_INTERVAL and MAX_AUTOSCALING_INTERVAL. Defaults to AUTOSCALING_DELAY,
+    which is also used, after logging an error, if ``interval`` isn't a number."""
+    interval = marathon_service_config.get_autoscaling_params().get('interval', AUTOSCALING_DELAY)
+    try:
+        interval = int(interval)
+    except (TypeError, ValueError):
+        write_to_log(config=marathon_service_config,
+                     line='Invalid autoscaling interval %r, using %d seconds' % (interval, AUTOSCALING_DELAY))
+        interval = AUTOSCALING_DELAY
+    return max(MIN_AUTOSCALING_INTERVAL, min(MAX_AUTOSCALING_INTERVAL, interval))
+
+
 def autoscale_marathon_instance(marathon_service_config, marathon_tasks, mesos_tasks):
     current_instances = marathon_service_config.get_instances()
     if len(marathon_tasks) != current_instances:
         write_to_log(config=marathon_service_config,
                      line='Delaying scaling as marathon is either waiting for resources or is delayed')
     autoscaling_params = marathon_service_config.get_autoscaling_params()
+    autoscaling_params.pop('interval', None)
     autoscaling_metrics_provider = get_autoscaling_metrics_provider(autoscaling_params.pop(METRICS_PROVIDER_KEY))
     autoscaling_decision_policy = get_autoscaling_decision_policy(autoscaling_params.pop(DECISION_POLICY_KEY))
 
@@ -277,51 +307,186 @@ def autoscale_marathon_instance(marathon_service_config, marathon_tasks, mesos_t
             )
 
 
-def autoscale_services(soa_dir=DEFAULT_SOA_DIR):
-    try:
-        with create_autoscaling_lock():
-            cluster = load_system_paasta_config().get_cluster()
-            services = get_services_for_cluster(
+def get_autoscaled_configs(soa_dir=DEFAULT_SOA_DIR):
+    """Returns the MarathonServiceConfigs of every service instance in this cluster
+    that paasta should autoscale."""
+    cluster = load_system_paasta_config().get_cluster()
+    services = get_services_for_cluster(
+        cluster=cluster,
+        instance_type='marathon',
+        soa_dir=soa_dir,
+    )
+    configs = []
+    for service, instance in services:
+        try:
+            service_config = load_marathon_service_config(
+                service=service,
+                instance=instance,
                 cluster=cluster,
-                instance_type='marathon',
                 soa_dir=soa_dir,
             )
-            configs = []
-            for service, instance in services:
-                service_config = load_marathon_service_config(
-                    service=service,
-                    instance=instance,
-                    cluster=cluster,
-                    soa_dir=soa_dir,
-                )
-                if service_config.get_max_instances() and service_config.get_desired_state() == 'start' \
-                        and service_config.get_autoscaling_params()['decision_policy'] != 'bespoke':
-                    configs.append(service_config)
+            if service_config.get_max_instances() and service_config.get_desired_state() == 'start' \
+                    and service_config.get_autoscaling_params()['decision_policy'] != 'bespoke':
+                configs.append(service_config)
+        except Exception:
+            # one broken service config shouldn't stop every other service from being autoscaled
+            log.exception("Failed to load the config of %s", format_job_id(service, instance))
+    return configs
+
 
+def get_all_marathon_tasks():
+    marathon_config = load_marathon_config()
+    return get_marathon_client(
+        url=marathon_config.get_url(),
+        user=marathon_config.get_username(),
+        passwd=marathon_config.get_password(),
+    ).list_tasks()
+
+
+def autoscale_service_config(config, all_marathon_tasks, all_mesos_tasks):
+    """Autoscales a single service instance using the given cluster-wide task lists,
+    logging rather than raising any errors."""
+    try:
+        job_id = format_job_id(config.service, config.instance)
+        marathon_tasks = {task.id: task for task in all_marathon_tasks
+                          if job_id == get_short_job_id(task.id) and task.health_check_results}
+        if not marathon_tasks:
+            raise MetricsProviderNoDataError("Couldn't find any healthy marathon tasks")
+        mesos_tasks = [task for task in all_mesos_tasks if task['id'] in marathon_tasks]
+        autoscale_marathon_instance(config, list(marathon_tasks.values()), mesos_tasks)
+    except Exception as e:
+        write_to_log(config=config, line='Caught Exception %s' % e)
+
+
+def autoscale_services(soa_dir=DEFAULT_SOA_DIR):
+    try:
+        with create_autoscaling_lock():
+            configs = get_autoscaled_configs(soa_dir=soa_dir)
             if configs:
-                marathon_config = load_marathon_config()
-                all_marathon_tasks = get_marathon_client(
-                    url=marathon_config.get_url(),
-                    user=marathon_config.get_username(),
-                    passwd=marathon_config.get_password(),
-                ).list_tasks()
+                all_marathon_tasks = get_all_marathon_tasks()
                 all_mesos_tasks = get_running_tasks_from_active_frameworks('')  # empty string matches all app ids
                 with ZookeeperPool():
                     for config in configs:
-                        try:
-                            job_id = format_job_id(config.service, config.instance)
-                            marathon_tasks = {task.id: task for task in all_marathon_tasks
-                                              if job_id == get_short_job_id(task.id) and task.health_check_results}
-                            if not marathon_tasks:
-                                raise MetricsProviderNoDataError("Couldn't find any healthy marathon tasks")
-                            mesos_tasks = [task for task in all_mesos_tasks if task['id'] in marathon_tasks]
-                            autoscale_marathon_instance(config, list(marathon_tasks.values()), mesos_tasks)
-                        except Exception as e:
-                            write_to_log(config=config, line='Caught Exception %s' % e)
+                        autoscale_service_config(config, all_marathon_tasks, all_mesos_tasks)
     except LockHeldException:
         pass
 
 
+class TaskSnapshot(object):
+    """Keeps the cluster-wide marathon and mesos task lists warm between autoscaler evaluations.
+    The lists are fetched again only once they are older than max_age seconds."""
+
+    def __init__(self, max_age=MIN_AUTOSCALING_INTERVAL):
+        self.max_age = max_age
+        self.fetched_at = None
+        self.marathon_tasks = []
+        self.mesos_tasks = []
+
+    def get(self, now):
+        if self.fetched_at is None or now - self.fetched_at >= self.max_age:
+            self.marathon_tasks = get_all_marathon_tasks()
+            self.mesos_tasks = get_running_tasks_from_active_frameworks('')  # empty string matches all app ids
+            self.fetched_at = now
+        return self.marathon_tasks, self.mesos_tasks
+
+
+def schedule_autoscaled_configs(schedule, configs, old_configs, now):
+    """Adds any newly autoscaled service instances to the schedule heap.
+    New instances are spread out over their interval so a restart or a config
+    reload doesn't evaluate every service at the same moment.
+
+    :param schedule: a heap of (next_run_time, (service, instance)) tuples
+    :param configs: a dict of (service, instance) -> MarathonServiceConfig that should be autoscaled
+    :param old_configs: the dict of configs that was already scheduled
+    :param now: the current time, in seconds since the epoch
+    """
+    for i, key in enumerate(sorted(set(configs) - set(old_configs))):
+        interval = get_autoscaling_interval(configs[key])
+        heapq.heappush(schedule, (now + (i % interval), key))
+
+
+def autoscale_due_services(schedule, configs, snapshot, now, leadership=None):
+    """Evaluates every service instance whose next run time has passed, then
+    reschedules it according to its own interval. Entries for instances that are no
+    longer in configs are dropped. If fetching the task lists fails, the remaining
+    instances stay due.
+
+    :param leadership: if given, an AutoscalingLeadership which is checked before each
+                       service instance, stopping the evaluation as soon as it isn't the leader
+    :returns: the number of service instances that were evaluated"""
+    evaluated = 0
+    while schedule and schedule[0][0] <= now:
+        if leadership is not None and not leadership.is_leader():
+            break
+        key = schedule[0][1]
+        config = configs.get(key)
+        if config is None:
+            heapq.heappop(schedule)
+            continue
+        all_marathon_tasks, all_mesos_tasks = snapshot.get(now)
+        heapq.heappop(schedule)
+        autoscale_service_config(config, all_marathon_tasks, all_mesos_tasks)
+        heapq.heappush(schedule, (now + get_autoscaling_interval(config), key))
+        evaluated += 1
+    return evaluated
+
+
+def get_backoff_delay(failures):
+    """Returns how long to wait after the given number of consecutive failed iterations."""
+    return min(MAX_AUTOSCALING_INTERVAL, MIN_AUTOSCALING_INTERVAL * 2 ** min(failures - 1, MAX_BACKOFF_DOUBLINGS))
+
+
+def autoscale_while_leader(leadership, soa_dir=DEFAULT_SOA_DIR):
+    """Evaluates each autoscaled service instance on its own interval until leadership is lost,
+    pausing while the zookeeper session is suspended. An iteration that fails, for instance
+    because marathon, mesos or the soa configs couldn't be read, is logged and retried after
+    get_backoff_delay rather than ending the loop."""
+    schedule = []
+    configs = {}
+    snapshot = TaskSnapshot()
+    configs_loaded_at = None
+    failures = 0
+    while not leadership.lost:
+        if leadership.suspended:
+            log.warning("Zookeeper connection suspended, pausing autoscaling until it is reconnected")
+            leadership.wait(MIN_AUTOSCALING_INTERVAL)
+            continue
+        now = time.time()
+        try:
+            if configs_loaded_at is None or now - configs_loaded_at >= CONFIG_RELOAD_INTERVAL:
+                new_configs = {(config.service, config.instance): config
+                               for config in get_autoscaled_configs(soa_dir=soa_dir)}
+                schedule_autoscaled_configs(schedule, new_configs, configs, now)
+                configs = new_configs
+                configs_loaded_at = now
+            autoscale_due_services(schedule, configs, snapshot, now, leadership=leadership)
+        except Exception:
+            failures += 1
+            delay = get_backoff_delay(failures)
+            log.exception("Autoscaling failed %d times in a row, retrying in %d seconds", failures, delay)
+            leadership.wait(delay)
+            continue
+        failures = 0
+        next_run = schedule[0][0] if schedule else now + MIN_AUTOSCALING_INTERVAL
+        leadership.wait(max(0, min(next_run, configs_loaded_at + CONFIG_RELOAD_INTERVAL) - time.time()))
+
+
+def autoscale_services_forever(soa_dir=DEFAULT_SOA_DIR):
+    """Runs the autoscaler as a long-lived process. Each autoscaled service instance is
+    evaluated on its own interval, while leadership is held through a single zookeeper
+    lock for as long as the process is connected to zookeeper."""
+    while True:
+        try:
+            with autoscaling_leadership() as leadership:
+                log.info("Acquired autoscaling leadership")
+                with ZookeeperPool():
+                    autoscale_while_leader(leadership, soa_dir=soa_dir)
+            log.warning("Lost autoscaling leadership, waiting to reacquire it")
+        except Exception:
+            log.exception("Failed to hold autoscaling leadership, retrying in %d seconds", MIN_AUTOSCALING_INTERVAL)
+            time.sleep(MIN_AUTOSCALING_INTERVAL)
+
+
 def write_to_log(config, line, level='event'):
     _log(
         service=config.service,
@@ -345,7 +510,7 @@ def create_autoscaling_lock():
     fetching mesos data."""
     zk = KazooClient(hosts=load_system_paasta_config().get_zk_hosts(), timeout=ZK_LOCK_CONNECT_TIMEOUT_S)
     zk.start()
-    lock = zk.Lock('/autoscaling/autoscaling.lock')
+    lock = zk.Lock(AUTOSCALING_LOCK_PATH)
     try:
         lock.acquire(timeout=1)  # timeout=0 throws some other strange exception
         yield
@@ -355,3 +520,51 @@ def create_autoscaling_lock():
         lock.release()
     finally:
         zk.stop()
+
+
+class AutoscalingLeadership(object):
+    """Tracks whether the zookeeper session backing the autoscaling lock is still alive.
+    While it is suspended another host may already hold the lock, so the holder must not
+    autoscale until it is reconnected; once it is lost, so is the lock."""
+
+    def __init__(self):
+        self.lost = False
+        self.suspended = False
+        self.state_changed = threading.Event()
+
+    def listener(self, state):
+        if state == KazooState.LOST:
+            self.lost = True
+        elif state == KazooState.SUSPENDED:
+            self.suspended = True
+        else:
+            self.suspended = False
+        self.state_changed.set()
+
+    def is_leader(self):
+        return not self.lost and not self.suspended
+
+    def wait(self, seconds):
+        """Sleeps for up to seconds, waking up early if the zookeeper connection state changes."""
+        self.state_changed.wait(seconds)
+        self.state_changed.clear()
+
+
+@contextmanager
+def autoscaling_leadership():
+    """Block until the autoscaling lock is acquired and hold it until the context exits.
+    This is the same lock create_autoscaling_lock uses, so the one-shot autoscaler
+    and a long-running one never evaluate services at the same time. If the zookeeper
+    session is suspended or lost, the yielded AutoscalingLeadership says so."""
+    leadership = AutoscalingLeadership()
+    zk = KazooClient(hosts=load_system_paasta_config().get_zk_hosts(), timeout=ZK_LOCK_CONNECT_TIMEOUT_S)
+    zk.start()
+    zk.add_listener(leadership.listener)
+    lock = zk.Lock(AUTOSCALING_LOCK_PATH)
+    try:
+        lock.acquire()
+        yield leadership
+        if not leadership.lost:
+            lock.release()
+    finally:
+        zk.stop()
@@ -16,7 +16,6 @@ import datetime
 import fcntl
 import logging
 import os
-import signal
 import time
 from contextlib import contextmanager
 from contextlib import nested
@@ -30,8 +29,11 @@ from marathon.models import MarathonApp
 from paasta_tools.monitoring.replication_utils import \
     get_registered_marathon_tasks
 from paasta_tools.smartstack_tools import DEFAULT_SYNAPSE_PORT
+from paasta_tools.utils import check_deadline
 from paasta_tools.utils import compose_job_id
 from paasta_tools.utils import load_system_paasta_config
+from paasta_tools.utils import Timeout
+from paasta_tools.utils import TimeoutError
 
 log = logging.getLogger('__main__')
 logging.getLogger("requests").setLevel(logging.WARNING)
@@ -137,18 +139,17 @@ def create_app_lock():
 
 @contextmanager
 def time_limit(minutes):
-    """A contextmanager to raise a TimeoutException whenever a specified
-    number of minutes has passed.
+    """A contextmanager yielding a utils.Timeout of a specified number of minutes,
+    which raises a TimeoutException instead of a TimeoutError once it expires.
+    Code inside it is only bounded if it checks the deadline, as wait_for_create
+    and wait_for_delete do between their calls to marathon.
 
     :param minutes: The number of minutes until an exception is raised"""
-    def signal_handler(signum, frame):
-        raise TimeoutException("Time limit expired")
-    signal.signal(signal.SIGALRM, signal_handler)
-    signal.alarm(minutes * 60)
     try:
-        yield
-    finally:
-        signal.alarm(0)
+        with Timeout(minutes * 60, "Time limit expired") as deadline:
+            yield deadline
+    except TimeoutError as e:
+        raise TimeoutException(e.message)
 
 
 def wait_for_create(app_id, client):
@@ -158,6 +159,7 @@ def wait_for_create(app_id, client):
     :param app_id: The app_id to ensure creation for
     :param client: A MarathonClient object"""
     while marathon_tools.is_app_id_running(app_id, client) is False:
+        check_deadline()
         log.info("Waiting for %s to be created in marathon..", app_id)
         time.sleep(WAIT_CREATE_S)
 
@@ -169,6 +171,8 @@ def create_marathon_app(app_id, config, client):
     :param config: The marathon configuration to be deployed
     :param client: A MarathonClient object"""
     with nested(create_app_lock(), time_limit(1)):
+        # Every marathon call is bounded by the client's own request timeout, and runs
+        # in this thread, so nothing is still changing marathon once the lock is released
         client.create_app(app_id, MarathonApp(**config))
         wait_for_create(app_id, client)
 
@@ -180,6 +184,7 @@ def wait_for_delete(app_id, client):
     :param app_id: The app_id to check for deletion
     :param client: A MarathonClient object"""
     while marathon_tools.is_app_id_running(app_id, client) is True:
+        check_deadline()
         log.info("Waiting for %s to be deleted from marathon...", app_id)
         time.sleep(WAIT_DELETE_S)
 
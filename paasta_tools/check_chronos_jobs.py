@@ -57,13 +57,18 @@ def compose_check_name_for_job(service, instance):
     return 'check-chronos-jobs.%s%s%s' % (service, utils.SPACER, instance)
 
 
-def last_run_state_for_jobs(jobs):
+def last_run_state_for_jobs(jobs, job_index=None):
     """
     Map over a list of jobs to create a pair of (job, LasRunState).
     ``chronos_tools.get_status_last_run`` returns a pair of (time, state), of which
     we only need the latter([-1]).
+
+    :param job_index: the ChronosJobIndex the jobs were listed in, if any
     """
-    return [(chronos_job, chronos_tools.get_status_last_run(chronos_job)[-1]) for chronos_job in jobs]
+    return [
+        (chronos_job, chronos_tools.get_status_last_run(chronos_job, job_index=job_index)[-1])
+        for chronos_job in jobs
+    ]
 
 
 def sensu_event_for_last_run_state(state):
@@ -93,6 +98,8 @@ def build_service_job_mapping(client, configured_jobs):
     where the chronos job is any with a matching (service, instance) in its
     name and disabled == False
     """
+    # list the jobs in chronos once rather than once per configured job
+    job_index = chronos_tools.ChronosJobIndex.from_client(client)
     service_job_mapping = {}
     for job in configured_jobs:
         # find all the jobs belonging to each service
@@ -100,9 +107,10 @@ def build_service_job_mapping(client, configured_jobs):
             service=job[0],
             instance=job[1],
             client=client,
+            job_index=job_index,
         )
         filtered = chronos_tools.filter_non_temporary_chronos_jobs(matching_jobs)
-        with_states = last_run_state_for_jobs(filtered)
+        with_states = last_run_state_for_jobs(filtered, job_index=job_index)
         service_job_mapping[job] = with_states
     return service_job_mapping
 
@@ -20,10 +20,18 @@ run as soon as possible, and only once. If the job being rerun is a
 'dependent job', that is, a job triggered by the successful running of 'parent'
 jobs, then it is cloned without any children attached, and run as a regular
 scheduled job.
+
+With ``--start`` and ``--end`` instead of an execution date, ``chronos_rerun``
+backfills the job: it clones it once for every ``--step`` between the two dates,
+keeping at most ``--max-running`` of its clones waiting or running in Chronos at once,
+and giving up if no clone finishes within ``--max-wait`` seconds.
 """
 import argparse
 import copy
 import datetime
+import re
+import sys
+import time
 
 from paasta_tools import chronos_tools
 from paasta_tools.utils import load_system_paasta_config
@@ -31,6 +39,15 @@ from paasta_tools.utils import NoDeploymentsAvailable
 from paasta_tools.utils import NoDockerImageError
 
 
+DEFAULT_MAX_RUNNING = 5
+DEFAULT_POLL_INTERVAL = 30
+DEFAULT_MAX_WAIT = 6 * 60 * 60
+
+
+class BackfillTimeoutError(Exception):
+    pass
+
+
 def parse_args():
     parser = argparse.ArgumentParser(
         description='',
@@ -41,12 +58,44 @@ def parse_args():
                         default=chronos_tools.DEFAULT_SOA_DIR,
                         help="define a different soa config directory")
     parser.add_argument('service_instance', help='Instance to operate on. Eg: example_service.main')
-    parser.add_argument('execution_date',
+    parser.add_argument('execution_date', nargs='?',
                         help="The date the job should be rerun for. Expected in the format %%Y-%%m-%%dT%%H:%%M:%%S .")
+    parser.add_argument('--start', type=chronos_tools.parse_execution_date,
+                        help="The first date to backfill the job for, in the same format as execution_date")
+    parser.add_argument('--end', type=chronos_tools.parse_execution_date,
+                        help="The last date to backfill the job for, in the same format as execution_date")
+    parser.add_argument('--step', type=parse_step, default=datetime.timedelta(days=1),
+                        help="The time between backfilled dates, like 1d, 6h or 30m. Defaults to 1d")
+    parser.add_argument('--max-running', type=int, default=DEFAULT_MAX_RUNNING, dest='max_running',
+                        help="How many clones may be waiting or running in Chronos at once when backfilling "
+                             "(default %(default)s)")
+    parser.add_argument('--poll-interval', type=int, default=DEFAULT_POLL_INTERVAL, dest='poll_interval',
+                        help="How many seconds to wait between checks of the running clones when backfilling "
+                             "(default %(default)s)")
+    parser.add_argument('--max-wait', type=int, default=DEFAULT_MAX_WAIT, dest='max_wait',
+                        help="How many seconds to wait for one of the running clones to finish before giving up "
+                             "on the backfill (default %(default)s)")
     args = parser.parse_args()
+    if (args.execution_date is None) == (args.start is None or args.end is None):
+        parser.error("specify either an execution_date, or both --start and --end")
+    if args.max_running < 1:
+        parser.error("--max-running must be at least 1")
+    if args.max_wait < 1:
+        parser.error("--max-wait must be at least 1")
     return args
 
 
+def parse_step(step_string):
+    """Parses a step like 1d, 6h, 30m or 45s into a datetime.timedelta.
+    Can be used as an ArgumentParser `type=` hint.
+    """
+    match = re.match(r'^(\d+)([dhms])$', step_string)
+    if not match or int(match.group(1)) == 0:
+        raise argparse.ArgumentTypeError('must be a positive number followed by d, h, m or s, like 1d')
+    unit = {'d': 'days', 'h': 'hours', 'm': 'minutes', 's': 'seconds'}[match.group(2)]
+    return datetime.timedelta(**{unit: int(match.group(1))})
+
+
 def modify_command_for_date(chronos_job, date):
     """
     Given a chronos job config, return a cloned job config where the command
@@ -148,6 +197,66 @@ def clone_job(chronos_job, date):
     return clone
 
 
+def get_backfill_dates(start, end, step):
+    """Returns every date from start to end, inclusive, step apart."""
+    dates = []
+    date = start
+    while date <= end:
+        dates.append(date)
+        date += step
+    return dates
+
+
+def count_unfinished_clones(client, service, instance, clone_names):
+    """Returns how many of the named temporary clones of a job are still waiting to run
+    or running, from a single listing of Chronos. Clones not in clone_names, such as
+    ones left over from earlier reruns, are ignored."""
+    job_index = chronos_tools.ChronosJobIndex.from_client(client)
+    return len([
+        job for job in job_index.get_temporary_jobs(service, instance)
+        if job['name'] in clone_names and
+        job_index.get_record(job).last_run_state == chronos_tools.LastRunState.NotRun
+    ])
+
+
+def backfill(client, complete_job_config, service, instance, dates, max_running=DEFAULT_MAX_RUNNING,
+             poll_interval=DEFAULT_POLL_INTERVAL, max_wait=DEFAULT_MAX_WAIT):
+    """Adds a clone of the job to Chronos for every date, without ever having more than
+    max_running of the clones it added waiting or running at once.
+
+    :param complete_job_config: the job to clone, with its original command
+    :param dates: the execution dates to rerun the job for, in the order to submit them
+    :param max_wait: how many seconds to wait for a clone to finish before giving up
+    :returns: the list of clones that were added
+    :raises BackfillTimeoutError: if no clone finished within max_wait seconds
+    """
+    clones = []
+    pending = list(dates)
+    waiting_since = time.time()
+    while pending:
+        unfinished = count_unfinished_clones(client, service, instance, set(clone['name'] for clone in clones))
+        slots = max_running - unfinished
+        if slots > 0:
+            for date in pending[:slots]:
+                clone = clone_job(complete_job_config, date)
+                client.add(clone)
+                clones.append(clone)
+                print "Submitted %s for %s (%d/%d)" % (
+                    clone['name'], date.strftime(chronos_tools.EXECUTION_DATE_FORMAT), len(clones), len(dates))
+            pending = pending[slots:]
+            waiting_since = time.time()
+        elif time.time() - waiting_since >= max_wait:
+            raise BackfillTimeoutError(
+                "None of the %d unfinished clones of %s finished within %d seconds (%d/%d submitted)" % (
+                    unfinished, chronos_tools.compose_job_id(service, instance), max_wait, len(clones), len(dates)))
+        else:
+            print "Waiting for %d unfinished clones of %s (%d/%d submitted)" % (
+                unfinished, chronos_tools.compose_job_id(service, instance), len(clones), len(dates))
+        if pending:
+            time.sleep(poll_interval)
+    return clones
+
+
 def main():
     args = parse_args()
 
@@ -190,8 +299,24 @@ def main():
     # re rendered
     original_command = chronos_job_config.get_cmd()
     complete_job_config['command'] = original_command
-    clone = clone_job(complete_job_config, datetime.datetime.strptime(args.execution_date, "%Y-%m-%dT%H:%M:%S"))
-    client.add(clone)
+    if args.execution_date is None:
+        try:
+            backfill(
+                client=client,
+                complete_job_config=complete_job_config,
+                service=service,
+                instance=instance,
+                dates=get_backfill_dates(args.start, args.end, args.step),
+                max_running=args.max_running,
+                poll_interval=args.poll_interval,
+                max_wait=args.max_wait,
+            )
+        except BackfillTimeoutError as e:
+            print >>sys.stderr, str(e)
+            sys.exit(1)
+    else:
+        clone = clone_job(complete_job_config, datetime.datetime.strptime(args.execution_date, "%Y-%m-%dT%H:%M:%S"))
+        client.add(clone)
 
 
 if __name__ == "__main__":
@@ -12,22 +12,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import argparse
+import calendar
 import datetime
 import json
 import logging
 import os
 import re
 import urlparse
+from collections import namedtuple
 from time import sleep
 
 import chronos
-import dateutil
 import isodate
 import monitoring_tools
 import service_configuration_lib
 from tron import command_context
+from tron.utils import timeutils
 
 from paasta_tools.mesos_tools import get_mesos_network_for_net
+from paasta_tools.utils import check_deadline
 from paasta_tools.utils import DEFAULT_SOA_DIR
 from paasta_tools.utils import get_config_hash
 from paasta_tools.utils import get_docker_url
@@ -62,6 +65,8 @@ TMP_JOB_IDENTIFIER = "tmp"
 VALID_BOUNCE_METHODS = ['graceful']
 PATH_TO_CHRONOS_CONFIG = os.path.join(PATH_TO_SYSTEM_PAASTA_CONFIG_DIR, 'chronos.json')
 EXECUTION_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+# The format of the lastSuccess and lastError of jobs returned by the chronos API
+CHRONOS_TIMESTAMP_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?Z$')
 log = logging.getLogger('__main__')
 
 
@@ -377,7 +382,12 @@ class ChronosJobConfig(InstanceConfig):
         else:
             return False, 'Your Chronos config specifies "%s", an unsupported parameter.' % param
 
-    def format_chronos_job_dict(self, docker_url, docker_volumes, dockercfg_location):
+    def format_chronos_job_dict(self, docker_url, docker_volumes, dockercfg_location, job_graph=None):
+        """Builds the dict describing this job to the Chronos API.
+
+        :param job_graph: an optional ChronosJobGraph to resolve the names of parent jobs from,
+        instead of listing Chronos once per parent
+        """
         valid, error_msgs = self.validate()
         if not valid:
             raise InvalidChronosConfigError("\n".join(error_msgs))
@@ -414,12 +424,17 @@ class ChronosJobConfig(InstanceConfig):
         if self.get_schedule() is not None:
             complete_config['schedule'] = self.get_schedule()
         else:
-            matching_parent_pairs = [(parent, get_job_for_service_instance(*parent.split(".")))
-                                     for parent in self.get_parents()]
+            if job_graph is not None:
+                matching_parent_pairs = [(parent, job_graph.resolve_parent(parent)) for parent in self.get_parents()]
+            else:
+                matching_parent_pairs = [(parent, get_job_for_service_instance(*parent.split(".")))
+                                         for parent in self.get_parents()]
+                matching_parent_pairs = [(parent, job['name'] if job is not None else None)
+                                         for parent, job in matching_parent_pairs]
             for parent_pair in matching_parent_pairs:
                 if parent_pair[1] is None:
                     raise InvalidParentError("%s has no matching jobs in Chronos" % parent_pair[0])
-            complete_config['parents'] = [parent_pair[1]['name'] for parent_pair in matching_parent_pairs]
+            complete_config['parents'] = [parent_pair[1] for parent_pair in matching_parent_pairs]
         return complete_config
 
     # 'docker job' requirements: https://mesos.github.io/chronos/docs/api.html#adding-a-docker-job
@@ -469,8 +484,11 @@ def get_chronos_jobs_for_cluster(cluster=None, soa_dir=DEFAULT_SOA_DIR):
     return get_services_for_cluster(cluster, 'chronos', soa_dir)
 
 
-def create_complete_config(service, job_name, soa_dir=DEFAULT_SOA_DIR):
-    """Generates a complete dictionary to be POST'ed to create a job on Chronos"""
+def create_complete_config(service, job_name, soa_dir=DEFAULT_SOA_DIR, job_graph=None):
+    """Generates a complete dictionary to be POST'ed to create a job on Chronos
+
+    :param job_graph: an optional ChronosJobGraph to resolve the names of parent jobs from
+    """
     system_paasta_config = load_system_paasta_config()
     chronos_job_config = load_chronos_job_config(
         service, job_name, system_paasta_config.get_cluster(), soa_dir=soa_dir)
@@ -482,6 +500,7 @@ def create_complete_config(service, job_name, soa_dir=DEFAULT_SOA_DIR):
         docker_url,
         docker_volumes,
         system_paasta_config.get_dockercfg_location(),
+        job_graph=job_graph,
     )
 
     complete_config['name'] = compose_job_id(service, job_name)
@@ -530,46 +549,6 @@ def determine_disabled_state(branch_state, soa_disabled_state):
         return soa_disabled_state
 
 
-def _safe_parse_datetime(dt):
-    """
-    Parse a datetime, swallowing exceptions.
-
-    :param dt: A string containing a datetime
-    :returns: A datetime.datetime object representing ``dt``. If a datetime
-    string is unparseable, it is represented as a datetime.datetime set to the
-    epoch in UTC (i.e. a value which will never be the most recent).
-    """
-    epoch = datetime.datetime(1970, 1, 1, tzinfo=dateutil.tz.tzutc())
-    try:
-        parsed_dt = isodate.parse_datetime(dt)
-    # I tried to limit this to isodate.ISO8601Error but parse_datetime() can
-    # also throw "AttributeError: 'NoneType' object has no attribute 'split'",
-    # and presumably other exceptions.
-    except Exception as exc:
-        log.debug("Failed to parse datetime '%s'" % dt)
-        log.debug(exc)
-        parsed_dt = epoch
-    return parsed_dt
-
-
-def cmp_datetimes(first, second):
-    """Compare two datetime strings and sort by most recent.
-
-    :param first: A string containing a datetime
-    :param second: A string containing a datetime
-    :returns: -1 if ``first`` is more recent, 1 if ``second`` is more recent, or 0
-    if they are equivalent.
-    """
-    parsed_first = _safe_parse_datetime(first)
-    parsed_second = _safe_parse_datetime(second)
-    if parsed_first > parsed_second:
-        return -1
-    elif parsed_first == parsed_second:
-        return 0
-    else:
-        return 1
-
-
 def filter_enabled_jobs(jobs):
     """Given a list of chronos jobs, find those which are not disabled"""
     return [job for job in jobs if job['disabled'] is False]
@@ -591,23 +570,87 @@ def last_failure_for_job(job):
     return job.get('lastError', None)
 
 
-def get_status_last_run(job):
+# The summary of a job's runs that sorting and status checks need, parsed once
+# from the job dict. ``last_success`` and ``last_failure`` are epoch seconds, or
+# None if the job has no such run or its timestamp can't be parsed.
+ChronosJobRecord = namedtuple('ChronosJobRecord', [
+    'name',
+    'last_success',
+    'last_failure',
+    'last_run_time',
+    'last_run_state',
+    'sort_key',
+])
+
+
+def parse_chronos_timestamp(timestamp):
+    """Parse a timestamp from the chronos API into epoch seconds.
+
+    Chronos reports times like ``2015-10-14T19:02:31.085Z``, which are parsed
+    without isodate; anything else falls back to ``isodate.parse_datetime``,
+    with naive datetimes taken to be in UTC.
+
+    :param timestamp: a string containing an ISO 8601 datetime
+    :returns: the timestamp in epoch seconds, or None if it can't be parsed
     """
-    Return the time of the last run of a job and the appropriate LastRunState.
+    match = CHRONOS_TIMESTAMP_RE.match(timestamp) if isinstance(timestamp, basestring) else None
+    if match is not None:
+        year, month, day, hour, minute, second, fraction = match.groups()
+        epoch = calendar.timegm((int(year), int(month), int(day), int(hour), int(minute), int(second)))
+        # isodate keeps microsecond precision
+        return epoch + (int(fraction[:6].ljust(6, '0')) / 1000000.0 if fraction else 0)
+    try:
+        parsed_dt = isodate.parse_datetime(timestamp)
+    except Exception as exc:
+        log.debug("Failed to parse datetime '%s'" % timestamp)
+        log.debug(exc)
+        return None
+    return calendar.timegm(parsed_dt.utctimetuple()) + parsed_dt.microsecond / 1000000.0
+
+
+def parse_chronos_job(job):
+    """Summarize a job's last runs into a ChronosJobRecord.
+
+    A success wins a tie with a failure, and unparseable timestamps count as the epoch.
+
+    :param job: a job dict, as returned by the chronos client
+    :returns: a ChronosJobRecord
     """
-    last_success = last_success_for_job(job)
-    last_failure = last_failure_for_job(job)
-    if not last_success and not last_failure:
-        return (None, LastRunState.NotRun)
-    elif not last_failure:
-        return (last_success, LastRunState.Success)
-    elif not last_success:
-        return (last_failure, LastRunState.Fail)
+    last_success_time = last_success_for_job(job)
+    last_failure_time = last_failure_for_job(job)
+    last_success = parse_chronos_timestamp(last_success_time) if last_success_time else None
+    last_failure = parse_chronos_timestamp(last_failure_time) if last_failure_time else None
+    success_key = last_success or 0
+    failure_key = last_failure or 0
+    if not last_success_time and not last_failure_time:
+        last_run_time, last_run_state = None, LastRunState.NotRun
+    elif not last_failure_time:
+        last_run_time, last_run_state = last_success_time, LastRunState.Success
+    elif not last_success_time:
+        last_run_time, last_run_state = last_failure_time, LastRunState.Fail
+    elif success_key >= failure_key:
+        last_run_time, last_run_state = last_success_time, LastRunState.Success
     else:
-        if cmp_datetimes(last_success, last_failure) <= 0:
-            return (last_success, LastRunState.Success)
-        else:
-            return (last_failure, LastRunState.Fail)
+        last_run_time, last_run_state = last_failure_time, LastRunState.Fail
+    return ChronosJobRecord(
+        name=job.get('name'),
+        last_success=last_success,
+        last_failure=last_failure,
+        last_run_time=last_run_time,
+        last_run_state=last_run_state,
+        sort_key=max(success_key, failure_key),
+    )
+
+
+def get_status_last_run(job, job_index=None):
+    """
+    Return the time of the last run of a job and the appropriate LastRunState.
+
+    :param job: a job dict, as returned by the chronos client
+    :param job_index: a ChronosJobIndex the job was listed in, to reuse its parsed records
+    """
+    record = job_index.get_record(job) if job_index is not None else parse_chronos_job(job)
+    return (record.last_run_time, record.last_run_state)
 
 
 def get_job_type(job):
@@ -620,35 +663,170 @@ def get_job_type(job):
         raise ValueError('Expected either schedule field or parents field')
 
 
-def sort_jobs(jobs):
+def sort_jobs(jobs, job_index=None):
     """Takes a list of chronos jobs and returns a sorted list where the job
     with the most recent result is first.
 
     :param jobs: list of dicts of job configuration, as returned by the chronos client
+    :param job_index: a ChronosJobIndex the jobs were listed in, to reuse its parsed records
     """
-    def get_key(job):
-        failure = last_failure_for_job(job)
-        success = last_success_for_job(job)
-        newest = failure if cmp_datetimes(failure, success) < 0 else success
-        return _safe_parse_datetime(newest)
-
+    get_record = job_index.get_record if job_index is not None else parse_chronos_job
     return sorted(
         jobs,
-        key=get_key,
+        key=lambda job: get_record(job).sort_key,
         reverse=True,
     )
 
 
-def lookup_chronos_jobs(client, service=None, instance=None, include_disabled=False):
+class ChronosJobIndex(object):
+    """The jobs from a single listing of Chronos, indexed by the (service, instance)
+    decomposed from their names. Lets callers that look up many service instances
+    share one ``client.list()``, which downloads every job in Chronos, and parses
+    the runs of every job into a ChronosJobRecord once.
+
+    :param jobs: a list of jobs, as returned by ``client.list()``
+    """
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.jobs_by_service_instance = {}
+        self.temporary_jobs_by_service_instance = {}
+        self.records_by_name = {}
+        for job in jobs:
+            self.records_by_name[job['name']] = parse_chronos_job(job)
+            try:
+                service_instance = decompose_job_id(job['name'])
+            except InvalidJobNameError:
+                continue
+            self.jobs_by_service_instance.setdefault(service_instance, []).append(job)
+            if job['name'].startswith(TMP_JOB_IDENTIFIER):
+                self.temporary_jobs_by_service_instance.setdefault(service_instance, []).append(job)
+
+    @classmethod
+    def from_client(cls, client):
+        return cls(client.list())
+
+    def lookup(self, service=None, instance=None, include_disabled=False):
+        """Equivalent to ``filter_chronos_jobs()`` over the indexed jobs."""
+        if service is None or instance is None:
+            return filter_chronos_jobs(
+                jobs=self.jobs,
+                service=service,
+                instance=instance,
+                include_disabled=include_disabled,
+            )
+        return [
+            job for job in self.jobs_by_service_instance.get((service, instance), [])
+            if include_disabled or not job['disabled']
+        ]
+
+    def get_temporary_jobs(self, service, instance):
+        return list(self.temporary_jobs_by_service_instance.get((service, instance), []))
+
+    def get_record(self, job):
+        """Returns the ChronosJobRecord of a job, parsing it if it isn't in the index."""
+        record = self.records_by_name.get(job['name'])
+        if record is None:
+            record = parse_chronos_job(job)
+        return record
+
+
+class ChronosJobGraph(object):
+    """The chronos jobs configured for a cluster and the configured jobs each of them
+    depends on, together with a ChronosJobIndex of what is already in Chronos.
+
+    :param parents: a dict of (service, instance) to the list of (service, instance)
+    parents of every job configured for the cluster
+    :param job_index: a ChronosJobIndex of the jobs in Chronos
+    """
+
+    def __init__(self, parents, job_index):
+        self.parents = parents
+        self.job_index = job_index
+
+    @classmethod
+    def load(cls, client, cluster, soa_dir=DEFAULT_SOA_DIR):
+        """Builds the graph from soa-configs and a single listing of the jobs in Chronos."""
+        parents = {}
+        service_chronos_jobs = {}
+        for service, instance in get_chronos_jobs_for_cluster(cluster, soa_dir=soa_dir):
+            if service not in service_chronos_jobs:
+                service_chronos_jobs[service] = read_chronos_jobs_for_service(service, cluster, soa_dir=soa_dir)
+            job_config = ChronosJobConfig(
+                service=service,
+                cluster=cluster,
+                instance=instance,
+                config_dict=service_chronos_jobs[service].get(instance, {}),
+                branch_dict={},
+            )
+            # as in format_chronos_job_dict, parents only count for jobs without a schedule
+            if job_config.get_schedule() is None:
+                parents[(service, instance)] = [
+                    tuple(parent.split('.')) for parent in job_config.get_parents() or []
+                    if check_parent_format(parent)
+                ]
+            else:
+                parents[(service, instance)] = []
+        return cls(parents, ChronosJobIndex.from_client(client))
+
+    def resolve_parent(self, parent):
+        """Returns the name of the chronos job for a service.instance parent, or None if there is none.
+
+        A parent that is configured for the cluster but isn't in Chronos yet resolves to
+        the name it will be created with, so it has to be deployed before its children.
+        """
+        service, instance = parent.split('.')
+        matching_jobs = sort_jobs(
+            self.job_index.lookup(service=service, instance=instance, include_disabled=True),
+            job_index=self.job_index,
+        )
+        if len(matching_jobs) > 0:
+            return matching_jobs[0]['name']
+        if (service, instance) in self.parents:
+            return compose_job_id(service, instance)
+        return None
+
+    def topological_levels(self):
+        """Groups the configured jobs into a list of levels, each of which only depends on
+        jobs in the levels before it. Jobs in a dependency cycle make up the last level.
+
+        :returns: a list of sorted lists of (service, instance) tuples
+        """
+        remaining = dict(
+            (service_instance, set(parent for parent in parents
+                                   if parent in self.parents and parent != service_instance))
+            for service_instance, parents in self.parents.items()
+        )
+        levels = []
+        while remaining:
+            level = sorted(service_instance for service_instance, parents in remaining.items() if not parents)
+            if not level:
+                log.warning("Chronos jobs have a dependency cycle: %s" % ', '.join(
+                    compose_job_id(*service_instance) for service_instance in sorted(remaining)))
+                levels.append(sorted(remaining))
+                break
+            levels.append(level)
+            for service_instance in level:
+                del remaining[service_instance]
+            for parents in remaining.values():
+                parents.difference_update(level)
+        return levels
+
+
+def lookup_chronos_jobs(client, service=None, instance=None, include_disabled=False, job_index=None):
     """Discovers Chronos jobs and filters them with ``filter_chronos_jobs()``.
 
     :param client: Chronos client object
     :param service: passed on to ``filter_chronos_jobs()``
     :param instance: passed on to ``filter_chronos_jobs()``
     :param include_disabled: passed on to ``filter_chronos_jobs()``
+    :param job_index: an optional ChronosJobIndex to answer from instead of listing
+    the jobs with ``client``
     :returns: list of job dicts discovered by ``client`` and filtered by
     ``filter_chronos_jobs()`` using the other parameters
     """
+    if job_index is not None:
+        return job_index.lookup(service=service, instance=instance, include_disabled=include_disabled)
     jobs = client.list()
     return filter_chronos_jobs(
         jobs=jobs,
@@ -707,6 +885,7 @@ def wait_for_job(client, job_name):
     """
     found = False
     while not found:
+        check_deadline()
         found = job_name in [job['name'] for job in client.list()]
         if found:
             return True
@@ -729,6 +908,103 @@ def parse_execution_date(execution_date_string):
     return parsed
 
 
+# A single % format specifier, e.g. %(shortdate-1)s or %%
+FORMAT_SPECIFIER_RE = re.compile(r'%(?:\(([^()]*)\))?[#0\- +]*(?:\d+)?(?:\.\d+)?[hlL]?([diouxXeEfFgGcrs%])')
+# Date arithmetic whose value changes within a minute, so can't be cached per minute
+SUB_MINUTE_TIME_VARIABLES = ('unixtime',)
+MAX_CACHED_TIME_VARIABLE_TEMPLATES = 4096
+
+
+def render_time_variables_with_tron(input_string, parse_time):
+    """Replaces the time variables in input_string using a tron context, as tron does."""
+    # We build up a tron context object that has the right
+    # methods to parse tron-style time syntax
+    job_context = command_context.JobRunContext(command_context.CommandContext())
+    # The tron context object needs the run_time attibute set so it knows
+    # how to interpret the date strings
+    job_context.job_run.run_time = parse_time
+    # The job_context object works like a normal dictionary for string replacement
+    return input_string % job_context
+
+
+def changes_within_a_minute(name):
+    match = timeutils.DateArithmetic.DATE_TYPE_PATTERN.match(name)
+    return match is not None and match.group(1) in SUB_MINUTE_TIME_VARIABLES
+
+
+class TimeVariableTemplate(object):
+    """A string compiled for repeated rendering of its tron-style time variables.
+
+    names is the set of time variables the string uses, or None if the string uses
+    % formatting that only a tron context renders correctly, like a specifier without
+    a variable name. Strings without a % are returned untouched, and renders are cached
+    for the minute of the parse time unless the string uses a variable that changes
+    within a minute.
+    """
+
+    def __init__(self, input_string):
+        self.input_string = input_string
+        self.names = self.find_names(input_string)
+        self.cacheable = self.names is not None and not any(
+            changes_within_a_minute(name) for name in self.names)
+        # (minute, output) of the last render
+        self.cached = (None, None)
+
+    @staticmethod
+    def find_names(input_string):
+        names = set()
+        position = input_string.find('%')
+        while position != -1:
+            match = FORMAT_SPECIFIER_RE.match(input_string, position)
+            if match is None:
+                return None
+            name, conversion = match.groups()
+            if name is None and conversion != '%':
+                return None
+            if name is not None:
+                names.add(name)
+            position = input_string.find('%', match.end())
+        return frozenset(names)
+
+    def render(self, parse_time):
+        if '%' not in self.input_string:
+            return self.input_string
+        if self.names is None:
+            return render_time_variables_with_tron(self.input_string, parse_time)
+        # the wall clock minute, as aware datetimes in different timezones can compare equal
+        minute = parse_time.timetuple()[:5]
+        cached_minute, cached_output = self.cached
+        if self.cacheable and cached_minute == minute:
+            return cached_output
+        try:
+            values = {}
+            for name in self.names:
+                value = timeutils.DateArithmetic.parse(name, parse_time)
+                if not value:
+                    raise KeyError(name)
+                values[name] = value
+            output = self.input_string % values
+        except Exception:
+            # Let tron raise whichever error it would have raised first
+            return render_time_variables_with_tron(self.input_string, parse_time)
+        if self.cacheable:
+            self.cached = (minute, output)
+        return output
+
+
+_time_variable_templates = {}
+
+
+def compile_time_variables(input_string):
+    """Returns the TimeVariableTemplate for input_string, compiling it the first time it is seen."""
+    template = _time_variable_templates.get(input_string)
+    if template is None:
+        if len(_time_variable_templates) >= MAX_CACHED_TIME_VARIABLE_TEMPLATES:
+            _time_variable_templates.clear()
+        template = _time_variable_templates[input_string] = TimeVariableTemplate(input_string)
+    return template
+
+
 def parse_time_variables(input_string, parse_time=None):
     """Parses an input string and uses the Tron-style dateparsing
     to replace time variables. Currently supports only the date/time
@@ -741,14 +1017,7 @@ def parse_time_variables(input_string, parse_time=None):
     """
     if parse_time is None:
         parse_time = datetime.datetime.now()
-    # We build up a tron context object that has the right
-    # methods to parse tron-style time syntax
-    job_context = command_context.JobRunContext(command_context.CommandContext())
-    # The tron context object needs the run_time attibute set so it knows
-    # how to interpret the date strings
-    job_context.job_run.run_time = parse_time
-    # The job_context object works like a normal dictionary for string replacement
-    return input_string % job_context
+    return compile_time_variables(input_string).render(parse_time)
 
 
 def uses_time_variables(chronos_job):
@@ -813,10 +1082,15 @@ def compose_check_name_for_service_instance(check_name, service, instance):
     return '%s.%s%s%s' % (check_name, service, INTERNAL_SPACER, instance)
 
 
-def get_temporary_jobs_for_service_instance(client, service, instance):
+def get_temporary_jobs_for_service_instance(client, service, instance, job_index=None):
     """ Given a service and instance, find any temporary jobs
     for that job, as created by chronos_rerun.
+
+    :param job_index: an optional ChronosJobIndex to answer from instead of listing
+    the jobs with ``client``
     """
+    if job_index is not None:
+        return job_index.get_temporary_jobs(service, instance)
     temporary_jobs = []
     all_jobs = lookup_chronos_jobs(
         client=client,
@@ -24,24 +24,38 @@ If a job is deployed by chronos but not in the expected list, it is deleted.
 Any tasks associated with that job are also deleted.
 
 - -d <SOA_DIR>, --soa-dir <SOA_DIR>: Specify a SOA config dir to read from
+- -n, --dry-run: Only report which jobs would be removed and how long each phase took
+- -w <WORKERS>, --workers <WORKERS>: How many Chronos API calls to make at once
 """
 import argparse
+import calendar
 import datetime
 import sys
+import time
+from contextlib import contextmanager
 
-import dateutil.parser
+import dateutil.tz
 import pysensu_yelp
+from concurrent import futures
 
 from paasta_tools import chronos_tools
 from paasta_tools.check_chronos_jobs import send_event
 from paasta_tools.utils import InvalidJobNameError
 
 
+DEFAULT_CLEANUP_WORKERS = 8
+TMP_JOB_MAX_AGE = datetime.timedelta(days=1)
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description='Cleans up stale chronos jobs.')
     parser.add_argument('-d', '--soa-dir', dest="soa_dir", metavar="SOA_DIR",
                         default=chronos_tools.DEFAULT_SOA_DIR,
                         help="define a different soa config directory")
+    parser.add_argument('-n', '--dry-run', action='store_true', dest='dry_run', default=False,
+                        help="only report what would be removed and how long each phase took")
+    parser.add_argument('-w', '--workers', dest='workers', type=int, default=DEFAULT_CLEANUP_WORKERS,
+                        help="how many chronos api calls to make at once (default %(default)s)")
     args = parser.parse_args()
     return args
 
@@ -67,14 +81,30 @@ def execute_chronos_api_call_for_job(api_call, job):
         return e
 
 
-def cleanup_jobs(client, jobs):
+def execute_chronos_api_calls_for_jobs(api_call, jobs, max_workers=DEFAULT_CLEANUP_WORKERS):
+    """Calls ``execute_chronos_api_call_for_job`` for each job, with at most max_workers calls in flight.
+
+    :returns: a list of (job, response or exception) tuples in the order of jobs
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return []
+    executor = futures.ThreadPoolExecutor(max_workers=min(max_workers, len(jobs)))
+    try:
+        responses = list(executor.map(lambda job: execute_chronos_api_call_for_job(api_call, job), jobs))
+    finally:
+        executor.shutdown(wait=True)
+    return zip(jobs, responses)
+
+
+def cleanup_jobs(client, jobs, max_workers=DEFAULT_CLEANUP_WORKERS):
     """Maps a list of jobs to cleanup to a list of response objects (or exception objects) from the api"""
-    return [(job, execute_chronos_api_call_for_job(client.delete, job)) for job in jobs]
+    return execute_chronos_api_calls_for_jobs(client.delete, jobs, max_workers)
 
 
-def cleanup_tasks(client, jobs):
+def cleanup_tasks(client, jobs, max_workers=DEFAULT_CLEANUP_WORKERS):
     """Maps a list of tasks to cleanup to a list of response objects (or exception objects) from the api"""
-    return [(job, execute_chronos_api_call_for_job(client.delete_tasks, job)) for job in jobs]
+    return execute_chronos_api_calls_for_jobs(client.delete_tasks, jobs, max_workers)
 
 
 def format_list_output(title, job_names):
@@ -110,7 +140,7 @@ def filter_tmp_jobs(job_names):
     return [name for name in job_names if name.startswith(chronos_tools.TMP_JOB_IDENTIFIER)]
 
 
-def filter_expired_tmp_jobs(client, job_names):
+def filter_expired_tmp_jobs(client, job_names, job_index=None, now=None):
     """
     Given a list of temporary jobs, find those ready to be removed. Their
     suitablity for removal is defined by two things:
@@ -118,25 +148,44 @@ def filter_expired_tmp_jobs(client, job_names):
         - the job has completed (irrespective of whether it was a success or
           failure)
         - the job completed more than 24 hours ago
+
+    :param job_index: a ChronosJobIndex to find the jobs in; lists the jobs with client if not given
+    :param now: the time to measure the age of the jobs from; defaults to the current time
     """
+    if job_index is None:
+        job_index = chronos_tools.ChronosJobIndex.from_client(client)
+    if now is None:
+        now = datetime.datetime.now(dateutil.tz.tzutc())
+    cutoff = calendar.timegm((now - TMP_JOB_MAX_AGE).utctimetuple())
+    job_names = set(job_names)
     expired = []
-    for job_name in job_names:
-        service, instance = chronos_tools.decompose_job_id(job_name)
-        temporary_jobs = chronos_tools.get_temporary_jobs_for_service_instance(
-            client=client,
-            service=service,
-            instance=instance
-        )
-        for job in temporary_jobs:
-            last_run_time, last_run_state = chronos_tools.get_status_last_run(job)
-            if last_run_state != chronos_tools.LastRunState.NotRun:
-                if ((datetime.datetime.now(dateutil.tz.tzutc()) -
-                     dateutil.parser.parse(last_run_time)) >
-                        datetime.timedelta(days=1)):
-                    expired.append(job_name)
+    for job in job_index.jobs:
+        if job['name'] in job_names:
+            record = job_index.get_record(job)
+            if record.last_run_state == chronos_tools.LastRunState.Success:
+                last_run = record.last_success
+            elif record.last_run_state == chronos_tools.LastRunState.Fail:
+                last_run = record.last_failure
+            else:
+                continue
+            # a job whose last run can't be parsed isn't known to be old enough
+            if last_run is not None and last_run < cutoff:
+                expired.append(job['name'])
     return expired
 
 
+@contextmanager
+def timed_phase(timings, phase):
+    """Appends (phase, seconds taken) to timings once the block has run."""
+    start = time.time()
+    yield
+    timings.append((phase, time.time() - start))
+
+
+def format_timings_output(timings):
+    return format_list_output('Phase timings:', ['%s: %.3fs' % timing for timing in timings])
+
+
 def main():
 
     args = parse_args()
@@ -144,19 +193,33 @@ def main():
 
     config = chronos_tools.load_chronos_config()
     client = chronos_tools.get_chronos_client(config)
+    timings = []
 
-    running_jobs = set(deployed_job_names(client))
+    with timed_phase(timings, 'list jobs'):
+        job_index = chronos_tools.ChronosJobIndex.from_client(client)
+    running_jobs = set(job['name'] for job in job_index.jobs)
 
-    expected_service_jobs = set([chronos_tools.compose_job_id(*job) for job in
-                                 chronos_tools.get_chronos_jobs_for_cluster(soa_dir=args.soa_dir)])
+    with timed_phase(timings, 'read soa configs'):
+        expected_service_jobs = set([chronos_tools.compose_job_id(*job) for job in
+                                     chronos_tools.get_chronos_jobs_for_cluster(soa_dir=args.soa_dir)])
 
-    all_tmp_jobs = set(filter_tmp_jobs(filter_paasta_jobs(running_jobs)))
-    expired_tmp_jobs = set(filter_expired_tmp_jobs(client, all_tmp_jobs))
+    with timed_phase(timings, 'find expired temporary jobs'):
+        all_tmp_jobs = set(filter_tmp_jobs(filter_paasta_jobs(running_jobs)))
+        expired_tmp_jobs = set(filter_expired_tmp_jobs(client, all_tmp_jobs, job_index=job_index))
     valid_tmp_jobs = all_tmp_jobs - expired_tmp_jobs
 
-    to_delete = running_jobs - expected_service_jobs - valid_tmp_jobs
+    to_delete = sorted(running_jobs - expected_service_jobs - valid_tmp_jobs)
+
+    if args.dry_run:
+        if len(to_delete) == 0:
+            print 'No Chronos Jobs to remove'
+        else:
+            print format_list_output("Would Remove Jobs and their Tasks:", to_delete)
+        print format_timings_output(timings)
+        return
 
-    task_responses = cleanup_tasks(client, to_delete)
+    with timed_phase(timings, 'delete tasks'):
+        task_responses = cleanup_tasks(client, to_delete, max_workers=args.workers)
     task_successes = []
     task_failures = []
     for response in task_responses:
@@ -165,7 +228,8 @@ def main():
         else:
             task_successes.append(response)
 
-    job_responses = cleanup_jobs(client, to_delete)
+    with timed_phase(timings, 'delete jobs'):
+        job_responses = cleanup_jobs(client, to_delete, max_workers=args.workers)
     job_successes = []
     job_failures = []
     for response in job_responses:
@@ -17,7 +17,7 @@ from paasta_tools.cli.utils import list_services
 from paasta_tools.cli.utils import PaastaColors
 from paasta_tools.cli.utils import validate_service_name
 from paasta_tools.generate_deployments_for_service import get_latest_deployment_tag
-from paasta_tools.remote_git import list_remote_refs
+from paasta_tools.remote_git import list_remote_paasta_refs
 from paasta_tools.utils import DEFAULT_SOA_DIR
 from paasta_tools.utils import get_git_url
 
@@ -56,7 +56,7 @@ def paasta_get_latest_deployment(args):
         service=service,
         soa_dir=soa_dir,
     )
-    remote_refs = list_remote_refs(git_url)
+    remote_refs = list_remote_paasta_refs(git_url)
 
     _, git_sha = get_latest_deployment_tag(remote_refs, deploy_group)
     if not git_sha:
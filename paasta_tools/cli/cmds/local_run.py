@@ -95,12 +95,12 @@ def perform_http_healthcheck(url, timeout):
     :returns: True if healthcheck succeeds within number of seconds specified by timeout, false otherwise
     """
     try:
-        with Timeout(seconds=timeout):
+        with Timeout(seconds=timeout) as deadline:
             try:
-                res = requests.head(url)
+                res = requests.head(url, timeout=deadline.remaining())
             except requests.ConnectionError:
                 return (False, "http request failed: connection failed")
-    except TimeoutError:
+    except (TimeoutError, requests.Timeout):
         return (False, "http request timed out after %d seconds" % timeout)
 
     if 'content-type' in res.headers and ',' in res.headers['content-type']:
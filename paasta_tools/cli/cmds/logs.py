@@ -14,16 +14,22 @@
 # limitations under the License.
 """PaaSTA log reader for humans"""
 import argparse
+import collections
 import datetime
+import glob
+import heapq
+import itertools
 import json
 import logging
+import os
 import re
 import sys
 from multiprocessing import Process
 from multiprocessing import Queue
 from Queue import Empty
 
-import dateutil
+import dateutil.parser
+import dateutil.tz
 import isodate
 
 try:
@@ -39,6 +45,7 @@ from paasta_tools.cli.utils import guess_service_name
 from paasta_tools.cli.utils import lazy_choices_completer
 from paasta_tools.cli.utils import list_services
 from paasta_tools.utils import ANY_CLUSTER
+from paasta_tools.utils import ANY_INSTANCE
 from paasta_tools.utils import datetime_convert_timezone
 from paasta_tools.utils import datetime_from_utc_to_local
 from paasta_tools.utils import DEFAULT_LOGLEVEL
@@ -82,8 +89,22 @@ def add_subparser(subparsers):
         help=cluster_help,
     ).completer = completer_clusters
     status_parser.add_argument(
-        '-f', '-F', '--tail', dest='tail', action='store_true', default=True,
-        help='Stream the logs and follow it for more data',
+        '-f', '-F', '--tail', dest='tail', action='store_true', default=False,
+        help='Stream the logs and follow it for more data. This is the default unless --since, --until or '
+             '--lines is given',
+    )
+    status_parser.add_argument(
+        '--since', type=parse_time_arg, default=None,
+        help='Print the logs from this time on, instead of tailing them. Either a timestamp like '
+             '"2016-01-31 13:00" (local time unless it has a timezone) or a duration ago like 30m, 2h or 1d',
+    )
+    status_parser.add_argument(
+        '--until', type=parse_time_arg, default=None,
+        help='Print the logs from before this time, instead of tailing them. Takes the same formats as --since',
+    )
+    status_parser.add_argument(
+        '-n', '--lines', type=int, default=None,
+        help='Print only the last LINES matching log lines, instead of tailing them',
     )
     status_parser.add_argument(
         '-v', '--verbose', action='store_true', dest='verbose', default=False,
@@ -122,6 +143,30 @@ def completer_clusters(prefix, parsed_args, **kwargs):
         return list_clusters()
 
 
+TIME_AGO_RE = re.compile(r'^(?P<amount>\d+)(?P<unit>[smhd])$')
+TIME_AGO_UNITS = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}
+
+
+def parse_time_arg(value, now=None):
+    """Parses the argument of --since or --until: either a duration ago like 30m,
+    or a timestamp, which is taken to be in local time unless it has a timezone.
+
+    :returns: a naive UTC datetime, like the timestamps of paasta log lines
+    """
+    match = TIME_AGO_RE.match(value)
+    if match:
+        if now is None:
+            now = datetime.datetime.utcnow()
+        return now - datetime.timedelta(**{TIME_AGO_UNITS[match.group('unit')]: int(match.group('amount'))})
+    try:
+        dt = dateutil.parser.parse(value)
+    except (ValueError, OverflowError):
+        raise argparse.ArgumentTypeError("%r is neither a timestamp nor a duration like 30m, 2h or 1d" % value)
+    if dt.tzinfo is None:
+        return datetime_convert_timezone(dt, dateutil.tz.tzlocal(), dateutil.tz.tzutc())
+    return datetime_convert_timezone(dt, dt.tzinfo, dateutil.tz.tzutc())
+
+
 def build_component_descriptions(components):
     """Returns a colored description string for every log component
     based on its help attribute"""
@@ -332,9 +377,19 @@ class LogReader(object):
     def __init__(self, **kwargs):
         pass
 
-    def tail_logs(service, levels, components, clusters, raw_mode=False):
+    def tail_logs(self, service, levels, components, clusters, raw_mode=False):
         raise NotImplementedError("tail_logs is not implemented")
 
+    def read_logs(self, service, levels, components, clusters, since=None, until=None, lines=None):
+        """Returns an iterator over the log lines of a service that passed the filters,
+        in timestamp order.
+
+        :param since: a naive UTC datetime; only lines from this time on are returned
+        :param until: a naive UTC datetime; only lines from before this time are returned
+        :param lines: if set, only the last this many lines are returned
+        """
+        raise NotImplementedError("read_logs is not implemented")
+
 
 @register_log_reader('scribereader')
 class ScribeLogReader(LogReader):
@@ -560,6 +615,120 @@ class ScribeLogReader(LogReader):
             return env
 
 
+def format_log_timestamp(dt):
+    """Formats a datetime for comparison with the timestamps of log lines, which
+    compare correctly as strings because they are all UTC isoformat timestamps."""
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+
+def get_log_line_timestamp(line):
+    """Returns the timestamp of a JSON log line, or None if it has none. Timestamps
+    written without microseconds, as isoformat() does when they are 0, get them added."""
+    try:
+        timestamp = json.loads(line).get('timestamp')
+    except (ValueError, AttributeError):
+        return None
+    if timestamp is not None and '.' not in timestamp:
+        timestamp += '.000000'
+    return timestamp
+
+
+def find_log_offset(f, timestamp):
+    """Binary searches a log file whose lines are in timestamp order for the first
+    line with a timestamp at or after timestamp, reading only O(log(size)) lines.
+    Lines without a timestamp are skipped over.
+
+    :param f: the log file, opened in binary mode
+    :param timestamp: the timestamp to look for, as formatted by format_log_timestamp
+    :returns: the offset of the start of that line, or the size of the file if there is none
+    """
+    def line_start_at_or_after(offset):
+        if offset == 0:
+            return 0
+        f.seek(offset - 1)
+        f.readline()
+        return f.tell()
+
+    def first_timestamp_from(offset):
+        f.seek(offset)
+        for line in iter(f.readline, ''):
+            line_timestamp = get_log_line_timestamp(line)
+            if line_timestamp is not None:
+                return line_timestamp
+        return None
+
+    f.seek(0, os.SEEK_END)
+    low, high = 0, f.tell()
+    while low < high:
+        middle = (low + high) // 2
+        line_timestamp = first_timestamp_from(line_start_at_or_after(middle))
+        if line_timestamp is None or line_timestamp >= timestamp:
+            high = middle
+        else:
+            low = middle + 1
+    return line_start_at_or_after(low)
+
+
+def read_log_file(path, since=None, until=None):
+    """Yields (timestamp, line) for the lines of a log file with a timestamp in
+    [since, until), seeking to since rather than reading the file from the start.
+
+    :param since: a timestamp as formatted by format_log_timestamp, or None
+    :param until: a timestamp as formatted by format_log_timestamp, or None
+    """
+    with open(path, 'rb') as f:
+        if since is not None:
+            f.seek(find_log_offset(f, since))
+        for line in f:
+            timestamp = get_log_line_timestamp(line)
+            if timestamp is None:
+                continue
+            if until is not None and timestamp >= until:
+                break
+            if since is None or timestamp >= since:
+                yield timestamp, line
+
+
+@register_log_reader('file')
+class FileLogReader(LogReader):
+    """Reads the logs written by the 'file' log writer, FileLogWriter, configured with the same path_format."""
+
+    def __init__(self, path_format, **kwargs):
+        self.path_format = path_format
+
+    def get_log_paths(self, service, levels, components, clusters):
+        """Returns the existing log files that the logs of service in the given levels,
+        components and clusters could have been written to, for any instance."""
+        paths = set()
+        for level, component, cluster in itertools.product(levels, components, list(clusters) + [ANY_CLUSTER]):
+            for instance in ('*', ANY_INSTANCE):
+                pattern = self.path_format.format(
+                    service=service,
+                    component=component,
+                    level=level,
+                    cluster=cluster,
+                    instance=instance,
+                )
+                paths.update(glob.glob(pattern))
+        return sorted(path for path in paths if os.path.isfile(path))
+
+    def read_logs(self, service, levels, components, clusters, since=None, until=None, lines=None):
+        since = format_log_timestamp(since) if since is not None else None
+        until = format_log_timestamp(until) if until is not None else None
+        # each file is in timestamp order, so a k-way merge puts them all in order without reading them up front
+        merged = heapq.merge(*[
+            read_log_file(path, since, until)
+            for path in self.get_log_paths(service, levels, components, clusters)
+        ])
+        log_lines = (
+            line for _, line in merged
+            if paasta_log_line_passes_filter(line, levels, service, components, clusters)
+        )
+        if lines is not None:
+            log_lines = iter(collections.deque(log_lines, maxlen=lines))
+        return log_lines
+
+
 def paasta_logs(args):
     """Print the logs for as Paasta service.
     :param args: argparse.Namespace obj created from sys.args by cli"""
@@ -587,7 +756,23 @@ def paasta_logs(args):
 
     log_reader = get_log_reader()
 
-    if args.tail:
-        log_reader.tail_logs(service, levels, components, clusters, raw_mode=args.raw_mode)
-    else:
-        print "Non-tailing actions are not yet supported"
+    if args.tail or (args.since is None and args.until is None and args.lines is None):
+        try:
+            log_reader.tail_logs(service, levels, components, clusters, raw_mode=args.raw_mode)
+        except NotImplementedError:
+            print "%s can only read logs with --since, --until or --lines, not tail them" % type(log_reader).__name__
+            return 1
+        return
+
+    try:
+        log_lines = log_reader.read_logs(
+            service, levels, components, clusters,
+            since=args.since,
+            until=args.until,
+            lines=args.lines,
+        )
+    except NotImplementedError:
+        print "%s can only tail logs, not read them with --since, --until or --lines" % type(log_reader).__name__
+        return 1
+    for line in log_lines:
+        print_log(line, levels, args.raw_mode)
@@ -15,12 +15,18 @@
 """Contains methods used by the paasta client to mark a docker image for
 deployment to a cluster.instance.
 """
+import fnmatch
+
+import dulwich.errors
+
 from paasta_tools import remote_git
 from paasta_tools.cli.utils import validate_service_name
+from paasta_tools.generate_deployments_for_service import get_instance_config_for_service
 from paasta_tools.utils import _log
 from paasta_tools.utils import DEFAULT_SOA_DIR
 from paasta_tools.utils import format_tag
 from paasta_tools.utils import get_paasta_tag_from_deploy_group
+from paasta_tools.utils import PaastaColors
 
 
 def add_subparser(subparsers):
@@ -50,8 +56,9 @@ def add_subparser(subparsers):
     list_parser.add_argument(
         '-l', '--deploy-group', '--clusterinstance',
         help='Mark the service ready for deployment in this deploy group (e.g. '
-             'cluster1.canary, cluster2.main). --clusterinstance is depricated and '
-             'should be replaced with --deploy-group',
+             'cluster1.canary, cluster2.main). Several deploy groups can be given separated by '
+             'commas, and globs (e.g. "cluster*.main") match the deploy groups of the service. '
+             '--clusterinstance is depricated and should be replaced with --deploy-group',
         required=True,
     )
     list_parser.add_argument(
@@ -73,24 +80,50 @@ def add_subparser(subparsers):
 
 def mark_for_deployment(git_url, deploy_group, service, commit):
     """Mark a docker image for deployment"""
-    tag = get_paasta_tag_from_deploy_group(identifier=deploy_group, desired_state='deploy')
-    remote_tag = format_tag(tag)
+    return mark_for_deployment_in_groups(
+        git_url=git_url,
+        deploy_groups=[deploy_group],
+        service=service,
+        commit=commit,
+    )
+
+
+def mark_for_deployment_in_groups(git_url, deploy_groups, service, commit):
+    """Mark a docker image for deployment in several deploy groups, pushing the
+    tags of all of them at once. The push isn't atomic: when the server rejects
+    some of the tags, the deploy groups whose tag it accepted are still marked."""
+    remote_tags = [
+        format_tag(get_paasta_tag_from_deploy_group(identifier=deploy_group, desired_state='deploy'))
+        for deploy_group in deploy_groups
+    ]
     ref_mutator = remote_git.make_force_push_mutate_refs_func(
-        targets=[remote_tag],
+        targets=remote_tags,
         sha=commit,
     )
+
+    def format_error(error):
+        return ' '.join(line for line in str(error).split('\n') if line)
+
     try:
         remote_git.create_remote_refs(git_url=git_url, ref_mutator=ref_mutator, force=True)
+    except dulwich.errors.UpdateRefsError as e:
+        # the server reports 'ok' or the reason it refused for every ref it was sent
+        errors = [
+            None if e.ref_status.get(remote_tag) == 'ok' else format_error(e.ref_status.get(remote_tag, e))
+            for remote_tag in remote_tags
+        ]
     except Exception as e:
-        loglines = ["Failed to mark %s in for deployment in deploy group %s!" % (commit, deploy_group)]
-        for line in str(e).split('\n'):
-            loglines.append(line)
-        return_code = 1
+        errors = [format_error(e)] * len(deploy_groups)
     else:
-        loglines = ["Marked %s in for deployment in deploy group %s" % (commit, deploy_group)]
-        return_code = 0
+        errors = [None] * len(deploy_groups)
 
-    for logline in loglines:
+    return_code = 0
+    for deploy_group, error in zip(deploy_groups, errors):
+        if error is None:
+            logline = "Marked %s in for deployment in deploy group %s" % (commit, deploy_group)
+        else:
+            logline = "Failed to mark %s in for deployment in deploy group %s! %s" % (commit, deploy_group, error)
+            return_code = 1
         _log(
             service=service,
             line=logline,
@@ -100,16 +133,56 @@ def mark_for_deployment(git_url, deploy_group, service, commit):
     return return_code
 
 
+def expand_deploy_groups(deploy_groups_arg, service, soa_dir):
+    """Turns the comma separated --deploy-group argument into a sorted list of deploy groups.
+    Globs are matched against the deploy groups configured for the service.
+
+    :raises ValueError: if a glob matches none of the deploy groups of the service
+    """
+    deploy_groups = set()
+    service_deploy_groups = None
+    for pattern in deploy_groups_arg.split(','):
+        if not pattern:
+            continue
+        if not any(char in pattern for char in '*?['):
+            deploy_groups.add(pattern)
+            continue
+        if service_deploy_groups is None:
+            service_deploy_groups = set(config.get_deploy_group() for config in get_instance_config_for_service(
+                soa_dir=soa_dir,
+                service=service,
+            ))
+        matches = fnmatch.filter(service_deploy_groups, pattern)
+        if not matches:
+            raise ValueError("%s doesn't match any deploy group of %s" % (pattern, service))
+        deploy_groups.update(matches)
+    return sorted(deploy_groups)
+
+
 def paasta_mark_for_deployment(args):
     """Wrapping mark_for_deployment"""
-    deploy_group = args.deploy_group
     service = args.service
     if service and service.startswith('services-'):
         service = service.split('services-', 1)[1]
     validate_service_name(service, soa_dir=args.soa_dir)
-    return mark_for_deployment(
+    try:
+        deploy_groups = expand_deploy_groups(args.deploy_group, service, args.soa_dir)
+    except ValueError as e:
+        print PaastaColors.red("ERROR: %s" % e)
+        return 1
+    if not deploy_groups:
+        print PaastaColors.red("ERROR: No deploy groups specified for %s." % service)
+        return 1
+    if len(deploy_groups) == 1:
+        return mark_for_deployment(
+            git_url=args.git_url,
+            deploy_group=deploy_groups[0],
+            service=service,
+            commit=args.commit,
+        )
+    return mark_for_deployment_in_groups(
         git_url=args.git_url,
-        deploy_group=deploy_group,
+        deploy_groups=deploy_groups,
         service=service,
         commit=args.commit,
     )
@@ -59,15 +59,38 @@ def add_subparser(subparsers):
         default=DEFAULT_SOA_DIR,
         help="define a different soa config directory",
     )
+    status_parser.add_argument(
+        '--fit',
+        metavar="CPUS,MEM,DISK[,ATTRIBUTE]",
+        help=(
+            "Instead of the cluster status, show how many more tasks of this shape fit on the "
+            "free resources of the cluster, grouped by ATTRIBUTE if given. Try: --fit 2,4096,0,region"
+        ),
+    )
+    status_parser.add_argument(
+        '--pool',
+        help="With --fit, only fit tasks on slaves of this pool",
+    )
+    status_parser.add_argument(
+        '--constraint',
+        action='append',
+        dest="constraints",
+        default=[],
+        metavar="ATTRIBUTE:OPERATOR[:VALUE]",
+        help=(
+            "With --fit, only fit tasks where this marathon-style constraint allows. "
+            "Supports LIKE, UNLIKE, CLUSTER and hostname:UNIQUE. May be given more than once"
+        ),
+    )
     status_parser.set_defaults(command=paasta_metastatus)
 
 
-def print_cluster_status(cluster, verbose=0):
+def print_cluster_status(cluster, verbose=0, **kwargs):
     """With a given cluster and verboseness, returns the status of the cluster
     output is printed directly to provide dashbaords even if the cluster is unavailable"""
     print "Cluster: %s" % cluster
     print get_cluster_dashboards(cluster)
-    print execute_paasta_metastatus_on_remote_master(cluster, verbose)
+    print execute_paasta_metastatus_on_remote_master(cluster, verbose, **kwargs)
     print ""
 
 
@@ -101,7 +124,11 @@ def paasta_metastatus(args):
     clusters_to_inspect = figure_out_clusters_to_inspect(args, all_clusters)
     for cluster in clusters_to_inspect:
         if cluster in all_clusters:
-            print_cluster_status(cluster, args.verbose)
+            if args.fit is not None:
+                print_cluster_status(cluster, args.verbose, fit=args.fit, pool=args.pool,
+                                     constraints=args.constraints)
+            else:
+                print_cluster_status(cluster, args.verbose)
         else:
             print "Cluster %s doesn't look like a valid cluster?" % args.clusters
             print "Try using tab completion to help complete the cluster name"
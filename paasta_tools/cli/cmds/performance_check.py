@@ -20,6 +20,7 @@ import requests
 
 from paasta_tools.utils import get_username
 from paasta_tools.utils import PATH_TO_SYSTEM_PAASTA_CONFIG_DIR
+from paasta_tools.utils import remaining_time
 from paasta_tools.utils import timeout
 
 
@@ -68,6 +69,7 @@ def submit_performance_check_job(service, commit, image):
     r = requests.post(
         url=performance_check_config['endpoint'],
         data=payload,
+        timeout=remaining_time(),
     )
     print "Posted a submission to the PaaSTA performance-check service:"
     print r.text
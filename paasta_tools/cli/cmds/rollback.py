@@ -14,13 +14,13 @@
 # limitations under the License.
 from humanize import naturaltime
 
-from paasta_tools.cli.cmds.mark_for_deployment import mark_for_deployment
+from paasta_tools.cli.cmds.mark_for_deployment import mark_for_deployment_in_groups
 from paasta_tools.cli.utils import extract_tags
 from paasta_tools.cli.utils import figure_out_service_name
 from paasta_tools.cli.utils import lazy_choices_completer
 from paasta_tools.cli.utils import list_services
 from paasta_tools.generate_deployments_for_service import get_instance_config_for_service
-from paasta_tools.remote_git import list_remote_refs
+from paasta_tools.remote_git import list_remote_paasta_refs
 from paasta_tools.utils import datetime_from_utc_to_local
 from paasta_tools.utils import DEFAULT_SOA_DIR
 from paasta_tools.utils import format_table
@@ -92,7 +92,7 @@ def get_git_shas_for_service(service, deploy_groups, soa_dir):
     )}
     deploy_groups, _ = validate_given_deploy_groups(all_deploy_groups, deploy_groups)
     previously_deployed_shas = {}
-    for ref, sha in list_remote_refs(git_url).items():
+    for ref, sha in list_remote_paasta_refs(git_url).items():
         regex_match = extract_tags(ref)
         try:
             deploy_group = regex_match['deploy_group']
@@ -142,10 +142,10 @@ def list_previous_commits(service, deploy_groups, any_given_deploy_groups, soa_d
 
 
 def paasta_rollback(args):
-    """Call mark_for_deployment with rollback parameters
+    """Call mark_for_deployment_in_groups with rollback parameters
     :param args: contains all the arguments passed onto the script: service,
     deploy groups and sha. These arguments will be verified and passed onto
-    mark_for_deployment.
+    mark_for_deployment_in_groups.
     """
     soa_dir = args.soa_dir
     service = figure_out_service_name(args, soa_dir)
@@ -171,17 +171,9 @@ def paasta_rollback(args):
         list_previous_commits(service, deploy_groups, bool(given_deploy_groups), soa_dir)
         return 1
 
-    returncode = 0
-
-    for deploy_group in deploy_groups:
-        returncode = max(
-            mark_for_deployment(
-                git_url=git_url,
-                service=service,
-                deploy_group=deploy_group,
-                commit=commit,
-            ),
-            returncode,
-        )
-
-    return returncode
+    return mark_for_deployment_in_groups(
+        git_url=git_url,
+        service=service,
+        deploy_groups=sorted(deploy_groups),
+        commit=commit,
+    )
@@ -14,6 +14,7 @@
 import fnmatch
 import logging
 import os
+import pipes
 import pkgutil
 import re
 import sys
@@ -518,22 +519,36 @@ def execute_paasta_serviceinit_on_remote_master(subcommand, cluster, service, in
     return run_paasta_serviceinit(subcommand, master, service, instancename, cluster, **kwargs)
 
 
-def run_paasta_metastatus(master, verbose=0):
+def run_paasta_metastatus(master, verbose=0, fit=None, pool=None, constraints=()):
+    """Runs paasta_metastatus on master.
+
+    :param fit: a CPUS,MEM,DISK[,ATTRIBUTE] task shape to run paasta_metastatus --fit with
+    :param pool: the pool to fit the task shape on
+    :param constraints: ATTRIBUTE:OPERATOR[:VALUE] constraints to fit the task shape with
+    """
     if verbose > 0:
         verbose_flag = " -%s" % 'v' * verbose
         timeout = 120
     else:
         verbose_flag = ''
         timeout = 20
-    command = 'ssh -A -n %s sudo paasta_metastatus%s' % (
+    fit_args = []
+    if fit is not None:
+        fit_args.extend(['--fit', fit])
+        if pool is not None:
+            fit_args.extend(['--pool', pool])
+        for constraint in constraints:
+            fit_args.extend(['--constraint', constraint])
+    command = 'ssh -A -n %s sudo paasta_metastatus%s%s' % (
         master,
         verbose_flag,
+        ''.join(' %s' % pipes.quote(pipes.quote(arg)) for arg in fit_args),
     )
     _, output = _run(command, timeout=timeout)
     return output
 
 
-def execute_paasta_metastatus_on_remote_master(cluster, verbose=0):
+def execute_paasta_metastatus_on_remote_master(cluster, verbose=0, **kwargs):
     """Returns a string containing an error message if an error occurred.
     Otherwise returns the output of run_paasta_metastatus().
     """
@@ -545,7 +560,7 @@ def execute_paasta_metastatus_on_remote_master(cluster, verbose=0):
         return (
             'ERROR: could not find connectable master in cluster %s\nOutput: %s' % (cluster, output)
         )
-    return run_paasta_metastatus(master, verbose)
+    return run_paasta_metastatus(master, verbose, **kwargs)
 
 
 def run_chronos_rerun(master, service, instancename, **kwargs):
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# Copyright 2015 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Deletes old paasta deploy and start/stop tags from the git repos of services,
+so that their ref advertisements stop growing with every deploy.
+
+For every deploy group the newest --keep deploy tags are kept, and for every
+branch the newest --keep start/stop tags. Any tag on a sha that the service's
+deployments.json still references is kept too, as is the newest start/stop tag
+of each branch on every sha, since that decides the desired state of the
+branch if the sha is ever deployed again.
+
+The tags to delete are appended to <archive-dir>/<service>.packed-refs, in the
+format of a git packed-refs file, and then deleted in a single push.
+
+Command line options:
+
+- -s <SERVICE>, --service <SERVICE>: Compact the tags of this service; may be repeated. Defaults to every service
+- -k <KEEP>, --keep <KEEP>: How many tags to keep per deploy group and per branch
+- -a <ARCHIVE_DIR>, --archive-dir <ARCHIVE_DIR>: Where to archive the deleted tags
+- -n, --dry-run: Only print the tags that would be deleted
+- -d <SOA_DIR>, --soa-dir <SOA_DIR>: Specify a SOA config dir to read from
+"""
+import argparse
+import datetime
+import os
+import sys
+
+import dulwich.errors
+import service_configuration_lib
+
+from paasta_tools import remote_git
+from paasta_tools.generate_deployments_for_service import DEPLOY_TAG_RE
+from paasta_tools.generate_deployments_for_service import STATE_TAG_RE
+from paasta_tools.utils import DEFAULT_SOA_DIR
+from paasta_tools.utils import get_git_url
+from paasta_tools.utils import load_deployments_json
+from paasta_tools.utils import NoDeploymentsAvailable
+
+DEFAULT_KEEP = 10
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Deletes old paasta tags from the git repos of services.')
+    parser.add_argument('-s', '--service', dest='services', action='append',
+                        help="compact the tags of this service; may be repeated. Defaults to every service")
+    parser.add_argument('-k', '--keep', type=int, default=DEFAULT_KEEP,
+                        help="how many tags to keep per deploy group and per branch (default %(default)s)")
+    parser.add_argument('-a', '--archive-dir', dest='archive_dir',
+                        help="directory to archive the deleted tags in")
+    parser.add_argument('-n', '--dry-run', dest='dry_run', action='store_true', default=False,
+                        help="only print the tags that would be deleted")
+    parser.add_argument('-d', '--soa-dir', dest="soa_dir", metavar="SOA_DIR",
+                        default=DEFAULT_SOA_DIR,
+                        help="define a different soa config directory")
+    args = parser.parse_args()
+    if args.keep < 1:
+        parser.error('--keep must be at least 1')
+    if args.archive_dir is None and not args.dry_run:
+        parser.error('--archive-dir is required unless --dry-run is given')
+    return args
+
+
+def find_compactable_tags(refs, keep, keep_shas=()):
+    """Finds the paasta tags that can be deleted from a repo.
+
+    :param refs: A dictionary mapping git refs to shas
+    :param keep: how many of the newest tags to keep per deploy group and per branch
+    :param keep_shas: shas whose tags must all be kept
+    :returns: a dictionary mapping the refs that can be deleted to their shas
+    """
+    # deploy group -> [(timestamp, ref)]
+    deploy_tags = {}
+    # branch -> [(force_bounce, ref)]
+    state_tags = {}
+    for ref_name in refs:
+        match = DEPLOY_TAG_RE.match(ref_name)
+        if match:
+            deploy_tags.setdefault(match.group('deploy_group'), []).append((match.group('tstamp'), ref_name))
+            continue
+        match = STATE_TAG_RE.match(ref_name)
+        if match:
+            # as in DeployTagIndex, paasta-paasta-... tags count for the branch with and without the prefix
+            branch = match.group('branch')
+            branches = [branch]
+            if branch.startswith('paasta-'):
+                branches.append(branch[len('paasta-'):])
+            for branch in branches:
+                state_tags.setdefault(branch, []).append((match.group('force_bounce'), ref_name))
+
+    kept = set(ref_name for ref_name, sha in refs.iteritems() if sha in keep_shas)
+    for tags in deploy_tags.values() + state_tags.values():
+        kept.update(ref_name for _, ref_name in sorted(tags)[-keep:])
+    newest_states = {}
+    for branch, tags in state_tags.iteritems():
+        for force_bounce, ref_name in tags:
+            newest_states.setdefault((branch, refs[ref_name]), []).append((force_bounce, ref_name))
+    for tags in newest_states.values():
+        newest = max(force_bounce for force_bounce, _ in tags)
+        kept.update(ref_name for force_bounce, ref_name in tags if force_bounce == newest)
+
+    tag_names = set(ref_name for tags in deploy_tags.values() + state_tags.values() for _, ref_name in tags)
+    return dict((ref_name, refs[ref_name]) for ref_name in tag_names - kept)
+
+
+def get_deployed_shas(service, soa_dir):
+    """Returns the shas of the docker images in the deployments.json of a service."""
+    deployments = load_deployments_json(service, soa_dir=soa_dir)
+    return set(
+        branch_dict['docker_image'].rsplit(':paasta-', 1)[-1]
+        for branch_dict in deployments.values() if 'docker_image' in branch_dict
+    )
+
+
+def archive_refs(path, git_url, refs):
+    """Appends refs to the archive at path in packed-refs format, under a comment saying where they came from."""
+    with open(path, 'a') as f:
+        f.write('# deleted from %s at %s\n' % (git_url, datetime.datetime.utcnow().isoformat()))
+        for ref_name, sha in sorted(refs.items()):
+            f.write('%s %s\n' % (sha, ref_name))
+
+
+def compact_deploy_tags(service, soa_dir, keep, archive_dir=None, dry_run=False):
+    """Archives and deletes the tags of a service that find_compactable_tags allows.
+
+    :returns: a dictionary mapping the deleted refs (or the ones that would be, with dry_run) to their shas
+    """
+    keep_shas = get_deployed_shas(service, soa_dir)
+    git_url = get_git_url(service=service, soa_dir=soa_dir)
+    refs = remote_git.list_remote_refs(git_url)
+    compactable = find_compactable_tags(refs, keep, keep_shas)
+    if compactable and not dry_run:
+        archive_refs(os.path.join(archive_dir, '%s.packed-refs' % service), git_url, compactable)
+        remote_git.delete_remote_refs(git_url, compactable)
+    return compactable
+
+
+def main():
+    args = parse_args()
+    soa_dir = os.path.abspath(args.soa_dir)
+    services = args.services
+    if not services:
+        services = sorted(service_configuration_lib.read_services_configuration(soa_dir=soa_dir).keys())
+
+    failed = False
+    for service in services:
+        try:
+            compacted = compact_deploy_tags(
+                service=service,
+                soa_dir=soa_dir,
+                keep=args.keep,
+                archive_dir=args.archive_dir,
+                dry_run=args.dry_run,
+            )
+        except NoDeploymentsAvailable:
+            # without a deployments.json we can't tell which tags are still in use
+            print 'Skipping %s: it has no deployments.json' % service
+            continue
+        except (remote_git.LSRemoteException, dulwich.errors.GitProtocolError) as e:
+            # the server rejected the deletes or hung up; the other services may still work
+            print 'Failed to compact the tags of %s: %s' % (service, e)
+            failed = True
+            continue
+        print '%s %d tags of %s' % ('Would delete' if args.dry_run else 'Deleted', len(compacted), service)
+        if args.dry_run:
+            for ref_name in sorted(compacted):
+                print '  %s' % ref_name
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -28,10 +28,11 @@ def main():
         mesos_tools.get_running_tasks_from_active_frameworks(''))]
     running_mesos_docker_containers = get_running_mesos_docker_containers()
 
+    container_id_index = mesos_tools.ContainerIdIndex()
     orphaned_containers = []
     for container in running_mesos_docker_containers:
         mesos_task_id = mesos_tools.get_mesos_id_from_container(
-            container=container, client=docker_client)
+            container=container, client=docker_client, index=container_id_index)
         if mesos_task_id not in running_mesos_task_ids:
             orphaned_containers.append((container["Names"][0], mesos_task_id))
 
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# Copyright 2015 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Generates the deployments.json of every service in the SOA configuration
+directory, as generate_deployments_for_service does for one service, talking
+to the git servers of several services at once.
+
+The services whose deployments.json changed are printed one per line on
+stdout, for consumers like the deploy daemon. Per-service timings and failures
+are logged to stderr. If every service succeeded, any deployments.json that has
+not been regenerated for an hour is deleted. If deployments_store_path is set in
+the system paasta config, every deployments.json is then also consolidated into
+the deployments store there, for load_deployments_json.
+
+Command line options:
+
+- -d <SOA_DIR>, --soa-dir <SOA_DIR>: Specify a SOA config dir to read from
+- -w <WORKERS>, --workers <WORKERS>: How many services to generate at once
+- -v, --verbose: Verbose output
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+import service_configuration_lib
+from concurrent import futures
+
+from paasta_tools.generate_deployments_for_service import generate_deployments_for_service
+from paasta_tools.generate_deployments_for_service import TARGET_FILE
+from paasta_tools.utils import DEFAULT_SOA_DIR
+from paasta_tools.utils import load_system_paasta_config
+from paasta_tools.utils import PaastaNotConfiguredError
+from paasta_tools.utils import write_deployments_store
+
+log = logging.getLogger('__main__')
+DEFAULT_WORKERS = 4
+# deployments.json files that haven't been regenerated for this long belong to
+# services that no longer exist
+MAX_DEPLOYMENTS_AGE = 3600
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Creates the deployments.json of every service.')
+    parser.add_argument('-d', '--soa-dir', dest="soa_dir", metavar="SOA_DIR",
+                        default=DEFAULT_SOA_DIR,
+                        help="define a different soa config directory")
+    parser.add_argument('-w', '--workers', dest="workers", type=int, default=DEFAULT_WORKERS,
+                        help="how many services to generate deployments.json for at once (default %(default)s)")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        dest="verbose", default=False)
+    args = parser.parse_args()
+    return args
+
+
+def timed_generate_deployments_for_service(service, soa_dir):
+    """Runs generate_deployments_for_service, catching any error.
+
+    :returns: a tuple of (changed, seconds taken, exception or None)
+    """
+    start = time.time()
+    try:
+        changed = generate_deployments_for_service(service=service, soa_dir=soa_dir)
+    except Exception as e:
+        log.exception('Failed to generate deployments.json for %s', service)
+        return False, time.time() - start, e
+    return changed, time.time() - start, None
+
+
+def generate_all_deployments(services, soa_dir, max_workers=DEFAULT_WORKERS):
+    """Generates the deployments.json of every service, max_workers at a time.
+
+    :returns: a list of (service, changed, seconds taken, exception or None), in the order of services
+    """
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = [executor.submit(timed_generate_deployments_for_service, service, soa_dir) for service in services]
+    return [(service,) + result.result() for service, result in zip(services, results)]
+
+
+def delete_old_deployments(soa_dir, max_age=MAX_DEPLOYMENTS_AGE):
+    """Deletes any deployments.json in soa_dir that is older than max_age seconds.
+
+    :returns: the paths deleted
+    """
+    deleted = []
+    cutoff = time.time() - max_age
+    for service in os.listdir(soa_dir):
+        path = os.path.join(soa_dir, service, TARGET_FILE)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                deleted.append(path)
+        except OSError:
+            continue
+    return deleted
+
+
+def format_report(results, verbose=False):
+    """Formats the timings of the services, slowest first, followed by a summary.
+    Only failed services are listed unless verbose is set."""
+    lines = [
+        '%s: %.2fs%s' % (service, elapsed, ' FAILED: %s' % error if error is not None else '')
+        for service, _, elapsed, error in sorted(results, key=lambda result: result[2], reverse=True)
+        if verbose or error is not None
+    ]
+    lines.append('%d services, %d changed, %d failed, slowest %.2fs' % (
+        len(results),
+        len([result for result in results if result[1]]),
+        len([result for result in results if result[3] is not None]),
+        max([result[2] for result in results] or [0]),
+    ))
+    return '\n'.join(lines)
+
+
+def get_deployments_store_path():
+    try:
+        return load_system_paasta_config().get_deployments_store_path()
+    except PaastaNotConfiguredError:
+        return None
+
+
+def main():
+    args = parse_args()
+    soa_dir = os.path.abspath(args.soa_dir)
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.WARNING)
+
+    services = sorted(service_configuration_lib.read_services_configuration(soa_dir=soa_dir).keys())
+    results = generate_all_deployments(services, soa_dir, max_workers=args.workers)
+
+    for service, changed, _, _ in results:
+        if changed:
+            print service
+    sys.stdout.flush()
+    sys.stderr.write(format_report(results, verbose=args.verbose) + '\n')
+
+    failed = any(error is not None for _, _, _, error in results)
+    deleted = []
+    # Only delete old files if we are confident that everything went ok
+    if not failed:
+        deleted = delete_old_deployments(soa_dir)
+        for path in deleted:
+            log.info('Deleted stale %s', path)
+
+    store_path = get_deployments_store_path()
+    if store_path is not None:
+        # Rewritten on every run, as even an unchanged deployments.json has been touched
+        # since, and the store only serves files whose mtime it recorded
+        write_deployments_store(store_path, soa_dir, services)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -103,29 +103,70 @@ def get_instance_config_for_service(soa_dir, service):
             )
 
 
-def get_latest_deployment_tag(refs, deploy_group):
+DEPLOY_TAG_RE = re.compile(r'^refs/tags/paasta-(?P<deploy_group>.+)-(?P<tstamp>\d{8}T\d{6})-deploy$')
+# A previous mistake means some start/stop tags are called paasta-paasta-cluster.instance-...,
+# so the branch of those is indexed both with and without its leading paasta-
+STATE_TAG_RE = re.compile(r'^refs/tags/paasta-(?P<branch>.+)-(?P<force_bounce>[^-]+)-(?P<state>start|stop)$')
+
+
+class DeployTagIndex(object):
+    """The paasta tags of a repo, parsed once so that the latest deployment of every
+    deploy group and the desired state of every branch can be looked up directly.
+
+    :param refs: A dictionary mapping git refs to shas
+    """
+
+    def __init__(self, refs):
+        # deploy_group -> [(timestamp, sha, ref)], sorted
+        self.deploy_tags = {}
+        # sha -> [(branch, force_bounce, state)]
+        self.states_by_sha = {}
+        for ref_name, sha in refs.iteritems():
+            match = DEPLOY_TAG_RE.match(ref_name)
+            if match:
+                self.deploy_tags.setdefault(match.group('deploy_group'), []).append(
+                    (match.group('tstamp'), sha, ref_name))
+                continue
+            match = STATE_TAG_RE.match(ref_name)
+            if match:
+                branch, force_bounce, state = match.group('branch', 'force_bounce', 'state')
+                states = self.states_by_sha.setdefault(sha, [])
+                states.append((branch, force_bounce, state))
+                if branch.startswith('paasta-'):
+                    states.append((branch[len('paasta-'):], force_bounce, state))
+        for tags in self.deploy_tags.values():
+            tags.sort()
+
+    def get_latest_deployment_tag(self, deploy_group):
+        """:returns: A tuple of (ref, sha) of the deploy tag of deploy_group with the most
+        recent timestamp, or (None, None) if it has none"""
+        tags = self.deploy_tags.get(deploy_group)
+        if not tags:
+            return None, None
+        _, sha, ref_name = tags[-1]
+        return ref_name, sha
+
+    def get_states(self, branch, sha):
+        """:returns: a list of (state, force_bounce) of the start/stop tags of branch on sha"""
+        return [
+            (state, force_bounce) for tag_branch, force_bounce, state in self.states_by_sha.get(sha, [])
+            if tag_branch == branch
+        ]
+
+
+def get_latest_deployment_tag(refs, deploy_group, tag_index=None):
     """Gets the latest deployment tag and sha for the specified deploy_group
 
     :param refs: A dictionary mapping git refs to shas
     :param deploy_group: The deployment group to return a deploy tag for
+    :param tag_index: A DeployTagIndex of refs; one is built if not given
 
     :returns: A tuple of the form (ref, sha) where ref is the actual deployment
               tag (with the most recent timestamp)  and sha is the sha it points at
     """
-    most_recent_dtime = None
-    most_recent_ref = None
-    most_recent_sha = None
-    pattern = re.compile("^refs/tags/paasta-%s-(\d{8}T\d{6})-deploy$" % deploy_group)
-
-    for ref_name, sha in refs.iteritems():
-        match = pattern.match(ref_name)
-        if match:
-            dtime = match.groups()[0]
-            if dtime > most_recent_dtime:
-                most_recent_dtime = dtime
-                most_recent_ref = ref_name
-                most_recent_sha = sha
-    return most_recent_ref, most_recent_sha
+    if tag_index is None:
+        tag_index = DeployTagIndex(refs)
+    return tag_index.get_latest_deployment_tag(deploy_group)
 
 
 def get_deploy_group_mappings(soa_dir, service, old_mappings):
@@ -160,10 +201,11 @@ def get_deploy_group_mappings(soa_dir, service, old_mappings):
         service=service,
         soa_dir=soa_dir,
     )
-    remote_refs = remote_git.list_remote_refs(git_url)
+    remote_refs = remote_git.list_remote_paasta_refs(git_url)
+    tag_index = DeployTagIndex(remote_refs)
 
     for control_branch, deploy_group in deploy_group_branch_mappings.items():
-        (deploy_ref_name, _) = get_latest_deployment_tag(remote_refs, deploy_group)
+        (deploy_ref_name, _) = get_latest_deployment_tag(remote_refs, deploy_group, tag_index=tag_index)
         if deploy_ref_name in remote_refs:
             commit_sha = remote_refs[deploy_ref_name]
             control_branch_alias = '%s:paasta-%s' % (service, control_branch)
@@ -176,6 +218,7 @@ def get_deploy_group_mappings(soa_dir, service, old_mappings):
                 branch=control_branch,
                 remote_refs=remote_refs,
                 deploy_group=deploy_group,
+                tag_index=tag_index,
             )
             mapping['desired_state'] = desired_state
             mapping['force_bounce'] = force_bounce
@@ -197,24 +240,17 @@ def get_service_from_docker_image(image_name):
     return matches.group(1)
 
 
-def get_desired_state(branch, remote_refs, deploy_group):
+def get_desired_state(branch, remote_refs, deploy_group, tag_index=None):
     """Gets the desired state (start or stop) from the given repo, as well as
     an arbitrary value (which may be None) that will change when a restart is
     desired.
-    """
-    # (?:paasta-){1,2} supports a previous mistake where some tags would be called
-    # paasta-paasta-cluster.instance
-    tag_pattern = r'^refs/tags/(?:paasta-){1,2}%s-(?P<force_bounce>[^-]+)-(?P<state>(start|stop))$' % branch
 
-    states = []
-    (_, head_sha) = get_latest_deployment_tag(remote_refs, deploy_group)
-
-    for ref_name, sha in remote_refs.iteritems():
-        if sha == head_sha:
-            match = re.match(tag_pattern, ref_name)
-            if match:
-                gd = match.groupdict()
-                states.append((gd['state'], gd['force_bounce']))
+    :param tag_index: A DeployTagIndex of remote_refs; one is built if not given
+    """
+    if tag_index is None:
+        tag_index = DeployTagIndex(remote_refs)
+    (_, head_sha) = tag_index.get_latest_deployment_tag(deploy_group)
+    states = tag_index.get_states(branch, head_sha)
 
     if states:
         # there may be more than one that matches, so take the one that sorts
@@ -245,11 +281,17 @@ def get_deploy_group_mappings_from_deployments_dict(deployments_dict):
 
 
 def generate_deployments_for_service(service, soa_dir):
+    """Writes the deployments.json of a service, unless it already has the same contents.
+
+    :returns: True if deployments.json was written, False if it was unchanged
+    """
+    target_path = os.path.join(soa_dir, service, TARGET_FILE)
     try:
-        with open(os.path.join(soa_dir, service, TARGET_FILE), 'r') as f:
+        with open(target_path, 'r') as f:
             old_deployments_dict = json.load(f)
             old_mappings = get_deploy_group_mappings_from_deployments_dict(old_deployments_dict)
     except (IOError, ValueError):
+        old_deployments_dict = None
         old_mappings = {}
     mappings = get_deploy_group_mappings(
         soa_dir=soa_dir,
@@ -259,8 +301,14 @@ def generate_deployments_for_service(service, soa_dir):
 
     deployments_dict = get_deployments_dict_from_deploy_group_mappings(mappings)
 
-    with atomic_file_write(os.path.join(soa_dir, service, TARGET_FILE)) as f:
+    if deployments_dict == old_deployments_dict:
+        # generate_all_deployments deletes any deployments.json older than an hour,
+        # so an unchanged one still has to look freshly generated
+        os.utime(target_path, None)
+        return False
+    with atomic_file_write(target_path) as f:
         json.dump(deployments_dict, f)
+    return True
 
 
 def main():
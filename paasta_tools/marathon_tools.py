@@ -33,6 +33,7 @@ from marathon import NotFoundError
 from paasta_tools.mesos_tools import get_local_slave_state
 from paasta_tools.mesos_tools import get_mesos_network_for_net
 from paasta_tools.mesos_tools import get_mesos_slaves_grouped_by_attribute
+from paasta_tools.utils import check_deadline
 from paasta_tools.utils import compose_job_id
 from paasta_tools.utils import decompose_job_id
 from paasta_tools.utils import deep_merge_dictionaries
@@ -945,6 +946,7 @@ def wait_for_app_to_launch_tasks(client, app_id, expected_tasks, exact_matches_o
     """
     found = False
     while not found:
+        check_deadline()
         try:
             found = app_has_tasks(client, app_id, expected_tasks, exact_matches_only)
         except NotFoundError:
@@ -12,18 +12,40 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import datetime
+import fcntl
+import gzip
+import io
 import json
 import os
 import re
 import socket
+import time
+import zlib
+from concurrent import futures
+from decimal import Decimal
 
 import humanize
 import requests
 from kazoo.client import KazooClient
 from mesos.cli.exceptions import SlaveDoesNotExist
 
+try:
+    # The C backend is an order of magnitude faster than ijson's pure python one
+    import ijson.backends.yajl2_c as ijson
+except ImportError:
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
+
+from paasta_tools.utils import atomic_file_write
+from paasta_tools.utils import check_deadline
 from paasta_tools.utils import format_table
+from paasta_tools.utils import load_system_paasta_config
 from paasta_tools.utils import PaastaColors
+from paasta_tools.utils import PaastaNotConfiguredError
+from paasta_tools.utils import remaining_time
+from paasta_tools.utils import Timeout
 from paasta_tools.utils import timeout
 from paasta_tools.utils import TimeoutError
 
@@ -75,6 +97,9 @@ mesos.cli.log.fatal = lambda msg, code = 1: raise_cli_exception(msg)
 MY_HOSTNAME = socket.getfqdn()
 MESOS_MASTER_PORT = 5050
 MESOS_SLAVE_PORT = '5051'
+# status_mesos_tasks_verbose gives up on slave lookups still running after this many seconds
+VERBOSE_STATUS_TIMEOUT = 20
+VERBOSE_STATUS_WORKERS = 20
 from mesos.cli import master  # noqa
 import mesos.cli.cluster  # noqa
 
@@ -240,13 +265,22 @@ def get_cpu_usage(task):
         return "Timed Out"
 
 
+def get_usage_or_timed_out(get_usage, task):
+    """Calls get_mem_usage or get_cpu_usage, returning "Timed Out" when their timeout
+    expires, which raises TimeoutError from outside of them"""
+    try:
+        return get_usage(task)
+    except TimeoutError:
+        return "Timed Out"
+
+
 def format_running_mesos_task_row(task, get_short_task_id):
     """Returns a pretty formatted string of a running mesos task attributes"""
     return (
         get_short_task_id(task['id']),
         get_short_hostname_from_task(task),
-        get_mem_usage(task),
-        get_cpu_usage(task),
+        get_usage_or_timed_out(get_mem_usage, task),
+        get_usage_or_timed_out(get_cpu_usage, task),
         get_first_status_timestamp(task),
     )
 
@@ -261,7 +295,6 @@ def format_non_running_mesos_task_row(task, get_short_task_id):
     )
 
 
-@timeout()
 def format_stdstreams_tail_for_task(task, get_short_task_id, nlines=10):
     """Returns the formatted "tail" of stdout/stderr, for a given a task.
 
@@ -272,8 +305,8 @@ def format_stdstreams_tail_for_task(task, get_short_task_id, nlines=10):
     error_message = PaastaColors.red("      couldn't read stdout/stderr for %s (%s)")
     output = []
     try:
-        fobjs = list(mesos.cli.cluster.files(lambda x: x, flist=['stdout', 'stderr'], fltr=task['id']))
-        fobjs.sort(key=lambda fobj: fobj.path, reverse=True)
+        sandbox = set(os.path.basename(entry['path']) for entry in task.file_list(''))
+        fobjs = [task.file(name) for name in ('stdout', 'stderr') if name in sandbox]
         if not fobjs:
             output.append(PaastaColors.blue("      no stdout/stderrr for %s" % get_short_task_id(task['id'])))
             return output
@@ -284,6 +317,7 @@ def format_stdstreams_tail_for_task(task, get_short_task_id, nlines=10):
             reversed_file = reversed(fobj)
             tail = []
             for _ in xrange(nlines):
+                check_deadline()
                 line = next(reversed_file, None)
                 if line is None:
                     break
@@ -294,6 +328,7 @@ def format_stdstreams_tail_for_task(task, get_short_task_id, nlines=10):
             output.append(PaastaColors.blue("      %s EOF" % fobj.path))
     except (MasterNotAvailableException,
             SlaveNotAvailableException,
+            SlaveDoesNotExist,
             TaskNotFoundException,
             FileNotFoundForTaskException) as e:
         output.append(error_message % (get_short_task_id(task['id']), e.message))
@@ -316,7 +351,141 @@ def zip_tasks_verbose_output(table, stdstreams):
     return output
 
 
-def format_task_list(tasks, list_title, table_header, get_short_task_id, format_task_row, grey, tail_stdstreams):
+def fetch_slave_task_data(slave, sandbox_task_ids=()):
+    """Looks up the executor and the resource statistics of every task on a slave,
+    with one request for the slave's state and one for its statistics, and lists the
+    sandbox of each of the tasks in sandbox_task_ids once.
+
+    :param slave: a mesos.cli MesosSlave
+    :param sandbox_task_ids: the ids of the tasks whose sandbox to list
+    :returns: a dictionary of task ids to (executor, statistics, sandbox) tuples, where sandbox
+              is the task's sandbox listing as returned by ``slave.file_list``, or None if it wasn't listed
+    """
+    executors = {}
+    state = slave.state
+    for framework in state.get('frameworks', []) + state.get('completed_frameworks', []):
+        for executor in framework.get('executors', []) + framework.get('completed_executors', []):
+            for key in ('tasks', 'completed_tasks', 'queued_tasks'):
+                for task in executor.get(key, []):
+                    executors[task['id']] = executor
+    statistics = {entry['executor_id']: entry['statistics'] for entry in slave.stats}
+    sandboxes = {}
+    for task_id in sandbox_task_ids:
+        if task_id in executors:
+            check_deadline()
+            sandboxes[task_id] = slave.file_list(executors[task_id].get('directory', ''))
+    return {
+        task_id: (executor, statistics.get(executor['id'], {}), sandboxes.get(task_id))
+        for task_id, executor in executors.iteritems()
+    }
+
+
+class PrefetchedTask(object):
+    """Wraps a mesos.cli Task so that its slave lookups are answered from a single
+    fetch_slave_task_data call shared by every task on the same slave.
+
+    Lookups wait for that call until the deadline passes, or until the Timeout of the
+    calling thread expires, and then raise TimeoutError, which the row formatting functions
+    already turn into partial output.
+    """
+
+    def __init__(self, task, slave, slave_task_data, deadline=None):
+        """
+        :param task: the mesos.cli Task
+        :param slave: the task's mesos.cli MesosSlave, or None if it no longer exists
+        :param slave_task_data: a future of fetch_slave_task_data for that slave, or None if there is no slave
+        :param deadline: a Timeout after which to stop waiting for slave_task_data
+        """
+        self.task = task
+        self._slave = slave
+        self._slave_task_data = slave_task_data
+        self.deadline = deadline
+
+    def __getitem__(self, name):
+        return self.task[name]
+
+    @property
+    def slave(self):
+        if self._slave is None:
+            raise SlaveDoesNotExist("Slave %s no longer exists." % self.task['slave_id'])
+        return self._slave
+
+    def _get_executor_and_statistics(self):
+        if self._slave_task_data is None:
+            raise SlaveDoesNotExist("Slave %s no longer exists." % self.task['slave_id'])
+        timeouts = [remaining for remaining in (remaining_time(), self.deadline and self.deadline.remaining())
+                    if remaining is not None]
+        try:
+            slave_task_data = self._slave_task_data.result(timeout=min(timeouts) if timeouts else None)
+        except futures.TimeoutError:
+            raise TimeoutError("Timed out looking up %s" % self.task['id'])
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise SlaveDoesNotExist(str(e))
+        return slave_task_data.get(self.task['id'], ({}, {}, None))
+
+    @property
+    def stats(self):
+        return self._get_executor_and_statistics()[1]
+
+    @property
+    def cpu_limit(self):
+        return self.stats.get("cpus_limit", 0)
+
+    @property
+    def mem_limit(self):
+        return self.stats.get("mem_limit_bytes", 0)
+
+    @property
+    def rss(self):
+        return self.stats.get("mem_rss_bytes", 0)
+
+    @property
+    def directory(self):
+        return self._get_executor_and_statistics()[0].get('directory', '')
+
+    def file_list(self, path):
+        sandbox = self._get_executor_and_statistics()[2]
+        if path == '' and sandbox is not None:
+            return sandbox
+        return self.slave.file_list(os.path.join(self.directory, path))
+
+    def file(self, path):
+        return mesos.cli.mesos_file.File(self.slave, self, path)
+
+
+def prefetch_tasks(tasks, executor, deadline, list_sandboxes=False):
+    """Starts fetch_slave_task_data for the slaves of the tasks, once per slave,
+    through deadline.run so that no fetch outlives the deadline.
+
+    :param tasks: a list of mesos.cli Tasks
+    :param executor: the concurrent.futures executor to fetch with
+    :param deadline: a Timeout after which to give up on the fetches
+    :param list_sandboxes: if True, also list the sandbox of every task
+    :returns: a list of PrefetchedTasks
+    """
+    slaves = {}
+    task_ids = {}
+    for task in tasks:
+        slave_id = task['slave_id']
+        if slave_id not in slaves:
+            try:
+                slaves[slave_id] = task.slave
+            except SlaveDoesNotExist:
+                slaves[slave_id] = None
+        task_ids.setdefault(slave_id, []).append(task['id'])
+    slave_futures = {}
+    for slave_id, slave in slaves.iteritems():
+        if slave is not None:
+            sandbox_task_ids = task_ids[slave_id] if list_sandboxes else ()
+            slave_futures[slave_id] = executor.submit(deadline.run, fetch_slave_task_data, slave, sandbox_task_ids)
+    return [
+        PrefetchedTask(task, slaves[task['slave_id']], slave_futures.get(task['slave_id']), deadline)
+        for task in tasks
+    ]
+
+
+def format_task_list(tasks, list_title, table_header, get_short_task_id, format_task_row, grey, tail_stdstreams,
+                     executor=None, deadline=None):
     """Formats a list of tasks, returns a list of output lines
     :param tasks: List of tasks as returned by get_*_tasks_from_active_frameworks.
     :param list_title: 'Running Tasks:' or 'Non-Running Tasks'.
@@ -328,6 +497,8 @@ def format_task_list(tasks, list_title, table_header, get_short_task_id, format_
     :param tail_stdstreams: If True, also display the stdout/stderr tail,
                             as obtained from the Mesos sandbox.
     :param grey: If True, the list will be made less visually prominent.
+    :param executor: If given, a concurrent.futures executor to read the stdout/stderr tails with.
+    :param deadline: The Timeout to read the stdout/stderr tails through, required with executor.
     :return output: Formatted output (list of output lines).
     """
     if not grey:
@@ -336,6 +507,10 @@ def format_task_list(tasks, list_title, table_header, get_short_task_id, format_
     else:
         def colorize(x):
             return(PaastaColors.grey(x))
+    stdstreams_futures = []
+    if tail_stdstreams and executor is not None:
+        stdstreams_futures = [executor.submit(deadline.run, format_stdstreams_tail_for_task, task, get_short_task_id)
+                              for task in tasks]
     output = []
     output.append(colorize("  %s" % list_title))
     table_rows = [
@@ -348,8 +523,16 @@ def format_task_list(tasks, list_title, table_header, get_short_task_id, format_
         output.extend(tasks_table)
     else:
         stdstreams = []
-        for task in tasks:
-            stdstreams.append(format_stdstreams_tail_for_task(task, get_short_task_id))
+        if executor is not None:
+            for task, future in zip(tasks, stdstreams_futures):
+                try:
+                    stdstreams.append(future.result(timeout=deadline.remaining()))
+                except (futures.TimeoutError, TimeoutError):
+                    stdstreams.append([PaastaColors.red("      couldn't read stdout/stderr for %s (%s)" % (
+                        get_short_task_id(task['id']), 'timeout'))])
+        else:
+            for task in tasks:
+                stdstreams.append(format_stdstreams_tail_for_task(task, get_short_task_id))
         output.append(tasks_table[0])  # header
         output.extend(zip_tasks_verbose_output(tasks_table[1:], stdstreams))
 
@@ -359,6 +542,11 @@ def format_task_list(tasks, list_title, table_header, get_short_task_id, format_
 def status_mesos_tasks_verbose(job_id, get_short_task_id, tail_stdstreams=False):
     """Returns detailed information about the mesos tasks for a service.
 
+    The slave of every task is queried once, and all slaves and stdout/stderr
+    tails are queried in parallel, each through the Timeout.run of a single
+    VERBOSE_STATUS_TIMEOUT deadline. Tasks whose lookups miss the deadline are
+    shown with partial information.
+
     :param job_id: An id used for looking up Mesos tasks
     :param get_short_task_id: A function which given a
                               task_id returns a short task_id suitable for
@@ -368,45 +556,57 @@ def status_mesos_tasks_verbose(job_id, get_short_task_id, tail_stdstreams=False)
     """
     output = []
     running_and_active_tasks = get_running_tasks_from_active_frameworks(job_id)
-    list_title = "Running Tasks:"
-    table_header = [
-        "Mesos Task ID",
-        "Host deployed to",
-        "Ram",
-        "CPU",
-        "Deployed at what localtime"
-    ]
-    output.extend(format_task_list(
-        running_and_active_tasks,
-        list_title,
-        table_header,
-        get_short_task_id,
-        format_running_mesos_task_row,
-        False,
-        tail_stdstreams
-    ))
-
     non_running_tasks = get_non_running_tasks_from_active_frameworks(job_id)
     # Order the tasks by timestamp
     non_running_tasks.sort(key=lambda task: get_first_status_timestamp(task))
     non_running_tasks_ordered = list(reversed(non_running_tasks[-10:]))
 
-    list_title = "Non-Running Tasks"
-    table_header = [
-        "Mesos Task ID",
-        "Host deployed to",
-        "Deployed at what localtime",
-        "Status",
-    ]
-    output.extend(format_task_list(
-        non_running_tasks_ordered,
-        list_title,
-        table_header,
-        get_short_task_id,
-        format_non_running_mesos_task_row,
-        True,
-        tail_stdstreams
-    ))
+    with futures.ThreadPoolExecutor(max_workers=VERBOSE_STATUS_WORKERS) as executor:
+        deadline = Timeout(VERBOSE_STATUS_TIMEOUT)
+        tasks = running_and_active_tasks + (non_running_tasks_ordered if tail_stdstreams else [])
+        prefetched_tasks = prefetch_tasks(tasks, executor, deadline, list_sandboxes=tail_stdstreams)
+        running_and_active_tasks = prefetched_tasks[:len(running_and_active_tasks)]
+        if tail_stdstreams:
+            non_running_tasks_ordered = prefetched_tasks[len(running_and_active_tasks):]
+
+        list_title = "Running Tasks:"
+        table_header = [
+            "Mesos Task ID",
+            "Host deployed to",
+            "Ram",
+            "CPU",
+            "Deployed at what localtime"
+        ]
+        output.extend(format_task_list(
+            running_and_active_tasks,
+            list_title,
+            table_header,
+            get_short_task_id,
+            format_running_mesos_task_row,
+            False,
+            tail_stdstreams,
+            executor,
+            deadline,
+        ))
+
+        list_title = "Non-Running Tasks"
+        table_header = [
+            "Mesos Task ID",
+            "Host deployed to",
+            "Deployed at what localtime",
+            "Status",
+        ]
+        output.extend(format_task_list(
+            non_running_tasks_ordered,
+            list_title,
+            table_header,
+            get_short_task_id,
+            format_non_running_mesos_task_row,
+            True,
+            tail_stdstreams,
+            executor,
+            deadline,
+        ))
 
     return "\n".join(output)
 
@@ -437,8 +637,8 @@ def get_local_slave_state():
     return json.loads(response.text)
 
 
-def get_mesos_state_from_leader():
-    """Fetches mesos state from the leader.
+def fetch_mesos_state_from_leader():
+    """Fetches mesos state from the leader, bypassing any cache.
     Raises an exception if the state doesn't look like it came from an
     elected leader, as we never want non-leader state data."""
     state = master.CURRENT.state
@@ -448,6 +648,256 @@ def get_mesos_state_from_leader():
     return state
 
 
+def read_mesos_state_snapshot(path):
+    """Reads a snapshot written by write_mesos_state_snapshot.
+
+    :param path: the path of the snapshot
+    :returns: a (state, fetched_at) tuple, or (None, None) if there is no readable snapshot
+    """
+    try:
+        with open(path, 'rb') as f:
+            fetched_at = os.fstat(f.fileno()).st_mtime
+            data = f.read()
+        return json.loads(zlib.decompress(data, 16 + zlib.MAX_WBITS)), fetched_at
+    except (IOError, OSError, ValueError, zlib.error):
+        return None, None
+
+
+def write_mesos_state_snapshot(path, state, fetched_at):
+    """Atomically replaces the snapshot at path with a gzipped copy of state.
+    The mtime of the snapshot records when the state was fetched from the master."""
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=1) as gz:
+        gz.write(json.dumps(state))
+    with atomic_file_write(path) as f:
+        f.write(buf.getvalue())
+    os.utime(path, (fetched_at, fetched_at))
+
+
+class MesosStateCache(object):
+    """Keeps the mesos master state for ttl seconds.
+
+    If snapshot_path is set the state is also shared with other processes on this host
+    through a gzipped snapshot on disk. Only one process at a time refreshes a stale
+    snapshot; the others wait for it and then read the new one.
+    """
+
+    def __init__(self, ttl=0, snapshot_path=None):
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.state = None
+        self.fetched_at = None
+
+    def is_fresh(self, fetched_at, now):
+        return fetched_at is not None and now - fetched_at < self.ttl
+
+    def get(self, fetch):
+        """Returns the cached state, calling fetch() to refresh it if it has expired."""
+        now = time.time()
+        if self.state is not None and self.is_fresh(self.fetched_at, now):
+            return self.state
+        if self.snapshot_path is not None and self.ttl > 0:
+            self.state, self.fetched_at = self.get_from_snapshot(fetch, now)
+        else:
+            self.state, self.fetched_at = fetch(), now
+        return self.state
+
+    def get_from_snapshot(self, fetch, now):
+        state, fetched_at = read_mesos_state_snapshot(self.snapshot_path)
+        if state is not None and self.is_fresh(fetched_at, now):
+            return state, fetched_at
+        try:
+            lockfile = open('%s.lock' % self.snapshot_path, 'a')
+        except IOError:
+            return fetch(), now
+        with lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            # Another process may have refreshed the snapshot while we were waiting for the lock
+            state, fetched_at = read_mesos_state_snapshot(self.snapshot_path)
+            now = time.time()
+            if state is not None and self.is_fresh(fetched_at, now):
+                return state, fetched_at
+            state = fetch()
+            try:
+                write_mesos_state_snapshot(self.snapshot_path, state, now)
+            except (IOError, OSError):
+                pass
+            return state, now
+
+
+_mesos_state_cache = None
+_compact_mesos_state_cache = None
+
+
+def make_mesos_state_cache(snapshot_suffix=''):
+    """Returns a MesosStateCache configured from the system paasta config. The snapshot
+    path is suffixed with snapshot_suffix, so that caches of different views of the
+    state don't share a snapshot."""
+    try:
+        system_paasta_config = load_system_paasta_config()
+    except PaastaNotConfiguredError:
+        return MesosStateCache()
+    snapshot_path = system_paasta_config.get_mesos_state_snapshot_path()
+    return MesosStateCache(
+        ttl=system_paasta_config.get_mesos_state_cache_ttl(),
+        snapshot_path=snapshot_path + snapshot_suffix if snapshot_path is not None else None,
+    )
+
+
+def get_mesos_state_cache():
+    """Returns the process-wide MesosStateCache, configured from the system paasta config."""
+    global _mesos_state_cache
+    if _mesos_state_cache is None:
+        _mesos_state_cache = make_mesos_state_cache()
+    return _mesos_state_cache
+
+
+def get_compact_mesos_state_cache():
+    """Returns the process-wide MesosStateCache of compact mesos states."""
+    global _compact_mesos_state_cache
+    if _compact_mesos_state_cache is None:
+        _compact_mesos_state_cache = make_mesos_state_cache(snapshot_suffix='.compact')
+    return _compact_mesos_state_cache
+
+
+def get_mesos_state_from_leader():
+    """Fetches mesos state from the leader, or from the mesos state cache if
+    it was fetched recently enough.
+    Raises an exception if the state doesn't look like it came from an
+    elected leader, as we never want non-leader state data."""
+    return get_mesos_state_cache().get(fetch_mesos_state_from_leader)
+
+
+COMPACT_RESOURCES = ('cpus', 'mem', 'disk')
+COMPACT_FLAGS = ('quorum', 'zk')
+
+
+def compact_resources(resources):
+    return {key: float(resources[key]) for key in COMPACT_RESOURCES if key in resources}
+
+
+def compact_slave(slave):
+    return {
+        'id': slave.get('id'),
+        'hostname': slave.get('hostname'),
+        'attributes': slave.get('attributes', {}),
+        'resources': compact_resources(slave.get('resources', {})),
+    }
+
+
+def compact_task(task):
+    return {
+        'id': task.get('id'),
+        'state': task.get('state'),
+        'slave_id': task.get('slave_id'),
+        'resources': compact_resources(task.get('resources', {})),
+    }
+
+
+def compact_mesos_state(state):
+    """Reduces an already parsed mesos master state to a compact state: a dictionary of the
+    same shape, with only the parts paasta_metastatus reads. Those are the elected_time,
+    the quorum and zk flags, the ids, hostnames, attributes and cpus/mem/disk of slaves,
+    and the names of frameworks with the ids, states, slave ids and cpus/mem/disk of
+    their (active) tasks."""
+    compact_state = {
+        'flags': {key: value for key, value in state.get('flags', {}).items() if key in COMPACT_FLAGS},
+        'slaves': [compact_slave(slave) for slave in state.get('slaves', [])],
+        'frameworks': [
+            {
+                'name': framework.get('name'),
+                'tasks': [compact_task(task) for task in framework.get('tasks', [])],
+            }
+            for framework in state.get('frameworks', [])
+        ],
+    }
+    if 'elected_time' in state:
+        compact_state['elected_time'] = state['elected_time']
+    return compact_state
+
+
+_SLAVE_PREFIX = 'slaves.item'
+_FRAMEWORK_PREFIX = 'frameworks.item'
+_TASK_PREFIX = 'frameworks.item.tasks.item'
+_SLAVE_ATTRIBUTES_PREFIX = '%s.attributes.' % _SLAVE_PREFIX
+_FLAGS_PREFIX = 'flags.'
+_SCALAR_EVENTS = frozenset(['string', 'number', 'boolean', 'null'])
+# Maps the full ijson prefix of every record field we keep to (record prefix, is_resource, field name),
+# so the vast majority of events (which belong to fields we don't keep) cost a single dict lookup.
+_COMPACT_FIELDS = dict(
+    [('%s.%s' % (_SLAVE_PREFIX, field), (_SLAVE_PREFIX, False, field)) for field in ('id', 'hostname')] +
+    [('%s.%s' % (_TASK_PREFIX, field), (_TASK_PREFIX, False, field)) for field in ('id', 'state', 'slave_id')] +
+    [('%s.name' % _FRAMEWORK_PREFIX, (_FRAMEWORK_PREFIX, False, 'name'))] +
+    [('%s.resources.%s' % (record_prefix, resource), (record_prefix, True, resource))
+     for record_prefix in (_SLAVE_PREFIX, _TASK_PREFIX) for resource in COMPACT_RESOURCES]
+)
+
+
+def parse_compact_mesos_state(fileobj):
+    """Incrementally parses a mesos master state document into the same compact state
+    as compact_mesos_state, so neither the document text nor its full object graph is
+    ever held in memory. Falls back to json.load (with the same result) if ijson isn't
+    installed.
+
+    :param fileobj: a file-like object returning the state as bytes
+    :returns: the compact state
+    """
+    if ijson is None:
+        return compact_mesos_state(json.load(fileobj))
+    compact_state = {'flags': {}, 'slaves': [], 'frameworks': []}
+    # record prefix -> the slave, framework or task currently being parsed
+    records = {}
+    for prefix, event, value in ijson.parse(fileobj):
+        field = _COMPACT_FIELDS.get(prefix)
+        if field is not None:
+            record_prefix, is_resource, name = field
+            if is_resource:
+                records[record_prefix]['resources'][name] = float(value)
+            else:
+                records[record_prefix][name] = value
+        elif event == 'start_map' and prefix in (_SLAVE_PREFIX, _TASK_PREFIX):
+            records[prefix] = {'attributes': {}, 'resources': {}}
+        elif event == 'start_map' and prefix == _FRAMEWORK_PREFIX:
+            records[prefix] = {'tasks': []}
+        elif event == 'end_map' and prefix == _SLAVE_PREFIX:
+            compact_state['slaves'].append(compact_slave(records.pop(prefix)))
+        elif event == 'end_map' and prefix == _TASK_PREFIX:
+            records[_FRAMEWORK_PREFIX]['tasks'].append(compact_task(records.pop(prefix)))
+        elif event == 'end_map' and prefix == _FRAMEWORK_PREFIX:
+            framework = records.pop(prefix)
+            compact_state['frameworks'].append({'name': framework.get('name'), 'tasks': framework['tasks']})
+        elif event in _SCALAR_EVENTS:
+            if _SLAVE_PREFIX in records and prefix.startswith(_SLAVE_ATTRIBUTES_PREFIX):
+                attribute = prefix[len(_SLAVE_ATTRIBUTES_PREFIX):]
+                records[_SLAVE_PREFIX]['attributes'][attribute] = float(value) if isinstance(value, Decimal) else value
+            elif prefix == 'elected_time':
+                compact_state['elected_time'] = float(value)
+            elif prefix.startswith(_FLAGS_PREFIX) and prefix[len(_FLAGS_PREFIX):] in COMPACT_FLAGS:
+                compact_state['flags'][prefix[len(_FLAGS_PREFIX):]] = value
+    return compact_state
+
+
+def fetch_compact_mesos_state_from_leader():
+    """Streams the mesos state from the leader straight into parse_compact_mesos_state,
+    bypassing any cache.
+    Raises an exception if the state doesn't look like it came from an
+    elected leader, as we never want non-leader state data."""
+    response = master.CURRENT.fetch('/master/state.json', stream=True)
+    response.raise_for_status()
+    response.raw.decode_content = True
+    compact_state = parse_compact_mesos_state(response.raw)
+    if 'elected_time' not in compact_state:
+        raise MasterNotAvailableException("We asked for the current leader state, "
+                                          "but it wasn't the elected leader. Please try again.")
+    return compact_state
+
+
+def get_compact_mesos_state_from_leader():
+    """Like get_mesos_state_from_leader, but returns the compact state, which is enough
+    for callers that only look at the quorum, frameworks, slaves and tasks."""
+    return get_compact_mesos_state_cache().get(fetch_compact_mesos_state_from_leader)
+
+
 def get_mesos_quorum(state):
     """Returns the configured quorum size.
     :param state: mesos state dictionary"""
@@ -475,30 +925,115 @@ def get_number_of_mesos_masters(zk_config):
     return len(result)
 
 
+class SlaveAttributeIndex(object):
+    """An index of mesos slaves by attribute, built once from a mesos state snapshot.
+
+    Every (attribute, value) pair maps to a bitset of the slaves that have it, with
+    slaves numbered in hostname order. Blacklists and whitelists are evaluated by
+    combining those bitsets, and the resulting groupings are memoized, so repeated
+    lookups for the same attribute and filters only copy the memoized grouping.
+    """
+
+    def __init__(self, slaves):
+        slaves = sorted(slaves, key=lambda slave: slave['hostname'])
+        self.hostnames = [slave['hostname'] for slave in slaves]
+        self.all_slaves = (1 << len(slaves)) - 1
+        self.bitsets = {}
+        for i, slave in enumerate(slaves):
+            for attribute, value in slave['attributes'].iteritems():
+                values = self.bitsets.setdefault(attribute, {})
+                values[value] = values.get(value, 0) | (1 << i)
+        self._grouped = {}
+
+    def hosts_for_bitset(self, bitset):
+        """Returns the sorted hostnames of the slaves in bitset"""
+        hosts = []
+        while bitset:
+            lowest_bit = bitset & -bitset
+            hosts.append(self.hostnames[lowest_bit.bit_length() - 1])
+            bitset ^= lowest_bit
+        return hosts
+
+    def slaves_matching(self, attribute, values):
+        """Returns a bitset of the slaves whose attribute is any of values"""
+        bitsets = self.bitsets.get(attribute, {})
+        matching = 0
+        for value in values:
+            matching |= bitsets.get(value, 0)
+        return matching
+
+    def allowed_slaves(self, blacklist, whitelist):
+        """Returns a bitset of the slaves that pass both the blacklist and the whitelist.
+        See slave_passes_blacklist and slave_passes_whitelist for their formats."""
+        allowed = self.all_slaves
+        for location_type, location in blacklist:
+            allowed &= ~self.slaves_matching(location_type, [location])
+        if len(whitelist) != 0:
+            location_type, locations = whitelist
+            allowed &= self.slaves_matching(location_type, locations)
+        return allowed
+
+    def grouped_by_attribute(self, attribute, blacklist=None, whitelist=None):
+        """Returns the same dictionary as get_mesos_slaves_grouped_by_attribute, with
+        the hosts for each value sorted by hostname."""
+        if blacklist is None:
+            blacklist = []
+        if whitelist is None:
+            whitelist = []
+        key = (
+            attribute,
+            tuple(tuple(entry) for entry in blacklist),
+            (whitelist[0], tuple(whitelist[1])) if whitelist else (),
+        )
+        if key not in self._grouped:
+            allowed = self.allowed_slaves(blacklist, whitelist)
+            if allowed == 0:
+                raise NoSlavesAvailable("No mesos slaves were available to query. Try again later")
+            grouped = {}
+            for value, bitset in self.bitsets.get(attribute, {}).iteritems():
+                if bitset & allowed:
+                    grouped[value] = self.hosts_for_bitset(bitset & allowed)
+            self._grouped[key] = grouped
+        return {value: list(hosts) for value, hosts in self._grouped[key].iteritems()}
+
+
+def get_slave_attributes_key(slaves):
+    """Returns a hashable summary of the hostnames and attributes of slaves, which
+    is all a SlaveAttributeIndex is built from"""
+    return tuple((slave['hostname'], frozenset(slave['attributes'].iteritems())) for slave in slaves)
+
+
+_slave_attribute_index = (None, None)
+
+
+def get_slave_attribute_index(mesos_state):
+    """Returns a SlaveAttributeIndex for mesos_state. The index of the most recent
+    slaves is kept, so it is only rebuilt when the slaves or their attributes change,
+    even if get_mesos_state_from_leader fetched a new copy of the state."""
+    global _slave_attribute_index
+    indexed_key, index = _slave_attribute_index
+    key = get_slave_attributes_key(mesos_state['slaves'])
+    if indexed_key != key:
+        index = SlaveAttributeIndex(mesos_state['slaves'])
+        _slave_attribute_index = (key, index)
+    return index
+
+
 def get_mesos_slaves_grouped_by_attribute(attribute, blacklist=None, whitelist=None):
     """Returns a dictionary of unique values and the corresponding hosts for a given Mesos attribute
 
     :param attribute: an attribute to filter
     :param blacklist: a list of [attribute, value] lists to exclude from the output list
-    :returns: a dictionary of the form {'<attribute_value>': [<list of hosts with attribute=attribute_value>]}
+    :param whitelist: a [attribute, [values]] list of slaves to restrict the output list to
+    :returns: a dictionary of the form {'<attribute_value>': [<sorted list of hosts with attribute=attribute_value>]}
               (response can contain multiple 'attribute_value)
     """
-    if blacklist is None:
-        blacklist = []
-    if whitelist is None:
-        whitelist = []
-    attr_map = {}
     mesos_state = get_mesos_state_from_leader()
-    slaves = mesos_state['slaves']
-    filtered_slaves = filter_mesos_slaves_by_blacklist(slaves=slaves, blacklist=blacklist, whitelist=whitelist)
-    if filtered_slaves == []:
-        raise NoSlavesAvailable("No mesos slaves were available to query. Try again later")
-    else:
-        for slave in filtered_slaves:
-            if attribute in slave['attributes']:
-                attr_val = slave['attributes'][attribute]
-                attr_map.setdefault(attr_val, []).append(slave['hostname'])
-        return attr_map
+    return get_slave_attribute_index(mesos_state).grouped_by_attribute(
+        attribute=attribute,
+        blacklist=blacklist,
+        whitelist=whitelist,
+    )
 
 
 def filter_mesos_slaves_by_blacklist(slaves, blacklist, whitelist):
@@ -547,35 +1082,195 @@ def slave_passes_whitelist(slave, whitelist):
     return False
 
 
-def get_container_id_for_mesos_id(client, mesos_task_id):
-    running_containers = client.containers()
+DEFAULT_CONTAINER_INDEX_PATH = '/var/run/paasta_container_index.json'
+# docker only keeps a short backlog of events, so an index that hasn't been brought
+# up to date for a while is rebuilt rather than replayed
+CONTAINER_INDEX_MAX_AGE = 300
+CONTAINER_INSPECT_WORKERS = 8
 
-    container_id = None
-    for container in running_containers:
-        info = client.inspect_container(container)
-        if info['Config']['Env']:
-            for env_var in info['Config']['Env']:
-                if ('MESOS_TASK_ID=%s' % mesos_task_id) in env_var:
-                    container_id = info['Id']
-                    break
 
-    return container_id
-
-
-def get_mesos_id_from_container(container, client):
-    mesos_id = None
-    info = client.inspect_container(container)
-    if info['Config']['Env']:
-        for env_var in info['Config']['Env']:
-            # In marathon it is like this
-            if 'MESOS_TASK_ID=' in env_var:
-                mesos_id = re.match("MESOS_TASK_ID=(.*)", env_var).group(1)
-                break
-            # Chronos it is like this?
-            if 'mesos_task_id=' in env_var:
-                mesos_id = re.match("mesos_task_id=(.*)", env_var).group(1)
-                break
-    return mesos_id
+def get_mesos_id_from_env(env):
+    """Returns the mesos task id set in a list of docker 'KEY=value' env vars, or None.
+
+    Marathon sets MESOS_TASK_ID, chronos sets mesos_task_id."""
+    for env_var in env or []:
+        for prefix in ('MESOS_TASK_ID=', 'mesos_task_id='):
+            if env_var.startswith(prefix):
+                return env_var[len(prefix):]
+    return None
+
+
+def inspect_containers(client, container_ids):
+    """Inspects containers concurrently.
+
+    :param client: a docker.Client
+    :param container_ids: the ids of the containers to inspect
+    :returns: a dict of container id to inspect output, leaving out containers that went away
+    """
+    def inspect(container_id):
+        try:
+            return client.inspect_container(container_id)
+        except requests.exceptions.RequestException:
+            return None
+
+    if not container_ids:
+        return {}
+    with futures.ThreadPoolExecutor(max_workers=min(CONTAINER_INSPECT_WORKERS, len(container_ids))) as executor:
+        infos = list(executor.map(inspect, container_ids))
+    return dict((container_id, info) for container_id, info in zip(container_ids, infos) if info is not None)
+
+
+class ContainerIdIndex(object):
+    """An index of the containers running on this host by mesos task id.
+
+    The index is built with one concurrent inspect pass over the running containers and
+    afterwards kept up to date from the docker events stream. If path is set the index
+    is shared with other processes on this host through a json file, so a healthcheck
+    only has to look at the containers started since the last one ran.
+    """
+
+    def __init__(self, path=DEFAULT_CONTAINER_INDEX_PATH, max_age=CONTAINER_INDEX_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        # container id -> mesos task id, or None for containers not started by mesos
+        self.containers = {}
+        self.updated_at = None
+
+    @property
+    def containers(self):
+        return self._containers
+
+    @containers.setter
+    def containers(self, containers):
+        self._containers = containers
+        # mesos task id -> container id, built on the first lookup after containers change
+        self._container_ids = None
+
+    def is_fresh(self, now):
+        return self.updated_at is not None and 0 <= now - self.updated_at < self.max_age
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.containers, self.updated_at = data['containers'], data['updated_at']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            self.containers, self.updated_at = {}, None
+
+    def save(self):
+        try:
+            with atomic_file_write(self.path) as f:
+                json.dump({'containers': self.containers, 'updated_at': self.updated_at}, f)
+        except (IOError, OSError):
+            pass
+
+    def rebuild(self, client, now):
+        """Replaces the index with the output of inspecting every running container."""
+        container_ids = [container['Id'] for container in client.containers(quiet=True)]
+        self.containers = dict(
+            (container_id, get_mesos_id_from_env(info['Config']['Env']))
+            for container_id, info in inspect_containers(client, container_ids).items()
+        )
+        self.updated_at = now
+
+    def apply_events(self, client, now):
+        """Applies the docker events between the last update and now to the index."""
+        started = set()
+        for event in client.events(since=self.updated_at, until=now, decode=True):
+            container_id = event.get('id')
+            if event.get('status') == 'start':
+                started.add(container_id)
+            elif event.get('status') in ('die', 'destroy'):
+                started.discard(container_id)
+                self.containers.pop(container_id, None)
+        for container_id, info in inspect_containers(client, list(started)).items():
+            self.containers[container_id] = get_mesos_id_from_env(info['Config']['Env'])
+        self._container_ids = None
+        self.updated_at = now
+
+    def update(self, client, now):
+        if self.is_fresh(now):
+            try:
+                self.apply_events(client, now)
+                return
+            except (requests.exceptions.RequestException, ValueError):
+                pass
+        self.rebuild(client, now)
+
+    def refresh(self, client, rebuild=False):
+        """Brings the index up to date, rebuilding it if it is stale or rebuild is set."""
+        # docker events only take whole seconds; replaying an event twice is harmless
+        now = int(time.time())
+        if rebuild:
+            self.updated_at = None
+        if self.path is None:
+            self.update(client, now)
+            return
+        try:
+            lockfile = open('%s.lock' % self.path, 'a')
+        except IOError:
+            self.update(client, now)
+            return
+        with lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            # Another process may have updated the index while we were waiting for the lock
+            if not rebuild:
+                self.load()
+            self.update(client, now)
+            self.save()
+
+    def get_container_id(self, client, mesos_task_id):
+        """Returns the id of the running container of a mesos task, or None.
+        The index is rebuilt once before giving up on a task it doesn't know about."""
+        self.refresh(client)
+        container_id = self.find_container_id(mesos_task_id)
+        if container_id is None:
+            self.refresh(client, rebuild=True)
+            container_id = self.find_container_id(mesos_task_id)
+        return container_id
+
+    def find_container_id(self, mesos_task_id):
+        if self._container_ids is None:
+            self._container_ids = dict(
+                (container_mesos_task_id, container_id)
+                for container_id, container_mesos_task_id in self.containers.iteritems()
+                if container_mesos_task_id is not None
+            )
+        return self._container_ids.get(mesos_task_id)
+
+    def get_mesos_task_id(self, client, container_id):
+        """Returns the mesos task id of a running container, or None if mesos didn't start it."""
+        if container_id not in self.containers:
+            self.refresh(client)
+        if container_id not in self.containers:
+            info = inspect_containers(client, [container_id]).get(container_id)
+            self.containers[container_id] = get_mesos_id_from_env(info['Config']['Env']) if info else None
+            self._container_ids = None
+        return self.containers[container_id]
+
+
+def get_container_id_for_mesos_id(client, mesos_task_id, index=None):
+    """Returns the id of the container running a mesos task on this host, or None.
+
+    :param client: a docker.Client
+    :param mesos_task_id: the mesos task id to look for
+    :param index: the ContainerIdIndex to look it up in; defaults to the one shared by this host
+    """
+    if index is None:
+        index = ContainerIdIndex()
+    return index.get_container_id(client, mesos_task_id)
+
+
+def get_mesos_id_from_container(container, client, index=None):
+    """Returns the mesos task id of a running container, or None.
+
+    :param container: a container dict from docker.Client.containers()
+    :param client: a docker.Client
+    :param index: the ContainerIdIndex to look it up in; defaults to the one shared by this host
+    """
+    if index is None:
+        index = ContainerIdIndex()
+    return index.get_mesos_task_id(client, container['Id'])
 
 
 def get_mesos_network_for_net(net):
@@ -24,14 +24,28 @@ Command line options:
 - -i <MESOS_TASK_ID>, --mesos-id <MESOS_TASK_ID>: Specify a Mesos task ID to search for
 - -c <command>, --cmd <command>: Shell command to execute in container
 - -t <timeout>, --timeout <timeout>: Timeout for command
+- --cache-exec-ids: Remember the exec id created for the command so later runs can start it straight away
 """
 import argparse
-import signal
+import fcntl
+import json
 import sys
+import time
 from contextlib import contextmanager
 
+from docker.errors import APIError
+
 from paasta_tools.mesos_tools import get_container_id_for_mesos_id
+from paasta_tools.utils import atomic_file_write
 from paasta_tools.utils import get_docker_client
+from paasta_tools.utils import Timeout
+from paasta_tools.utils import TimeoutError
+
+
+DEFAULT_EXEC_ID_CACHE_PATH = '/var/run/paasta_exec_id_cache.json'
+# Entries are dropped after this long, so the cache doesn't keep the exec ids of
+# containers that have gone away
+EXEC_ID_CACHE_MAX_AGE = 3600
 
 
 def parse_args():
@@ -39,6 +53,8 @@ def parse_args():
     parser.add_argument('-i', '--mesos-id', required=True, help="Mesos task ID")
     parser.add_argument('-c', '--cmd', required=True, help="command to execute in container")
     parser.add_argument('-t', '--timeout', default=45, type=int, help="timeout for command")
+    parser.add_argument('--cache-exec-ids', action='store_true',
+                        help="remember the exec id created for the command in %s" % DEFAULT_EXEC_ID_CACHE_PATH)
     args = parser.parse_args()
     return args
 
@@ -48,28 +64,101 @@ class TimeoutException(Exception):
 
 
 @contextmanager
-def time_limit(seconds):  # From http://stackoverflow.com/a/601168/1576438
-    def signal_handler(signum, frame):
-        raise TimeoutException('Timed out!')
-    signal.signal(signal.SIGALRM, signal_handler)
-    signal.alarm(seconds)
+def time_limit(seconds):
+    """A contextmanager yielding a utils.Timeout of seconds, which raises
+    TimeoutException instead of TimeoutError once it expires."""
     try:
-        yield
-    finally:
-        signal.alarm(0)
+        with Timeout(seconds, 'Timed out!') as deadline:
+            yield deadline
+    except TimeoutError as e:
+        raise TimeoutException(e.message)
+
 
+class ExecIdCache(object):
+    """Remembers the exec id created for each (container, cmd) in a json file.
 
-def execute_in_container(docker_client, container_id, cmd, timeout):
+    Reads don't take the lock as the file is always replaced atomically; writes
+    are serialized with a lock file and drop entries older than max_age.
+    """
+
+    def __init__(self, path=DEFAULT_EXEC_ID_CACHE_PATH, max_age=EXEC_ID_CACHE_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def get(self, container_id, cmd):
+        entry = self.load().get(container_id, {})
+        if time.time() - entry.get('created_at', 0) >= self.max_age:
+            return None
+        return entry.get('execs', {}).get(cmd)
+
+    def update(self, container_id, cmd, exec_id):
+        """Records exec_id for (container_id, cmd), or forgets it if exec_id is None."""
+        try:
+            lockfile = open('%s.lock' % self.path, 'a')
+        except IOError:
+            return
+        with lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            now = time.time()
+            entries = dict(
+                (entry_container_id, entry) for entry_container_id, entry in self.load().items()
+                if now - entry.get('created_at', 0) < self.max_age
+            )
+            entry = entries.setdefault(container_id, {'created_at': now, 'execs': {}})
+            if exec_id is None:
+                entry['execs'].pop(cmd, None)
+            else:
+                entry['execs'][cmd] = exec_id
+            try:
+                with atomic_file_write(self.path) as f:
+                    json.dump(entries, f)
+            except (IOError, OSError):
+                pass
+
+
+def find_exec_id(docker_client, container_id, cmd):
+    """Returns the id of an exec of '/bin/sh -c cmd' already created in the container, or None."""
     container_info = docker_client.inspect_container(container_id)
     if container_info['ExecIDs'] and len(container_info['ExecIDs']) > 0:
         for possible_exec_id in container_info['ExecIDs']:
-            exec_info = docker_client.exec_inspect(possible_exec_id)['ProcessConfig']
+            try:
+                exec_info = docker_client.exec_inspect(possible_exec_id)['ProcessConfig']
+            except APIError:
+                continue
             if exec_info['entrypoint'] == '/bin/sh' and exec_info['arguments'] == ['-c', cmd]:
-                exec_id = possible_exec_id
-                break
-    else:
-        exec_id = docker_client.exec_create(container_id, ['/bin/sh', '-c', cmd])['Id']
-    output = docker_client.exec_start(exec_id, stream=False)
+                return possible_exec_id
+    return None
+
+
+def execute_in_container(docker_client, container_id, cmd, timeout, exec_id_cache=None):
+    """Runs '/bin/sh -c cmd' in the container, reusing an exec of it if there is one.
+
+    :param exec_id_cache: an optional ExecIdCache to look the exec id up in before
+                          searching the execs of the container for it
+    :returns: a tuple of the output and the return code of cmd
+    """
+    exec_id = exec_id_cache.get(container_id, cmd) if exec_id_cache else None
+    output = None
+    if exec_id is not None:
+        try:
+            output = docker_client.exec_start(exec_id, stream=False)
+        except APIError:
+            exec_id_cache.update(container_id, cmd, None)
+            exec_id = None
+    if exec_id is None:
+        exec_id = find_exec_id(docker_client, container_id, cmd)
+        if exec_id is None:
+            exec_id = docker_client.exec_create(container_id, ['/bin/sh', '-c', cmd])['Id']
+        if exec_id_cache:
+            exec_id_cache.update(container_id, cmd, exec_id)
+        output = docker_client.exec_start(exec_id, stream=False)
     return_code = docker_client.exec_inspect(exec_id)['ExitCode']
     return (output, return_code)
 
@@ -82,14 +171,18 @@ def main():
             "The Mesos task id you supplied seems to be an empty string! Please provide a valid task id.\n")
         sys.exit(2)
 
+    # The container lookup and the exec share this client and so its connection to docker
     docker_client = get_docker_client()
+    exec_id_cache = ExecIdCache() if args.cache_exec_ids else None
 
     container_id = get_container_id_for_mesos_id(docker_client, args.mesos_id)
 
     if container_id:
         try:
-            with time_limit(args.timeout):
-                output, return_code = execute_in_container(docker_client, container_id, args.cmd, args.timeout)
+            with time_limit(args.timeout) as deadline:
+                # docker-py can't give up on a running exec, so stop waiting for it instead
+                output, return_code = deadline.run(
+                    execute_in_container, docker_client, container_id, args.cmd, args.timeout, exec_id_cache)
             sys.stdout.write(output)
         except TimeoutException:
             sys.stdout.write("Command timed out!\n")
@@ -13,24 +13,35 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import argparse
-import copy
+import BaseHTTPServer
+import json
+import logging
+import math
+import re
 import sys
+import threading
+import time
 from collections import Counter
-from collections import defaultdict
+from collections import namedtuple
 from collections import OrderedDict
 
 from httplib2 import ServerNotFoundError
 from humanize import naturalsize
 from marathon.exceptions import MarathonError
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from paasta_tools import chronos_tools
 from paasta_tools import marathon_tools
 from paasta_tools.chronos_tools import ChronosNotConfigured
 from paasta_tools.chronos_tools import get_chronos_client
 from paasta_tools.chronos_tools import load_chronos_config
 from paasta_tools.marathon_tools import MarathonNotConfigured
+from paasta_tools.mesos_tools import get_compact_mesos_state_from_leader
 from paasta_tools.mesos_tools import get_mesos_quorum
-from paasta_tools.mesos_tools import get_mesos_state_from_leader
 from paasta_tools.mesos_tools import get_mesos_stats
 from paasta_tools.mesos_tools import get_number_of_mesos_masters
 from paasta_tools.mesos_tools import get_zookeeper_config
@@ -38,6 +49,13 @@ from paasta_tools.mesos_tools import MasterNotAvailableException
 from paasta_tools.utils import format_table
 from paasta_tools.utils import PaastaColors
 from paasta_tools.utils import print_with_indent
+from paasta_tools.utils import remove_ansi_escape_sequences
+
+
+log = logging.getLogger('__main__')
+
+DEFAULT_EXPORTER_PORT = 9473
+DEFAULT_EXPORTER_INTERVAL = 60
 
 
 def parse_args():
@@ -48,6 +66,24 @@ def parse_args():
                         help="Print out more output regarding the state of the cluster")
     parser.add_argument('-H', '--humanize', action='store_true', dest="humanize", default=False,
                         help="Print human-readable sizes")
+    parser.add_argument('--json', action='store_true', dest="json", default=False,
+                        help="Print every check result and resource figure as a single JSON document")
+    parser.add_argument('--exporter', action='store_true', dest="exporter", default=False,
+                        help="Run continuously, serving the same data as --json in the Prometheus text "
+                             "format on http://localhost:PORT/metrics")
+    parser.add_argument('--port', type=int, dest="port", default=DEFAULT_EXPORTER_PORT,
+                        help="Port for --exporter to listen on. Defaults to %(default)s")
+    parser.add_argument('--interval', type=int, dest="interval", default=DEFAULT_EXPORTER_INTERVAL,
+                        help="Seconds between refreshes of the --exporter data. Defaults to %(default)s")
+    parser.add_argument('--fit', type=parse_fit_spec, dest="fit", metavar="CPUS,MEM,DISK[,ATTRIBUTE]",
+                        help="Instead of the usual checks, print how many more tasks of this shape fit on "
+                             "the free resources of the slaves, grouped by ATTRIBUTE if given")
+    parser.add_argument('--pool', dest="pool",
+                        help="Only fit --fit tasks on slaves of this pool")
+    parser.add_argument('--constraint', type=parse_constraint, action='append', dest="constraints", default=[],
+                        metavar="ATTRIBUTE:OPERATOR[:VALUE]",
+                        help="Only fit --fit tasks where this marathon-style constraint allows. "
+                             "Supports LIKE, UNLIKE, CLUSTER and hostname:UNIQUE. May be given more than once")
     return parser.parse_args()
 
 
@@ -80,47 +116,275 @@ def get_mesos_disk_status(metrics):
     return total, used, available
 
 
-def filter_mesos_state_metrics(dictionary):
-    valid_keys = ['cpus', 'mem', 'disk']
-    return {key: value for (key, value) in dictionary.items() if key in valid_keys}
+RESOURCE_NAMES = ('cpus', 'mem', 'disk')
 
+SlaveResourceVectors = namedtuple('SlaveResourceVectors', ['slaves', 'total', 'used', 'total_present', 'used_present'])
 
-def get_extra_mesos_slave_data(mesos_state):
-    slaves = dict((slave['id'], {
-        'total_resources': Counter(filter_mesos_state_metrics(slave['resources'])),
-        'hostname': slave['hostname'],
-        'free_resources': Counter(filter_mesos_state_metrics(slave['resources'])),
-    }) for slave in mesos_state['slaves'])
 
+def get_resource_vector(resources):
+    """Returns a resources dictionary as a [cpus, mem, disk] list, and a bitmask
+    of which of those resources were actually present in the dictionary."""
+    present = ('cpus' in resources) | ('mem' in resources) << 1 | ('disk' in resources) << 2
+    return [resources.get('cpus', 0), resources.get('mem', 0), resources.get('disk', 0)], present
+
+
+def resource_counter(vector, present):
+    """The inverse of get_resource_vector: returns a Counter of only the present resources."""
+    return Counter({name: vector[i] for i, name in enumerate(RESOURCE_NAMES) if present & (1 << i)})
+
+
+def to_rows(vectors):
+    """Returns resource vectors as a list of lists of python numbers"""
+    return vectors.tolist() if numpy is not None else vectors
+
+
+def group_sum(vectors, group_indexes, num_groups):
+    """Sums resource vectors into num_groups groups, vectors[i] being added to group group_indexes[i]."""
+    if numpy is not None:
+        sums = numpy.zeros((num_groups, len(RESOURCE_NAMES)))
+        if len(group_indexes):
+            numpy.add.at(sums, numpy.array(group_indexes, dtype=int), vectors)
+        return sums
+    sums = [[0, 0, 0] for _ in xrange(num_groups)]
+    for group_index, vector in zip(group_indexes, vectors):
+        group = sums[group_index]
+        for i in xrange(len(RESOURCE_NAMES)):
+            group[i] += vector[i]
+    return sums
+
+
+def subtract_vectors(minuends, subtrahends):
+    if numpy is not None:
+        return minuends - subtrahends
+    return [[a - b for a, b in zip(minuend, subtrahend)] for minuend, subtrahend in zip(minuends, subtrahends)]
+
+
+_slave_resource_vectors = (None, None)
+
+
+def get_slave_resource_vectors(mesos_state):
+    """Computes the total and used resources of every slave, in a single pass over the
+    tasks of every framework. Uses numpy for the reductions when it is available.
+    The vectors of the most recent mesos_state are kept, as the slave and attribute
+    tables are both built from them.
+
+    :returns: a SlaveResourceVectors of the slaves, their total and used [cpus, mem, disk]
+              vectors, and bitmasks of which resources their own and their tasks' resources defined
+    """
+    global _slave_resource_vectors
+    vectors_state, vectors = _slave_resource_vectors
+    if vectors_state is mesos_state:
+        return vectors
+
+    slaves = mesos_state['slaves']
+    slave_indexes = {}
+    total = []
+    total_present = []
+    for i, slave in enumerate(slaves):
+        slave_indexes[slave['id']] = i
+        vector, present = get_resource_vector(slave['resources'])
+        total.append(vector)
+        total_present.append(present)
+
+    task_slave_indexes = []
+    task_vectors = []
+    used_present = [0] * len(slaves)
     for framework in mesos_state.get('frameworks', []):
         for task in framework.get('tasks', []):
-            mesos_metrics = filter_mesos_state_metrics(task['resources'])
-            slaves[task['slave_id']]['free_resources'].subtract(mesos_metrics)
+            slave_index = slave_indexes[task['slave_id']]
+            vector, present = get_resource_vector(task['resources'])
+            task_slave_indexes.append(slave_index)
+            task_vectors.append(vector)
+            used_present[slave_index] |= present
+    if numpy is not None:
+        total = numpy.array(total, dtype=float).reshape(-1, len(RESOURCE_NAMES))
+        task_vectors = numpy.array(task_vectors, dtype=float).reshape(-1, len(RESOURCE_NAMES))
+
+    vectors = SlaveResourceVectors(
+        slaves=slaves,
+        total=total,
+        used=group_sum(task_vectors, task_slave_indexes, len(slaves)),
+        total_present=total_present,
+        used_present=used_present,
+    )
+    _slave_resource_vectors = (mesos_state, vectors)
+    return vectors
 
-    return sorted(slaves.values())
+
+def get_extra_mesos_slave_data(mesos_state):
+    vectors = get_slave_resource_vectors(mesos_state)
+    total = to_rows(vectors.total)
+    free = to_rows(subtract_vectors(vectors.total, vectors.used))
+    slaves = [{
+        'total_resources': resource_counter(total[i], vectors.total_present[i]),
+        'hostname': slave['hostname'],
+        'free_resources': resource_counter(free[i], vectors.total_present[i] | vectors.used_present[i]),
+    } for i, slave in enumerate(vectors.slaves)]
+    return sorted(slaves)
 
 
 def get_extra_mesos_attribute_data(mesos_state):
-    attributes = set().union(*(slave['attributes'].keys() for slave in mesos_state['slaves']))
+    vectors = get_slave_resource_vectors(mesos_state)
+    attributes = set().union(*(slave['attributes'].keys() for slave in vectors.slaves))
 
     for attribute in attributes:
-        resource_free_dict = defaultdict(Counter)
-        resource_availability_dict = dict()
-        slave_attribute_mapping = {}
-        for slave in mesos_state['slaves']:
-            slave_attribute_name = slave['attributes'].get(attribute, 'UNDEFINED')
-            slave_attribute_mapping[slave['id']] = slave_attribute_name
-            filtered_resources = filter_mesos_state_metrics(slave['resources'])
-            resource_free_dict[slave_attribute_name].update(filtered_resources)
-        resource_availability_dict = copy.deepcopy(resource_free_dict)
-        for framework in mesos_state.get('frameworks', []):
-            for task in framework.get('tasks', []):
-                task_resources = task['resources']
-                attribute_value = slave_attribute_mapping[task['slave_id']]
-                resource_free_dict[attribute_value].subtract(filter_mesos_state_metrics(task_resources))
+        attribute_values = []
+        attribute_indexes = {}
+        slave_groups = []
+        for slave in vectors.slaves:
+            attribute_value = slave['attributes'].get(attribute, 'UNDEFINED')
+            if attribute_value not in attribute_indexes:
+                attribute_indexes[attribute_value] = len(attribute_values)
+                attribute_values.append(attribute_value)
+            slave_groups.append(attribute_indexes[attribute_value])
+
+        group_total = group_sum(vectors.total, slave_groups, len(attribute_values))
+        group_used = group_sum(vectors.used, slave_groups, len(attribute_values))
+        group_free = to_rows(subtract_vectors(group_total, group_used))
+        group_total = to_rows(group_total)
+        group_total_present = [0] * len(attribute_values)
+        group_used_present = [0] * len(attribute_values)
+        for slave_index, group_index in enumerate(slave_groups):
+            group_total_present[group_index] |= vectors.total_present[slave_index]
+            group_used_present[group_index] |= vectors.used_present[slave_index]
+
+        resource_free_dict = {}
+        resource_availability_dict = {}
+        for i, attribute_value in enumerate(attribute_values):
+            resource_availability_dict[attribute_value] = resource_counter(group_total[i], group_total_present[i])
+            resource_free_dict[attribute_value] = resource_counter(
+                group_free[i], group_total_present[i] | group_used_present[i])
         yield (attribute, {"free": resource_free_dict, "availability": resource_availability_dict})
 
 
+FitSpec = namedtuple('FitSpec', ['shape', 'attribute'])
+
+SUPPORTED_CONSTRAINT_OPERATORS = ('LIKE', 'UNLIKE', 'CLUSTER', 'UNIQUE', 'GROUP_BY')
+
+
+def parse_fit_spec(spec):
+    """Parses a --fit argument of the form CPUS,MEM,DISK[,ATTRIBUTE] into a FitSpec"""
+    parts = spec.split(',')
+    if len(parts) not in (3, 4):
+        raise argparse.ArgumentTypeError("expected CPUS,MEM,DISK[,ATTRIBUTE], got %r" % spec)
+    try:
+        shape = tuple(float(part) for part in parts[:3])
+    except ValueError:
+        raise argparse.ArgumentTypeError("CPUS, MEM and DISK must be numbers, got %r" % spec)
+    if any(amount < 0 for amount in shape) or not any(amount > 0 for amount in shape):
+        raise argparse.ArgumentTypeError("CPUS, MEM and DISK must not be negative, and at least one must be positive")
+    return FitSpec(shape=shape, attribute=parts[3] if len(parts) == 4 else None)
+
+
+def parse_constraint(constraint):
+    """Parses a --constraint argument of the form ATTRIBUTE:OPERATOR[:VALUE] into
+    a marathon-style [attribute, operator(, value)] constraint"""
+    parts = constraint.split(':', 2)
+    if len(parts) < 2 or parts[1] not in SUPPORTED_CONSTRAINT_OPERATORS:
+        raise argparse.ArgumentTypeError("expected ATTRIBUTE:OPERATOR[:VALUE] with an operator of %s, got %r" % (
+            ', '.join(SUPPORTED_CONSTRAINT_OPERATORS), constraint))
+    if parts[1] in ('LIKE', 'UNLIKE', 'CLUSTER') and len(parts) != 3:
+        raise argparse.ArgumentTypeError("%s constraints need a value, got %r" % (parts[1], constraint))
+    if parts[1] == 'UNIQUE' and parts[0] != 'hostname':
+        raise argparse.ArgumentTypeError("only hostname:UNIQUE constraints are supported, got %r" % constraint)
+    if parts[1] == 'UNIQUE':
+        return parts[:2]
+    return parts
+
+
+def get_slave_attribute(slave, attribute, default=None):
+    if attribute == 'hostname':
+        return slave['hostname']
+    return slave['attributes'].get(attribute, default)
+
+
+def slave_passes_constraints(slave, constraints):
+    """Returns whether marathon would place a task with these constraints on slave.
+    GROUP_BY and UNIQUE constraints don't exclude any slave, so they always pass."""
+    for constraint in constraints:
+        attribute, operator = constraint[:2]
+        value = get_slave_attribute(slave, attribute)
+        if operator == 'CLUSTER':
+            if value is None or str(value) != constraint[2]:
+                return False
+        elif operator in ('LIKE', 'UNLIKE'):
+            matches = value is not None and re.match('(?:%s)\\Z' % constraint[2], str(value)) is not None
+            if matches != (operator == 'LIKE'):
+                return False
+    return True
+
+
+def get_instances_that_fit(vectors, shape, allowed, max_per_slave=None):
+    """Bin-packs tasks of shape onto the free resources of every slave.
+
+    :param vectors: the SlaveResourceVectors of the slaves
+    :param shape: the (cpus, mem, disk) of one task
+    :param allowed: a list of whether each slave may run the task at all
+    :param max_per_slave: the most tasks any one slave may run, or None for no limit
+    :returns: a list of how many more tasks fit on each slave
+    """
+    free = subtract_vectors(vectors.total, vectors.used)
+    needed = [i for i, amount in enumerate(shape) if amount > 0]
+    if numpy is not None:
+        needed_shape = numpy.array([shape[i] for i in needed])
+        # The epsilon stops float error in the free resources rounding a task that exactly fits down
+        fits = numpy.floor(free[:, needed] / needed_shape + 1e-9).min(axis=1)
+        fits = numpy.clip(fits, 0, max_per_slave)
+        fits[~numpy.array(allowed, dtype=bool)] = 0
+        return fits.astype(int).tolist()
+    fits = []
+    for slave_free, slave_allowed in zip(free, allowed):
+        if not slave_allowed:
+            fits.append(0)
+            continue
+        fit = max(0, min(int(math.floor(slave_free[i] / shape[i] + 1e-9)) for i in needed))
+        fits.append(fit if max_per_slave is None else min(fit, max_per_slave))
+    return fits
+
+
+def get_fit_data(mesos_state, shape, attribute=None, constraints=()):
+    """Computes how many more tasks of shape fit on the slaves that constraints allow.
+
+    :param mesos_state: the mesos state from the leader
+    :param shape: the (cpus, mem, disk) of one task
+    :param attribute: a slave attribute to group the results by, or None
+    :param constraints: a list of marathon-style constraints
+    :returns: a JSON-serializable dictionary of the total number of tasks that fit, and of the
+              number of tasks that fit and of allowed slaves for each value of attribute
+    """
+    vectors = get_slave_resource_vectors(mesos_state)
+    allowed = [slave_passes_constraints(slave, constraints) for slave in vectors.slaves]
+    max_per_slave = 1 if ['hostname', 'UNIQUE'] in constraints else None
+    fits = get_instances_that_fit(vectors, shape, allowed, max_per_slave)
+
+    groups = {}
+    if attribute is not None:
+        for slave, slave_allowed, fit in zip(vectors.slaves, allowed, fits):
+            if slave_allowed:
+                group = groups.setdefault(get_slave_attribute(slave, attribute, 'UNDEFINED'),
+                                          {'instances': 0, 'slaves': 0})
+                group['instances'] += fit
+                group['slaves'] += 1
+    return {
+        'shape': dict(zip(RESOURCE_NAMES, shape)),
+        'attribute': attribute,
+        'instances': sum(fits),
+        'slaves': sum(allowed),
+        'groups': groups,
+    }
+
+
+def format_fit_data(fit_data):
+    """Returns get_fit_data as a table"""
+    rows = [((fit_data['attribute'] or 'Slaves').capitalize(), 'Instances', 'Slaves')]
+    for value in sorted(fit_data['groups']):
+        group = fit_data['groups'][value]
+        rows.append((str(value), str(group['instances']), str(group['slaves'])))
+    rows.append(('Total', str(fit_data['instances']), str(fit_data['slaves'])))
+    shape = ', '.join('%s=%g' % (name, fit_data['shape'][name]) for name in RESOURCE_NAMES)
+    return '\n'.join(['Additional instances of %s that fit:' % shape] + ['    %s' % row for row in format_table(rows)])
+
+
 def quorum_ok(masters, quorum):
     return masters >= quorum
 
@@ -318,14 +582,16 @@ def slaves_registered(mesos_state):
     return 'slaves' in mesos_state and mesos_state['slaves']
 
 
-def get_mesos_status(mesos_state, verbosity, humanize_output=False):
+def get_mesos_status(mesos_state, verbosity, humanize_output=False, metrics=None):
     """Gathers information about the mesos cluster.
+       :param metrics: the mesos metrics, fetched with get_mesos_stats if not given
        :return: tuple of a string containing the status and a bool representing if it is ok or not
     """
 
     cluster_results = run_healthchecks_with_param(mesos_state, [assert_quorum_size, assert_no_duplicate_frameworks])
 
-    metrics = get_mesos_stats()
+    if metrics is None:
+        metrics = get_mesos_stats()
     metrics_results = run_healthchecks_with_param(metrics, [
         assert_cpu_health,
         assert_memory_health,
@@ -348,8 +614,20 @@ def run_healthchecks_with_param(param, healthcheck_functions, format_options={})
     return [healthcheck(param, **format_options) for healthcheck in healthcheck_functions]
 
 
-def assert_marathon_apps(client):
-    num_apps = len(client.list_apps())
+def get_marathon_listings(client):
+    """Lists the apps, tasks and deployments of marathon, once each.
+
+    :returns: a dictionary of 'apps', 'tasks' and 'deployments' to their lists
+    """
+    return {
+        'apps': client.list_apps(),
+        'tasks': client.list_tasks(),
+        'deployments': client.list_deployments(),
+    }
+
+
+def assert_marathon_apps(marathon_listings):
+    num_apps = len(marathon_listings['apps'])
     if num_apps < 1:
         return (PaastaColors.red(
             "CRITICAL: No marathon apps running"),
@@ -360,44 +638,54 @@ def assert_marathon_apps(client):
                 True)
 
 
-def assert_marathon_tasks(client):
-    num_tasks = len(client.list_tasks())
+def assert_marathon_tasks(marathon_listings):
+    num_tasks = len(marathon_listings['tasks'])
     return ("marathon tasks: %d"
             % num_tasks,
             True)
 
 
-def assert_marathon_deployments(client):
-    num_deployments = len(client.list_deployments())
+def assert_marathon_deployments(marathon_listings):
+    num_deployments = len(marathon_listings['deployments'])
     return ("marathon deployments: %d"
             % num_deployments,
             True)
 
 
-def get_marathon_status(client):
-    """ Gathers information about marathon.
-    :return: string containing the status.  """
-    return run_healthchecks_with_param(client, [
+def check_marathon_listings(marathon_listings):
+    """Runs the marathon healthchecks against the result of get_marathon_listings."""
+    return run_healthchecks_with_param(marathon_listings, [
         assert_marathon_apps,
         assert_marathon_tasks,
         assert_marathon_deployments])
 
 
-def assert_chronos_scheduled_jobs(client):
+def get_marathon_status(client):
+    """ Gathers information about marathon.
+    :return: string containing the status.  """
+    return check_marathon_listings(get_marathon_listings(client))
+
+
+def assert_chronos_scheduled_jobs(chronos_jobs):
     """
     :returns: a tuple of a string and a bool containing representing if it is ok or not
     """
-    num_jobs = len(chronos_tools.filter_enabled_jobs(client.list()))
+    num_jobs = len(chronos_tools.filter_enabled_jobs(chronos_jobs))
     return ("Enabled chronos jobs: %d" % num_jobs, True)
 
 
+def check_chronos_jobs(chronos_jobs):
+    """Runs the chronos healthchecks against a listing of the chronos jobs."""
+    return run_healthchecks_with_param(chronos_jobs, [
+        assert_chronos_scheduled_jobs,
+    ])
+
+
 def get_chronos_status(chronos_client):
     """Gather information about chronos.
     :return: string containing the status
     """
-    return run_healthchecks_with_param(chronos_client, [
-        assert_chronos_scheduled_jobs,
-    ])
+    return check_chronos_jobs(chronos_client.list())
 
 
 def get_marathon_client(marathon_config):
@@ -447,13 +735,286 @@ def print_results_for_healthchecks(summary, ok, results, verbose):
             print_with_indent(line, 2)
 
 
+def format_results_for_json(results):
+    return [{'output': remove_ansi_escape_sequences(output), 'ok': ok} for output, ok in results]
+
+
+def format_resources_for_json(resources):
+    return {name: resources[name] for name in RESOURCE_NAMES}
+
+
+def get_mesos_data(mesos_state, metrics):
+    """Returns the mesos check results and figures as a JSON-serializable dictionary."""
+    results = get_mesos_status(mesos_state, verbosity=0, metrics=metrics)
+    data = {
+        'ok': all(status_for_results(results)),
+        'checks': format_results_for_json(results),
+        'masters': get_num_masters(mesos_state),
+        'quorum': get_mesos_quorum(mesos_state),
+        'frameworks': dict(Counter([framework['name'] for framework in mesos_state['frameworks']])),
+        'tasks': {state: metrics['master/tasks_%s' % state] for state in ('running', 'staging', 'starting')},
+        'slaves': {state: metrics['master/slaves_%s' % state] for state in ('active', 'inactive')},
+    }
+    for name in RESOURCE_NAMES:
+        data[name] = {'total': metrics['master/%s_total' % name], 'used': metrics['master/%s_used' % name]}
+    return data
+
+
+def get_resource_data(mesos_state):
+    """Returns the free and total resources of every slave, and of every slave attribute value."""
+    if not slaves_registered(mesos_state):
+        return {'slaves': [], 'attributes': {}}
+    slaves = [{
+        'hostname': slave['hostname'],
+        'free': format_resources_for_json(slave['free_resources']),
+        'total': format_resources_for_json(slave['total_resources']),
+    } for slave in get_extra_mesos_slave_data(mesos_state)]
+    attributes = {}
+    for attribute, resource_dict in get_extra_mesos_attribute_data(mesos_state):
+        attributes[attribute] = {
+            attribute_value: {
+                'free': format_resources_for_json(resource_dict['free'][attribute_value]),
+                'total': format_resources_for_json(resource_dict['availability'][attribute_value]),
+            } for attribute_value in resource_dict['free']
+        }
+    return {'slaves': sorted(slaves, key=lambda slave: slave['hostname']), 'attributes': attributes}
+
+
+def get_marathon_data(marathon_client):
+    """Returns the marathon check results and figures as a JSON-serializable dictionary,
+    listing each kind of object once."""
+    if marathon_client is None:
+        results = [('marathon is not configured to run here', True)]
+        return {'configured': False, 'ok': True, 'checks': format_results_for_json(results)}
+    try:
+        marathon_listings = get_marathon_listings(marathon_client)
+    except MarathonError as e:
+        results = [(PaastaColors.red("CRITICAL: Unable to contact Marathon! Error: %s" % e), False)]
+        return {'configured': True, 'ok': False, 'error': str(e), 'checks': format_results_for_json(results)}
+    results = check_marathon_listings(marathon_listings)
+    data = {
+        'configured': True,
+        'ok': all(status_for_results(results)),
+        'checks': format_results_for_json(results),
+    }
+    for key in ('apps', 'tasks', 'deployments'):
+        data[key] = len(marathon_listings[key])
+    return data
+
+
+def get_chronos_data(chronos_client):
+    """Returns the chronos check results and figures as a JSON-serializable dictionary."""
+    if chronos_client is None:
+        results = [('chronos is not configured to run here', True)]
+        return {'configured': False, 'ok': True, 'checks': format_results_for_json(results)}
+    try:
+        jobs = chronos_client.list()
+    except ServerNotFoundError as e:
+        results = [(PaastaColors.red("CRITICAL: Unable to contact Chronos! Error: %s" % e), False)]
+        return {'configured': True, 'ok': False, 'error': str(e), 'checks': format_results_for_json(results)}
+    results = check_chronos_jobs(jobs)
+    return {
+        'configured': True,
+        'ok': all(status_for_results(results)),
+        'checks': format_results_for_json(results),
+        'enabled_jobs': len(chronos_tools.filter_enabled_jobs(jobs)),
+    }
+
+
+def get_configured_clients():
+    """Returns a (marathon client, chronos client) tuple, either of which is None
+    if that framework isn't configured to run here."""
+    try:
+        marathon_client = get_marathon_client(marathon_tools.load_marathon_config())
+    except MarathonNotConfigured:
+        marathon_client = None
+    try:
+        chronos_client = get_chronos_client(load_chronos_config())
+    except ChronosNotConfigured:
+        chronos_client = None
+    return marathon_client, chronos_client
+
+
+def get_metastatus_data(mesos_state, marathon_client, chronos_client):
+    """Gathers everything paasta_metastatus knows about the cluster into a JSON-serializable dictionary.
+
+    :param mesos_state: the mesos state from the leader
+    :param marathon_client: a marathon client, or None if marathon isn't configured here
+    :param chronos_client: a chronos client, or None if chronos isn't configured here
+    """
+    data = {
+        'mesos': get_mesos_data(mesos_state, get_mesos_stats()),
+        'marathon': get_marathon_data(marathon_client),
+        'chronos': get_chronos_data(chronos_client),
+    }
+    data.update(get_resource_data(mesos_state))
+    data['ok'] = all(data[framework]['ok'] for framework in ('mesos', 'marathon', 'chronos'))
+    return data
+
+
+def collect_metastatus_data():
+    """Fetches the compact mesos state (through the mesos state cache) and returns get_metastatus_data for it."""
+    marathon_client, chronos_client = get_configured_clients()
+    return get_metastatus_data(get_compact_mesos_state_from_leader(), marathon_client, chronos_client)
+
+
+def escape_prometheus_label_value(value):
+    return unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_prometheus_metric(name, value, labels=None):
+    if labels:
+        formatted_labels = ','.join('%s="%s"' % (key, escape_prometheus_label_value(labels[key]))
+                                    for key in sorted(labels))
+        return '%s{%s} %s' % (name, formatted_labels, float(value))
+    return '%s %s' % (name, float(value))
+
+
+def format_prometheus_metrics(data):
+    """Renders get_metastatus_data in the Prometheus text exposition format."""
+    samples = {}
+
+    def add(metric, sample, **labels):
+        samples.setdefault(metric, []).append(format_prometheus_metric(metric, sample, labels))
+
+    for framework in ('mesos', 'marathon', 'chronos'):
+        add('paasta_metastatus_ok', data[framework]['ok'], framework=framework)
+
+    mesos = data['mesos']
+    add('paasta_mesos_masters', mesos['masters'])
+    add('paasta_mesos_quorum', mesos['quorum'])
+    for name in RESOURCE_NAMES:
+        add('paasta_mesos_resource_total', mesos[name]['total'], resource=name)
+        add('paasta_mesos_resource_used', mesos[name]['used'], resource=name)
+    for state, count in mesos['tasks'].items():
+        add('paasta_mesos_tasks', count, state=state)
+    for state, count in mesos['slaves'].items():
+        add('paasta_mesos_slaves', count, state=state)
+    for framework, count in mesos['frameworks'].items():
+        add('paasta_mesos_framework_instances', count, framework=framework)
+
+    for slave in data['slaves']:
+        for name in RESOURCE_NAMES:
+            add('paasta_mesos_slave_resource_free', slave['free'][name], hostname=slave['hostname'], resource=name)
+            add('paasta_mesos_slave_resource_total', slave['total'][name], hostname=slave['hostname'], resource=name)
+    for attribute, values in data['attributes'].items():
+        for attribute_value, resources in values.items():
+            for name in RESOURCE_NAMES:
+                add('paasta_mesos_attribute_resource_free', resources['free'][name],
+                    attribute=attribute, value=attribute_value, resource=name)
+                add('paasta_mesos_attribute_resource_total', resources['total'][name],
+                    attribute=attribute, value=attribute_value, resource=name)
+
+    for key in ('apps', 'tasks', 'deployments'):
+        if key in data['marathon']:
+            add('paasta_marathon_%s' % key, data['marathon'][key])
+    if 'enabled_jobs' in data['chronos']:
+        add('paasta_chronos_enabled_jobs', data['chronos']['enabled_jobs'])
+
+    lines = []
+    for name in sorted(samples):
+        lines.append('# TYPE %s gauge' % name)
+        lines.extend(samples[name])
+    return '\n'.join(lines) + '\n'
+
+
+class MetastatusExporter(object):
+    """Refreshes the metastatus data every interval seconds and keeps it rendered in
+    the Prometheus text format, so scrapes never hit mesos, marathon or chronos."""
+
+    def __init__(self, interval=DEFAULT_EXPORTER_INTERVAL):
+        self.interval = interval
+        self.metrics = ''
+
+    def refresh(self):
+        start = time.time()
+        try:
+            metrics = format_prometheus_metrics(collect_metastatus_data())
+            up = 1
+        except Exception:
+            log.exception("Failed to refresh metastatus data")
+            metrics = ''
+            up = 0
+        metrics += '# TYPE paasta_metastatus_up gauge\n%s\n' % format_prometheus_metric('paasta_metastatus_up', up)
+        metrics += '# TYPE paasta_metastatus_refresh_seconds gauge\n%s\n' % format_prometheus_metric(
+            'paasta_metastatus_refresh_seconds', time.time() - start)
+        self.metrics = metrics
+
+    def refresh_forever(self):
+        while True:
+            self.refresh()
+            time.sleep(self.interval)
+
+
+def make_exporter_request_handler(exporter):
+    class MetastatusExporterRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = exporter.metrics.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            log.debug(format, *args)
+    return MetastatusExporterRequestHandler
+
+
+def run_exporter(port, interval):
+    exporter = MetastatusExporter(interval=interval)
+    refresh_thread = threading.Thread(target=exporter.refresh_forever)
+    refresh_thread.daemon = True
+    refresh_thread.start()
+    server = BaseHTTPServer.HTTPServer(('localhost', port), make_exporter_request_handler(exporter))
+    server.serve_forever()
+
+
+def print_json_status():
+    try:
+        data = collect_metastatus_data()
+    except MasterNotAvailableException as e:
+        data = {'ok': False, 'error': e.message}
+    print json.dumps(data, sort_keys=True)
+    sys.exit(0 if data['ok'] else 2)
+
+
+def print_fit(fit, constraints, as_json=False):
+    try:
+        mesos_state = get_compact_mesos_state_from_leader()
+    except MasterNotAvailableException as e:
+        print(PaastaColors.red("CRITICAL:  %s" % e.message))
+        sys.exit(2)
+    fit_data = get_fit_data(mesos_state, fit.shape, fit.attribute, constraints)
+    if as_json:
+        print json.dumps(fit_data, sort_keys=True)
+    else:
+        print format_fit_data(fit_data)
+    sys.exit(0)
+
+
 def main():
     marathon_config = None
     chronos_config = None
     args = parse_args()
 
+    if args.exporter:
+        logging.basicConfig()
+        run_exporter(port=args.port, interval=args.interval)
+        return
+    if args.fit:
+        constraints = list(args.constraints)
+        if args.pool:
+            constraints.append(['pool', 'LIKE', args.pool])
+        print_fit(args.fit, constraints, as_json=args.json)
+    if args.json:
+        print_json_status()
+
     try:
-        mesos_state = get_mesos_state_from_leader()
+        mesos_state = get_compact_mesos_state_from_leader()
     except MasterNotAvailableException as e:
         # if we can't connect to master at all,
         # then bomb out early
@@ -11,9 +11,23 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import fcntl
+import hashlib
+import json
+import os
+import time
+
 import dulwich.client
 import dulwich.errors
 
+from paasta_tools.utils import atomic_file_write
+from paasta_tools.utils import load_system_paasta_config
+from paasta_tools.utils import PaastaNotConfiguredError
+
+
+# The deploy and start/stop tags that paasta creates, which are the only refs it reads
+PAASTA_REF_PREFIX = 'refs/tags/paasta-'
+
 
 def _make_determine_wants_func(ref_mutator):
     """Returns a safer version of ref_mutator, suitable for passing as the
@@ -53,6 +67,30 @@ def create_remote_refs(git_url, ref_mutator, force=False):
     return client.send_pack(path, determine_wants, generate_pack_contents)
 
 
+def delete_remote_refs(git_url, refs_to_delete):
+    """Deletes refs (tags, branches) from a remote git repo in a single push.
+
+    :param git_url: the URL or path to the remote git repo.
+    :param refs_to_delete: A dictionary of the refs to delete in the format
+                           {name : hash, ...}. A ref is only deleted if it
+                           still points at the given hash on the server.
+    :returns: The map of refs, with the deletions applied.
+    """
+    client, path = dulwich.client.get_transport_and_path(git_url)
+
+    def determine_wants(old_refs):
+        # refs missing from what we return are deleted by send_pack
+        return dict(
+            (name, sha) for name, sha in old_refs.items()
+            if refs_to_delete.get(name) != sha
+        )
+
+    def generate_pack_contents(have, want):
+        return []
+
+    return client.send_pack(path, determine_wants, generate_pack_contents)
+
+
 class LSRemoteException(Exception):
     pass
 
@@ -66,6 +104,114 @@ def list_remote_refs(git_url):
         raise LSRemoteException("Unable to fetch remote refs: %s" % e)
 
 
+def filter_paasta_refs(refs):
+    """Returns the refs of a dict of name->hash that are paasta tags."""
+    return dict((name, sha) for name, sha in refs.iteritems() if name.startswith(PAASTA_REF_PREFIX))
+
+
+class RemoteRefCache(object):
+    """Keeps the paasta tags of remote git repos for ttl seconds.
+
+    If cache_dir is set the tags are also shared with other processes on this host
+    through a mirror file per repo in it, whose mtime is when the tags were last
+    fetched. Only one process at a time refreshes a stale mirror, and it only
+    rewrites the file if the tags have changed. The git protocol dulwich speaks
+    can't ask for a subset of refs or for only the refs that changed, so a
+    refresh still reads the full ref advertisement of the repo.
+    """
+
+    def __init__(self, ttl=0, cache_dir=None):
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.refs_by_url = {}
+
+    def is_fresh(self, fetched_at, now):
+        return fetched_at is not None and now - fetched_at < self.ttl
+
+    def get_mirror_path(self, git_url):
+        return os.path.join(self.cache_dir, '%s.json' % hashlib.sha1(git_url).hexdigest())
+
+    def fetch(self, git_url):
+        return filter_paasta_refs(list_remote_refs(git_url))
+
+    def get(self, git_url):
+        """Returns the paasta tags of the repo at git_url as a dict of name->hash,
+        fetching them if the cached ones have expired."""
+        now = time.time()
+        refs, fetched_at = self.refs_by_url.get(git_url, (None, None))
+        if refs is not None and self.is_fresh(fetched_at, now):
+            return refs
+        if self.cache_dir is not None and self.ttl > 0:
+            refs, fetched_at = self.get_from_mirror(git_url, now)
+        else:
+            refs, fetched_at = self.fetch(git_url), now
+        self.refs_by_url[git_url] = (refs, fetched_at)
+        return refs
+
+    def get_from_mirror(self, git_url, now):
+        path = self.get_mirror_path(git_url)
+        refs, fetched_at = read_ref_mirror(path)
+        if refs is not None and self.is_fresh(fetched_at, now):
+            return refs, fetched_at
+        try:
+            lockfile = open('%s.lock' % path, 'a')
+        except IOError:
+            return self.fetch(git_url), now
+        with lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            # Another process may have refreshed the mirror while we were waiting for the lock
+            mirrored_refs, fetched_at = read_ref_mirror(path)
+            now = time.time()
+            if mirrored_refs is not None and self.is_fresh(fetched_at, now):
+                return mirrored_refs, fetched_at
+            refs = self.fetch(git_url)
+            try:
+                if refs == mirrored_refs:
+                    os.utime(path, None)
+                else:
+                    with atomic_file_write(path) as f:
+                        json.dump(refs, f)
+            except (IOError, OSError):
+                pass
+            return refs, now
+
+
+def read_ref_mirror(path):
+    """Reads a mirror file written by RemoteRefCache.
+
+    :returns: a tuple of (refs, fetched_at), or (None, None) if it is missing or unreadable
+    """
+    try:
+        with open(path) as f:
+            return json.load(f), os.fstat(f.fileno()).st_mtime
+    except (IOError, OSError, ValueError):
+        return None, None
+
+
+_remote_ref_cache = None
+
+
+def get_remote_ref_cache():
+    """Returns the process-wide RemoteRefCache, configured from the system paasta config."""
+    global _remote_ref_cache
+    if _remote_ref_cache is None:
+        try:
+            system_paasta_config = load_system_paasta_config()
+            _remote_ref_cache = RemoteRefCache(
+                ttl=system_paasta_config.get_git_ref_cache_ttl(),
+                cache_dir=system_paasta_config.get_git_ref_cache_dir(),
+            )
+        except PaastaNotConfiguredError:
+            _remote_ref_cache = RemoteRefCache()
+    return _remote_ref_cache
+
+
+def list_remote_paasta_refs(git_url):
+    """Get the paasta tags of a remote git repo as a dictionary of name->hash, from
+    the local mirror of them if it was fetched recently enough."""
+    return get_remote_ref_cache().get(git_url)
+
+
 def make_force_push_mutate_refs_func(targets, sha):
     """Create a 'force push' function that will inform send_pack that we want
     to mark a certain list of target branches/tags to point to a particular
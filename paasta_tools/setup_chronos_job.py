@@ -13,7 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """
-Usage: ./setup_chronos_job.py <service.instance> [options]
+Usage: ./setup_chronos_job.py (<service.instance> | --all) [options]
 
 Deploy a service instance to Chronos from a configuration file.
 Reads from the soa_dir /nail/etc/services by default.
@@ -33,16 +33,23 @@ if something went wrong, it'll alert the team responsible for the service
 (as defined in that service's monitoring.yaml), and it'll send resolves
 when the deployment goes alright.
 
+With --all, every chronos job configured for the cluster is deployed from one process.
+Jobs are deployed in the order of their dependencies, so that a parent is in Chronos
+by the time its children are deployed.
+
 Command line options:
 
 - -d <SOA_DIR>, --soa-dir <SOA_DIR>: Specify a SOA config dir to read from
 - -v, --verbose: Verbose output
+- -a, --all: Deploy every chronos job configured for the cluster
+- -w <WORKERS>, --workers <WORKERS>: How many jobs to deploy at once with --all
 """
 import argparse
 import logging
 import sys
 
 import pysensu_yelp
+from concurrent import futures
 
 from paasta_tools import chronos_tools
 from paasta_tools import monitoring_tools
@@ -59,18 +66,26 @@ from paasta_tools.utils import SPACER
 log = logging.getLogger('__main__')
 logging.basicConfig()
 
+DEFAULT_DEPLOY_WORKERS = 5
+
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Creates chronos jobs.')
-    parser.add_argument('service_instance',
+    parser.add_argument('service_instance', nargs='?',
                         help="The chronos instance of the service to create or update",
                         metavar=compose_job_id("SERVICE", "INSTANCE"))
+    parser.add_argument('-a', '--all', action='store_true', dest="all_jobs", default=False,
+                        help="create or update every chronos job configured for the cluster")
+    parser.add_argument('-w', '--workers', dest="workers", type=int, default=DEFAULT_DEPLOY_WORKERS,
+                        help="how many jobs to deploy at once with --all (default %(default)s)")
     parser.add_argument('-d', '--soa-dir', dest="soa_dir", metavar="SOA_DIR",
                         default=chronos_tools.DEFAULT_SOA_DIR,
                         help="define a different soa config directory")
     parser.add_argument('-v', '--verbose', action='store_true',
                         dest="verbose", default=False)
     args = parser.parse_args()
+    if bool(args.service_instance) == args.all_jobs:
+        parser.error("specify either a service instance or --all")
     return args
 
 
@@ -131,58 +146,52 @@ def bounce_chronos_job(
     return (0, "All chronos bouncing tasks finished.")
 
 
-def setup_job(service, instance, complete_job_config, client, cluster):
+def get_job_to_update(all_existing_jobs, complete_job_config):
+    """Returns complete_job_config if it differs from the existing job for its service instance, else None."""
+    if len(all_existing_jobs) > 0:
+        # we store the md5 sum of the config in the description field.
+        if all_existing_jobs[0]['description'] != complete_job_config['description']:
+            return complete_job_config
+        return None
+    return complete_job_config
+
+
+def setup_job(service, instance, complete_job_config, client, cluster, job_index=None):
     # There should only ever be *one* job for a given service_instance
     all_existing_jobs = chronos_tools.lookup_chronos_jobs(
         service=service,
         instance=instance,
         client=client,
         include_disabled=True,
+        job_index=job_index,
     )
 
-    job_to_update = None
-    if len(all_existing_jobs) > 0:
-        # we store the md5 sum of the config in the description field.
-        if all_existing_jobs[0]['description'] != complete_job_config['description']:
-            job_to_update = complete_job_config
-    else:
-        job_to_update = complete_job_config
-
     return bounce_chronos_job(
         service=service,
         instance=instance,
         cluster=cluster,
-        job_to_update=job_to_update,
+        job_to_update=get_job_to_update(all_existing_jobs, complete_job_config),
         client=client,
     )
 
 
-def main():
-    args = parse_args()
-    soa_dir = args.soa_dir
-    if args.verbose:
-        log.setLevel(logging.DEBUG)
-    else:
-        log.setLevel(logging.WARNING)
-    try:
-        service, instance, _, __ = decompose_job_id(args.service_instance, spacer=chronos_tools.INTERNAL_SPACER)
-    except InvalidJobNameError:
-        log.error("Invalid service instance '%s' specified. Format is service%sinstance."
-                  % (args.service_instance, SPACER))
-        sys.exit(1)
-
-    client = chronos_tools.get_chronos_client(chronos_tools.load_chronos_config())
-    cluster = load_system_paasta_config().get_cluster()
+def create_complete_config_or_report(service, instance, cluster, soa_dir, job_graph=None):
+    """Calls chronos_tools.create_complete_config, sending a sensu event for the errors that
+    the team owning the job has to fix.
 
+    :returns: the complete job config, or None if it couldn't be created
+    """
+    service_instance = compose_job_id(service, instance)
     try:
-        complete_job_config = chronos_tools.create_complete_config(
+        return chronos_tools.create_complete_config(
             service=service,
             job_name=instance,
             soa_dir=soa_dir,
+            job_graph=job_graph,
         )
     except (NoDeploymentsAvailable, NoDockerImageError):
         error_msg = "No deployment found for %s in cluster %s. Has Jenkins run for it?" % (
-            args.service_instance, cluster)
+            service_instance, cluster)
         send_event(
             service=service,
             instance=instance,
@@ -191,10 +200,9 @@ def main():
             output=error_msg,
         )
         log.error(error_msg)
-        sys.exit(0)
     except chronos_tools.UnknownChronosJobError as e:
         error_msg = (
-            "Could not read chronos configuration file for %s in cluster %s\n" % (args.service_instance, cluster) +
+            "Could not read chronos configuration file for %s in cluster %s\n" % (service_instance, cluster) +
             "Error was: %s" % str(e))
         send_event(
             service=service,
@@ -204,18 +212,12 @@ def main():
             output=error_msg,
         )
         log.error(error_msg)
-        sys.exit(0)
     except chronos_tools.InvalidParentError:
         log.warn("Skipping %s.%s: Parent job could not be found" % (service, instance))
-        sys.exit(0)
+    return None
 
-    status, output = setup_job(
-        service=service,
-        instance=instance,
-        cluster=cluster,
-        complete_job_config=complete_job_config,
-        client=client,
-    )
+
+def send_setup_event(service, instance, soa_dir, status, output):
     sensu_status = pysensu_yelp.Status.CRITICAL if status else pysensu_yelp.Status.OK
     send_event(
         service=service,
@@ -224,6 +226,162 @@ def main():
         status=sensu_status,
         output=output,
     )
+
+
+def deploy_service_instance(service, instance, client, cluster, soa_dir, job_graph=None):
+    """Creates or updates the chronos job for a service instance and sends a sensu event saying how it went.
+
+    :param job_graph: an optional ChronosJobGraph to look up existing and parent jobs in
+    :returns: True if the job is now deployed as configured
+    """
+    complete_job_config = create_complete_config_or_report(service, instance, cluster, soa_dir, job_graph=job_graph)
+    if complete_job_config is None:
+        return False
+
+    status, output = setup_job(
+        service=service,
+        instance=instance,
+        cluster=cluster,
+        complete_job_config=complete_job_config,
+        client=client,
+        job_index=job_graph.job_index if job_graph is not None else None,
+    )
+    send_setup_event(service, instance, soa_dir, status, output)
+    return not status
+
+
+def get_blocking_parent(job_graph, deployed, service_instance):
+    """Returns the first parent that the job can't be deployed without, or None if there is none:
+    a parent whose push to Chronos failed, or one that wasn't pushed and isn't in Chronos either.
+
+    :param deployed: a dict of (service, instance) to the deploy results so far
+    """
+    for parent in job_graph.parents[service_instance]:
+        if deployed.get(parent) is False:
+            return parent
+        if not deployed.get(parent) and not job_graph.job_index.lookup(
+                service=parent[0], instance=parent[1], include_disabled=True):
+            return parent
+    return None
+
+
+def deploy_in_topological_order(job_graph, deploy, skip=None, max_workers=DEFAULT_DEPLOY_WORKERS):
+    """Calls deploy(service, instance) for every job in job_graph, running up to max_workers
+    at once. A job is only deployed once all of its configured parents have been deployed,
+    and is skipped, calling skip(service, instance, parent), if a parent it needs failed
+    to be pushed or is missing from Chronos.
+
+    :param deploy: a function returning True if the job was deployed, False if pushing it
+    to Chronos failed, or None if nothing was pushed
+    :returns: a dict of (service, instance) to what deploy returned, or None if the job was skipped
+    """
+    deployed = {}
+    executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for level in job_graph.topological_levels():
+            to_deploy = []
+            for service_instance in level:
+                blocking_parent = get_blocking_parent(job_graph, deployed, service_instance)
+                if blocking_parent is not None:
+                    log.warn("Skipping %s: parent %s was not deployed" % (
+                        compose_job_id(*service_instance), compose_job_id(*blocking_parent)))
+                    if skip is not None:
+                        skip(service_instance[0], service_instance[1], blocking_parent)
+                    deployed[service_instance] = None
+                else:
+                    to_deploy.append(service_instance)
+            results = executor.map(lambda service_instance: deploy(*service_instance), to_deploy)
+            deployed.update(zip(to_deploy, results))
+    finally:
+        executor.shutdown(wait=True)
+    return deployed
+
+
+def plan_job_updates(job_graph, cluster, soa_dir):
+    """Creates the complete config of every job in job_graph and diffs it against the jobs
+    already in Chronos.
+
+    :returns: a dict of (service, instance) to the job config to push to Chronos, or None
+    if the job is already up to date. Jobs whose config couldn't be created are left out.
+    """
+    jobs_to_update = {}
+    for service, instance in sorted(job_graph.parents):
+        complete_job_config = create_complete_config_or_report(
+            service, instance, cluster, soa_dir, job_graph=job_graph)
+        if complete_job_config is None:
+            continue
+        all_existing_jobs = job_graph.job_index.lookup(service=service, instance=instance, include_disabled=True)
+        jobs_to_update[(service, instance)] = get_job_to_update(all_existing_jobs, complete_job_config)
+    return jobs_to_update
+
+
+def deploy_all(client, cluster, soa_dir, max_workers=DEFAULT_DEPLOY_WORKERS):
+    """Deploys every chronos job configured for the cluster in dependency order.
+
+    The complete config of every job is created up front and diffed against a single
+    listing of Chronos, so only the jobs that changed are pushed; every job still gets
+    the same sensu event as when it is set up on its own.
+    """
+    job_graph = chronos_tools.ChronosJobGraph.load(client, cluster, soa_dir=soa_dir)
+    jobs_to_update = plan_job_updates(job_graph, cluster, soa_dir)
+    log.info("%d of %d chronos jobs need to be updated" % (
+        len([job for job in jobs_to_update.values() if job is not None]), len(job_graph.parents)))
+
+    def deploy(service, instance):
+        if (service, instance) not in jobs_to_update:
+            # create_complete_config_or_report has already reported why
+            return None
+        try:
+            status, output = bounce_chronos_job(
+                service=service,
+                instance=instance,
+                cluster=cluster,
+                job_to_update=jobs_to_update[(service, instance)],
+                client=client,
+            )
+        except Exception:
+            log.exception("Failed to deploy %s" % compose_job_id(service, instance))
+            return False
+        send_setup_event(service, instance, soa_dir, status, output)
+        return not status
+
+    def skip(service, instance, parent):
+        send_event(
+            service=service,
+            instance=instance,
+            soa_dir=soa_dir,
+            status=pysensu_yelp.Status.CRITICAL,
+            output="Not deploying %s: its parent %s failed to deploy or doesn't exist in Chronos" % (
+                compose_job_id(service, instance), compose_job_id(*parent)),
+        )
+
+    return deploy_in_topological_order(job_graph, deploy, skip=skip, max_workers=max_workers)
+
+
+def main():
+    args = parse_args()
+    soa_dir = args.soa_dir
+    if args.verbose:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.WARNING)
+
+    client = chronos_tools.get_chronos_client(chronos_tools.load_chronos_config())
+    cluster = load_system_paasta_config().get_cluster()
+
+    if args.all_jobs:
+        deploy_all(client, cluster, soa_dir, max_workers=args.workers)
+        # As for a single job, failures have been reported to their teams through sensu.
+        sys.exit(0)
+
+    try:
+        service, instance, _, __ = decompose_job_id(args.service_instance, spacer=chronos_tools.INTERNAL_SPACER)
+    except InvalidJobNameError:
+        log.error("Invalid service instance '%s' specified. Format is service%sinstance."
+                  % (args.service_instance, SPACER))
+        sys.exit(1)
+
+    deploy_service_instance(service, instance, client, cluster, soa_dir)
     # We exit 0 because the script finished ok and the event was sent to the right team.
     sys.exit(0)
 
@@ -29,10 +29,11 @@ import os
 import pwd
 import re
 import shlex
-import signal
+import sqlite3
 import sys
 import tempfile
 import threading
+import time
 from functools import wraps
 from subprocess import PIPE
 from subprocess import Popen
@@ -42,6 +43,7 @@ import dateutil.tz
 import docker
 import service_configuration_lib
 import yaml
+from concurrent import futures
 from docker import Client
 from docker.utils import kwargs_from_env
 from kazoo.client import KazooClient
@@ -831,6 +833,42 @@ class SystemPaastaConfig(dict):
         """
         return self.get('dockercfg_location', DEFAULT_DOCKERCFG_LOCATION)
 
+    def get_mesos_state_cache_ttl(self):
+        """Get how long, in seconds, the mesos master state may be reused before it is fetched again.
+
+        :returns: the mesos_state_cache_ttl value as a number, or 0 (no caching) if not specified.
+        """
+        return float(self.get('mesos_state_cache_ttl', 0))
+
+    def get_mesos_state_snapshot_path(self):
+        """Get the path of the on-disk mesos master state snapshot shared between processes on a host.
+
+        :returns: the mesos_state_snapshot_path string, or None if not specified.
+        """
+        return self.get('mesos_state_snapshot_path', None)
+
+    def get_git_ref_cache_ttl(self):
+        """Get how long, in seconds, the mirrored paasta refs of a git repo may be reused before they
+        are fetched again.
+
+        :returns: the git_ref_cache_ttl value as a number, or 0 (always fetch) if not specified.
+        """
+        return float(self.get('git_ref_cache_ttl', 0))
+
+    def get_git_ref_cache_dir(self):
+        """Get the directory of the on-disk mirror of the paasta refs of service git repos.
+
+        :returns: the git_ref_cache_dir string, or None if not specified.
+        """
+        return self.get('git_ref_cache_dir', None)
+
+    def get_deployments_store_path(self):
+        """Get the path of the sqlite database consolidating the deployments.json of every service.
+
+        :returns: the deployments_store_path string, or None if not specified.
+        """
+        return self.get('deployments_store_path', None)
+
 
 def _run(command, env=os.environ, timeout=None, log=False, stream=False, stdin=None, **kwargs):
     """Given a command, run it. Return a tuple of the return code and any
@@ -1175,41 +1213,118 @@ class TimeoutError(Exception):
     pass
 
 
-def timeout(seconds=10, error_message=os.strerror(errno.ETIME)):
-    def decorator(func):
-        def _handle_timeout(signum, frame):
-            raise TimeoutError(error_message)
+_deadlines = threading.local()
 
-        def wrapper(*args, **kwargs):
-            signal.signal(signal.SIGALRM, _handle_timeout)
-            signal.alarm(seconds)
-            try:
-                result = func(*args, **kwargs)
-            finally:
-                signal.alarm(0)
-            return result
 
-        return wraps(func)(wrapper)
+def _get_deadline_stack():
+    try:
+        return _deadlines.stack
+    except AttributeError:
+        _deadlines.stack = []
+        return _deadlines.stack
+
+
+def get_current_timeout():
+    """Returns the innermost Timeout active in the current thread, or None"""
+    stack = _get_deadline_stack()
+    return stack[-1] if stack else None
 
-    return decorator
 
+def remaining_time(default=None):
+    """Returns the seconds left until the innermost Timeout of the current thread expires,
+    or default if there is no active Timeout. Use it as the timeout of blocking calls."""
+    current = get_current_timeout()
+    if current is None:
+        return default
+    return current.remaining()
 
-class Timeout:
-    # From http://stackoverflow.com/questions/2281850/timeout-function-if-it-takes-too-long-to-finish
+
+def check_deadline():
+    """Raises TimeoutError if the innermost Timeout of the current thread has expired"""
+    current = get_current_timeout()
+    if current is not None:
+        current.check()
+
+
+class Timeout(object):
+    """A deadline, counted from when the Timeout is created, that works from any thread.
+
+    Entering a Timeout makes it the deadline of the current thread until it exits. Timeouts
+    nest: an inner Timeout never expires later than the one around it. Unlike signal.alarm,
+    a Timeout can't interrupt code by itself. Code that can't cooperate, by calling
+    check_deadline in its loops and passing remaining_time as the timeout of its blocking
+    calls, has to go through Timeout.run to be bounded, as the timeout decorator does.
+    """
 
     def __init__(self, seconds=1, error_message='Timeout'):
         self.seconds = seconds
         self.error_message = error_message
-
-    def handle_timeout(self, signum, frame):
-        raise TimeoutError(self.error_message)
+        self.expires_at = time.time() + seconds
 
     def __enter__(self):
-        signal.signal(signal.SIGALRM, self.handle_timeout)
-        signal.alarm(self.seconds)
+        current = get_current_timeout()
+        if current is not None:
+            self.expires_at = min(self.expires_at, current.expires_at)
+        _get_deadline_stack().append(self)
+        return self
 
     def __exit__(self, type, value, traceback):
-        signal.alarm(0)
+        _get_deadline_stack().remove(self)
+
+    def remaining(self):
+        return max(0, self.expires_at - time.time())
+
+    def expired(self):
+        return time.time() >= self.expires_at
+
+    def check(self):
+        if self.expired():
+            raise TimeoutError(self.error_message)
+
+    def run(self, func, *args, **kwargs):
+        """Calls func in a separate daemon thread, which has this Timeout as its deadline,
+        and waits for it until this Timeout expires.
+
+        :returns: whatever func returns
+        :raises TimeoutError: if func is still running when this Timeout expires. func is
+                              abandoned, and keeps running in the background until it notices
+                              the deadline or returns.
+        """
+        future = futures.Future()
+        stack = list(_get_deadline_stack())
+        if not stack or stack[-1] is not self:
+            stack.append(self)
+
+        def target():
+            _deadlines.stack = stack
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception_info(e, sys.exc_info()[2])
+
+        thread = threading.Thread(target=target, name='Timeout.run(%s)' % getattr(func, '__name__', func))
+        thread.daemon = True
+        thread.start()
+        try:
+            return future.result(timeout=self.remaining())
+        except futures.TimeoutError:
+            raise TimeoutError(self.error_message)
+
+
+def timeout(seconds=10, error_message=os.strerror(errno.ETIME)):
+    """Decorates a function to raise TimeoutError if it hasn't returned after seconds.
+    The function runs through Timeout.run, so it is bounded even while it is blocked in
+    a call that can't be interrupted; a function which also checks the deadline stops
+    soon after being abandoned."""
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            with Timeout(seconds, error_message) as deadline:
+                return deadline.run(func, *args, **kwargs)
+
+        return wraps(func)(wrapper)
+
+    return decorator
 
 
 def print_with_indent(line, indent=2):
@@ -1222,6 +1337,11 @@ class NoDeploymentsAvailable(Exception):
 
 
 def load_deployments_json(service, soa_dir=DEFAULT_SOA_DIR):
+    store = get_deployments_store()
+    if store is not None:
+        deployments_json = store.get_deployments_json(service, soa_dir)
+        if deployments_json is not None:
+            return deployments_json
     deployment_file = os.path.join(soa_dir, service, 'deployments.json')
     if os.path.isfile(deployment_file):
         with open(deployment_file) as f:
@@ -1237,6 +1357,137 @@ class DeploymentsJson(dict):
         return self.get(full_branch, {})
 
 
+# how much of the deployments store sqlite may read through mmap rather than read()
+DEPLOYMENTS_STORE_MMAP_SIZE = 64 * 1024 * 1024
+
+
+class DeploymentsStore(object):
+    """The deployments.json of every service in a soa_dir, consolidated into one
+    sqlite database keyed by service:branch, as written by write_deployments_store.
+    Looking up a service is an index lookup and a stat of its deployments.json, rather
+    than opening and parsing it. The database is reopened if it has been replaced.
+
+    :param path: the path of the database
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = None
+        self.file_id = None
+        self.soa_dir = None
+
+    def close(self):
+        """Closes the database if it is open."""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def connect(self):
+        """Opens the database if it isn't open yet or has been replaced since.
+
+        :returns: False if there is no database at path
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self.close()
+            return False
+        file_id = (stat.st_ino, stat.st_mtime, stat.st_size)
+        if self.connection is None or file_id != self.file_id:
+            self.close()
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute('PRAGMA mmap_size = %d' % DEPLOYMENTS_STORE_MMAP_SIZE)
+            self.soa_dir, = self.connection.execute("SELECT value FROM metadata WHERE name = 'soa_dir'").fetchone()
+            self.file_id = file_id
+        return True
+
+    def get_deployments_json(self, service, soa_dir=DEFAULT_SOA_DIR):
+        """Returns the deployments.json of a service as a DeploymentsJson, or None if the
+        store doesn't exist, was built from another soa_dir, has no deployments.json for service
+        or the service's deployments.json has changed since the store was written."""
+        with self.lock:
+            try:
+                if not self.connect() or self.soa_dir != os.path.abspath(soa_dir):
+                    return None
+                row = self.connection.execute(
+                    "SELECT mtime, size FROM services WHERE service = ?", (service,),
+                ).fetchone()
+                if row is None or row != get_deployments_json_version(soa_dir, service):
+                    # deployments.json has been regenerated (or deleted) since the store was written
+                    return None
+                return DeploymentsJson(
+                    (key, json.loads(branch_dict)) for key, branch_dict in self.connection.execute(
+                        "SELECT key, branch_dict FROM deployments WHERE service = ?", (service,),
+                    )
+                )
+            except sqlite3.Error as e:
+                log.warning("Failed to read the deployments store %s: %s", self.path, e)
+                self.close()
+                return None
+
+
+def get_deployments_json_version(soa_dir, service):
+    """Returns the (mtime, size) of the deployments.json of a service, or None if it has none."""
+    try:
+        stat = os.stat(os.path.join(soa_dir, service, 'deployments.json'))
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size)
+
+
+def write_deployments_store(path, soa_dir, services):
+    """Atomically replaces the database at path with the deployments.json of services in soa_dir.
+    Services without a deployments.json are left out, so lookups for them fall back to the file.
+    The mtime and size of every deployments.json are recorded too, so that lookups also fall back
+    to the file once it has been regenerated, for instance by generate_deployments_for_service.
+    """
+    soa_dir = os.path.abspath(soa_dir)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.%s-' % os.path.basename(path))
+    os.close(fd)
+    try:
+        connection = sqlite3.connect(temp_path)
+        with connection:
+            connection.execute("CREATE TABLE metadata (name TEXT PRIMARY KEY, value TEXT)")
+            connection.execute("CREATE TABLE services (service TEXT PRIMARY KEY, mtime REAL, size INTEGER)")
+            connection.execute("CREATE TABLE deployments (key TEXT PRIMARY KEY, service TEXT, branch_dict TEXT)")
+            connection.execute("CREATE INDEX deployments_by_service ON deployments (service)")
+            connection.execute("INSERT INTO metadata VALUES ('soa_dir', ?)", (soa_dir,))
+            for service in services:
+                try:
+                    with open(os.path.join(soa_dir, service, 'deployments.json')) as f:
+                        stat = os.fstat(f.fileno())
+                        deployments = json.load(f)['v1']
+                except (IOError, ValueError, KeyError):
+                    continue
+                connection.execute("INSERT INTO services VALUES (?, ?, ?)", (service, stat.st_mtime, stat.st_size))
+                connection.executemany("INSERT INTO deployments VALUES (?, ?, ?)", [
+                    (key, service, json.dumps(branch_dict)) for key, branch_dict in deployments.items()
+                ])
+        connection.close()
+        os.chmod(temp_path, 0666 & (~get_umask()))
+        os.rename(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+_deployments_store = None
+
+
+def get_deployments_store():
+    """Returns the process-wide DeploymentsStore, or None if the system paasta config doesn't set
+    deployments_store_path."""
+    global _deployments_store
+    if _deployments_store is None:
+        try:
+            path = load_system_paasta_config().get_deployments_store_path()
+        except PaastaNotConfiguredError:
+            path = None
+        _deployments_store = DeploymentsStore(path) if path is not None else False
+    return _deployments_store or None
+
+
 def get_paasta_branch_from_deploy_group(identifier):
     return 'paasta-%s' % (identifier)
 
@@ -39,6 +39,7 @@ setup(
         # the Docker version deployed on PaaSTA servers
         'docker-py == 1.2.3',
         'dulwich == 0.10.0',
+        'futures >= 3.0.1',
         'humanize >= 0.5.1',
         'httplib2 >= 0.9, <= 1.0',
         'isodate >= 0.5.0',
@@ -67,9 +68,11 @@ setup(
         'paasta_tools/cleanup_chronos_jobs.py',
         'paasta_tools/check_chronos_jobs.py',
         'paasta_tools/cleanup_marathon_jobs.py',
+        'paasta_tools/compact_deploy_tags.py',
         'paasta_tools/deploy_chronos_jobs',
         'paasta_tools/deploy_marathon_services',
         'paasta_tools/generate_all_deployments',
+        'paasta_tools/generate_deployments_for_all_services.py',
         'paasta_tools/generate_deployments_for_service.py',
         'paasta_tools/generate_services_file.py',
         'paasta_tools/generate_services_yaml.py',
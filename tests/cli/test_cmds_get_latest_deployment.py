@@ -31,7 +31,7 @@ def test_get_latest_deployment():
         patch('paasta_tools.cli.cmds.get_latest_deployment.get_latest_deployment_tag', autospec=True,
               return_value=(None, "FAKE_SHA")),
         patch('paasta_tools.cli.cmds.get_latest_deployment.get_git_url', autospec=True),
-        patch('paasta_tools.cli.cmds.get_latest_deployment.list_remote_refs', autospec=True),
+        patch('paasta_tools.cli.cmds.get_latest_deployment.list_remote_paasta_refs', autospec=True),
         patch('paasta_tools.cli.cmds.get_latest_deployment.validate_service_name', autospec=True),
     ) as (
         mock_stdout,
@@ -55,7 +55,7 @@ def test_get_latest_deployment_no_deployment_tag():
         patch('paasta_tools.cli.cmds.get_latest_deployment.get_latest_deployment_tag', autospec=True,
               return_value=(None, None)),
         patch('paasta_tools.cli.cmds.get_latest_deployment.get_git_url', autospec=True),
-        patch('paasta_tools.cli.cmds.get_latest_deployment.list_remote_refs', autospec=True),
+        patch('paasta_tools.cli.cmds.get_latest_deployment.list_remote_paasta_refs', autospec=True),
         patch('paasta_tools.cli.cmds.get_latest_deployment.validate_service_name', autospec=True),
     ) as (
         mock_stdout,
@@ -76,7 +76,7 @@ def test_perform_http_healthcheck_success(mock_http_conn):
 
     mock_http_conn.return_value = mock.Mock(status_code=200, headers={})
     assert perform_http_healthcheck(fake_http_url, fake_timeout)
-    mock_http_conn.assert_called_once_with(fake_http_url)
+    mock_http_conn.assert_called_once_with(fake_http_url, timeout=mock.ANY)
 
 
 @mock.patch('requests.head')
@@ -87,7 +87,7 @@ def test_perform_http_healthcheck_failure(mock_http_conn):
     mock_http_conn.return_value = mock.Mock(status_code=400, headers={})
     result, reason = perform_http_healthcheck(fake_http_url, fake_timeout)
     assert result is False
-    mock_http_conn.assert_called_once_with(fake_http_url)
+    mock_http_conn.assert_called_once_with(fake_http_url, timeout=mock.ANY)
 
 
 @mock.patch('requests.head', side_effect=TimeoutError)
@@ -99,7 +99,7 @@ def test_perform_http_healthcheck_timeout(mock_http_conn):
     assert actual[0] is False
     assert "10" in actual[1]
     assert "timed out" in actual[1]
-    mock_http_conn.assert_called_once_with(fake_http_url)
+    mock_http_conn.assert_called_once_with(fake_http_url, timeout=mock.ANY)
 
 
 @mock.patch('requests.head')
@@ -112,7 +112,7 @@ def test_perform_http_healthcheck_failure_with_multiple_content_type(mock_http_c
     actual = perform_http_healthcheck(fake_http_url, fake_timeout)
     assert actual[0] is False
     assert "200" in actual[1]
-    mock_http_conn.assert_called_once_with(fake_http_url)
+    mock_http_conn.assert_called_once_with(fake_http_url, timeout=mock.ANY)
 
 
 @mock.patch('paasta_tools.cli.cmds.local_run.perform_http_healthcheck')
@@ -11,11 +11,14 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import argparse
 import contextlib
+import datetime
 import json
 from multiprocessing import Queue
 from Queue import Empty
 
+import dateutil.tz
 import isodate
 import mock
 import pytest
@@ -755,3 +758,172 @@ def test_get_log_reader():
 
         actual = logs.get_log_reader()
         assert isinstance(actual, logs.ScribeLogReader)
+
+
+def test_parse_time_arg_duration_ago():
+    now = datetime.datetime(2016, 1, 31, 13, 0, 0)
+    assert logs.parse_time_arg('90s', now=now) == datetime.datetime(2016, 1, 31, 12, 58, 30)
+    assert logs.parse_time_arg('2h', now=now) == datetime.datetime(2016, 1, 31, 11, 0, 0)
+    assert logs.parse_time_arg('1d', now=now) == datetime.datetime(2016, 1, 30, 13, 0, 0)
+
+
+def test_parse_time_arg_timestamp():
+    assert logs.parse_time_arg('2016-01-31T13:00:00+01:00') == datetime.datetime(2016, 1, 31, 12, 0, 0)
+    with mock.patch('paasta_tools.cli.cmds.logs.dateutil.tz.tzlocal', autospec=True,
+                    return_value=dateutil.tz.tzutc()):
+        assert logs.parse_time_arg('2016-01-31 13:00') == datetime.datetime(2016, 1, 31, 13, 0, 0)
+
+
+def test_parse_time_arg_invalid():
+    with raises(argparse.ArgumentTypeError):
+        logs.parse_time_arg('yesterday-ish')
+
+
+def write_fake_log(path, timestamps, cluster='fake_cluster'):
+    with open(path, 'w') as f:
+        for timestamp in timestamps:
+            f.write(format_log_line('event', cluster, 'fake_service', 'main', 'deploy',
+                                    'at %s' % timestamp, timestamp=timestamp) + '\n')
+
+
+def test_find_log_offset(tmpdir):
+    timestamps = ['2016-01-01T00:00:%02d.000000' % second for second in range(0, 60, 2)]
+    path = str(tmpdir.join('log'))
+    write_fake_log(path, timestamps)
+    with open(path, 'rb') as f:
+        offsets = [0] + [f.tell() for _ in iter(f.readline, '')]
+        size = offsets.pop()
+        assert logs.find_log_offset(f, '2015-12-31T23:00:00.000000') == 0
+        assert logs.find_log_offset(f, '2016-01-01T00:00:10.000000') == offsets[5]
+        assert logs.find_log_offset(f, '2016-01-01T00:00:11.000000') == offsets[6]
+        assert logs.find_log_offset(f, '2016-01-01T00:00:58.000000') == offsets[29]
+        assert logs.find_log_offset(f, '2016-01-01T00:01:00.000000') == size
+
+
+def test_find_log_offset_skips_invalid_lines(tmpdir):
+    path = str(tmpdir.join('log'))
+    write_fake_log(path, ['2016-01-01T00:00:01.000000'])
+    with open(path, 'a') as f:
+        f.write('not json\n')
+    write_fake_log(str(tmpdir.join('rest')), ['2016-01-01T00:00:03.000000'])
+    with open(path, 'a') as f:
+        f.write(tmpdir.join('rest').read())
+    with open(path, 'rb') as f:
+        offsets = [0] + [f.tell() for _ in iter(f.readline, '')]
+        assert logs.find_log_offset(f, '2016-01-01T00:00:02.000000') == offsets[1]
+
+
+def test_read_log_file(tmpdir):
+    path = str(tmpdir.join('log'))
+    write_fake_log(path, ['2016-01-01T00:00:01', '2016-01-01T00:00:02.500000', '2016-01-01T00:00:03.000000'])
+    assert [timestamp for timestamp, _ in logs.read_log_file(path)] == [
+        '2016-01-01T00:00:01.000000',
+        '2016-01-01T00:00:02.500000',
+        '2016-01-01T00:00:03.000000',
+    ]
+    assert [timestamp for timestamp, _ in logs.read_log_file(
+        path, since='2016-01-01T00:00:01.000000', until='2016-01-01T00:00:03.000000',
+    )] == [
+        '2016-01-01T00:00:01.000000',
+        '2016-01-01T00:00:02.500000',
+    ]
+
+
+def test_file_log_reader_read_logs(tmpdir):
+    path_format = str(tmpdir.join('{service}-{component}-{cluster}.log'))
+    write_fake_log(path_format.format(service='fake_service', component='deploy', cluster='cluster1'),
+                   ['2016-01-01T00:00:01.000000', '2016-01-01T00:00:04.000000'], cluster='cluster1')
+    write_fake_log(path_format.format(service='fake_service', component='deploy', cluster='cluster2'),
+                   ['2016-01-01T00:00:02.000000', '2016-01-01T00:00:03.000000'], cluster='cluster2')
+    write_fake_log(path_format.format(service='fake_service', component='deploy', cluster='cluster3'),
+                   ['2016-01-01T00:00:02.500000'], cluster='cluster3')
+    log_reader = logs.FileLogReader(path_format=path_format)
+
+    def read_timestamps(**kwargs):
+        return [json.loads(line)['timestamp'] for line in log_reader.read_logs(
+            'fake_service', ['event'], ['deploy'], ['cluster1', 'cluster2'], **kwargs)]
+
+    assert read_timestamps() == [
+        '2016-01-01T00:00:01.000000',
+        '2016-01-01T00:00:02.000000',
+        '2016-01-01T00:00:03.000000',
+        '2016-01-01T00:00:04.000000',
+    ]
+    assert read_timestamps(since=datetime.datetime(2016, 1, 1, 0, 0, 2),
+                           until=datetime.datetime(2016, 1, 1, 0, 0, 4)) == [
+        '2016-01-01T00:00:02.000000',
+        '2016-01-01T00:00:03.000000',
+    ]
+    assert read_timestamps(lines=3) == [
+        '2016-01-01T00:00:02.000000',
+        '2016-01-01T00:00:03.000000',
+        '2016-01-01T00:00:04.000000',
+    ]
+
+
+def fake_paasta_logs_args(**kwargs):
+    args = mock.Mock(soa_dir='/fake/soa/dir', clusters='fake_cluster', components=None, verbose=False,
+                     raw_mode=False, tail=False, since=None, until=None, lines=None)
+    for key, value in kwargs.items():
+        setattr(args, key, value)
+    return args
+
+
+def test_paasta_logs_tails_by_default():
+    with contextlib.nested(
+        mock.patch('paasta_tools.cli.cmds.logs.figure_out_service_name', autospec=True, return_value='fake_service'),
+        mock.patch('paasta_tools.cli.cmds.logs.get_log_reader', autospec=True),
+    ) as (
+        _,
+        mock_get_log_reader,
+    ):
+        logs.paasta_logs(fake_paasta_logs_args())
+    mock_get_log_reader.return_value.tail_logs.assert_called_once_with(
+        'fake_service', ['event'], logs.DEFAULT_COMPONENTS, ['fake_cluster'], raw_mode=False)
+    assert not mock_get_log_reader.return_value.read_logs.called
+
+
+def test_paasta_logs_reads_logs_since():
+    since = datetime.datetime(2016, 1, 1)
+    with contextlib.nested(
+        mock.patch('paasta_tools.cli.cmds.logs.figure_out_service_name', autospec=True, return_value='fake_service'),
+        mock.patch('paasta_tools.cli.cmds.logs.get_log_reader', autospec=True),
+        mock.patch('paasta_tools.cli.cmds.logs.print_log', autospec=True),
+    ) as (
+        _,
+        mock_get_log_reader,
+        mock_print_log,
+    ):
+        mock_get_log_reader.return_value.read_logs.return_value = iter(['line1', 'line2'])
+        logs.paasta_logs(fake_paasta_logs_args(since=since))
+    mock_get_log_reader.return_value.read_logs.assert_called_once_with(
+        'fake_service', ['event'], logs.DEFAULT_COMPONENTS, ['fake_cluster'], since=since, until=None, lines=None)
+    assert mock_print_log.call_args_list == [
+        mock.call('line1', ['event'], False),
+        mock.call('line2', ['event'], False),
+    ]
+    assert not mock_get_log_reader.return_value.tail_logs.called
+
+
+def test_paasta_logs_read_logs_not_implemented(capsys):
+    with contextlib.nested(
+        mock.patch('paasta_tools.cli.cmds.logs.figure_out_service_name', autospec=True, return_value='fake_service'),
+        mock.patch('paasta_tools.cli.cmds.logs.get_log_reader', autospec=True, return_value=logs.LogReader()),
+    ):
+        assert logs.paasta_logs(fake_paasta_logs_args(lines=10)) == 1
+    out, _ = capsys.readouterr()
+    assert 'LogReader can only tail logs' in out
+
+
+def test_paasta_logs_tail_logs_not_implemented(capsys):
+    with contextlib.nested(
+        mock.patch('paasta_tools.cli.cmds.logs.figure_out_service_name', autospec=True, return_value='fake_service'),
+        mock.patch(
+            'paasta_tools.cli.cmds.logs.get_log_reader',
+            autospec=True,
+            return_value=logs.FileLogReader(path_format='/fake/{service}.log'),
+        ),
+    ):
+        assert logs.paasta_logs(fake_paasta_logs_args()) == 1
+    out, _ = capsys.readouterr()
+    assert 'FileLogReader can only read logs' in out
@@ -11,8 +11,11 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import dulwich.errors
 from mock import ANY
+from mock import Mock
 from mock import patch
+from pytest import raises
 
 from paasta_tools.cli.cmds import mark_for_deployment
 
@@ -75,3 +78,114 @@ def test_mark_for_deployment_sad(mock_create_remote_refs, mock__log):
         ref_mutator=ANY,
         force=True,
     )
+
+
+@patch('paasta_tools.cli.cmds.mark_for_deployment._log', autospec=True)
+@patch('paasta_tools.remote_git.create_remote_refs', autospec=True)
+def test_mark_for_deployment_in_groups_pushes_once(mock_create_remote_refs, mock__log):
+    actual = mark_for_deployment.mark_for_deployment_in_groups(
+        git_url='fake_git_url',
+        deploy_groups=['cluster1.main', 'cluster2.main'],
+        service='fake_service',
+        commit='fake_commit',
+    )
+    assert actual == 0
+    assert mock_create_remote_refs.call_count == 1
+    ref_mutator = mock_create_remote_refs.call_args[1]['ref_mutator']
+    refs = ref_mutator({})
+    assert sorted(ref.split('-')[1] for ref in refs) == ['cluster1.main', 'cluster2.main']
+    assert set(refs.values()) == {'fake_commit'}
+    assert mock__log.call_count == 2
+
+
+@patch('paasta_tools.cli.cmds.mark_for_deployment._log', autospec=True)
+@patch('paasta_tools.remote_git.create_remote_refs', autospec=True)
+def test_mark_for_deployment_in_groups_logs_one_line_per_group(mock_create_remote_refs, mock__log):
+    mock_create_remote_refs.side_effect = Exception('something bad\nhappened')
+    actual = mark_for_deployment.mark_for_deployment_in_groups(
+        git_url='fake_git_url',
+        deploy_groups=['cluster1.main', 'cluster2.main'],
+        service='fake_service',
+        commit='fake_commit',
+    )
+    assert actual == 1
+    assert [log_call[1]['line'] for log_call in mock__log.call_args_list] == [
+        "Failed to mark fake_commit in for deployment in deploy group cluster1.main! something bad happened",
+        "Failed to mark fake_commit in for deployment in deploy group cluster2.main! something bad happened",
+    ]
+
+
+@patch('paasta_tools.cli.cmds.mark_for_deployment._log', autospec=True)
+@patch('paasta_tools.cli.cmds.mark_for_deployment.get_paasta_tag_from_deploy_group', autospec=True)
+@patch('paasta_tools.remote_git.create_remote_refs', autospec=True)
+def test_mark_for_deployment_in_groups_logs_partial_push(
+    mock_create_remote_refs,
+    mock_get_paasta_tag_from_deploy_group,
+    mock__log,
+):
+    mock_get_paasta_tag_from_deploy_group.side_effect = lambda identifier, desired_state: 'paasta-%s-%s' % (
+        identifier, desired_state)
+    mock_create_remote_refs.side_effect = dulwich.errors.UpdateRefsError(
+        'refs/tags/paasta-cluster2.main-deploy failed to update',
+        ref_status={
+            'refs/tags/paasta-cluster1.main-deploy': 'ok',
+            'refs/tags/paasta-cluster2.main-deploy': 'hook declined',
+        },
+    )
+    actual = mark_for_deployment.mark_for_deployment_in_groups(
+        git_url='fake_git_url',
+        deploy_groups=['cluster1.main', 'cluster2.main', 'cluster3.main'],
+        service='fake_service',
+        commit='fake_commit',
+    )
+    assert actual == 1
+    assert [log_call[1]['line'] for log_call in mock__log.call_args_list] == [
+        "Marked fake_commit in for deployment in deploy group cluster1.main",
+        "Failed to mark fake_commit in for deployment in deploy group cluster2.main! hook declined",
+        "Failed to mark fake_commit in for deployment in deploy group cluster3.main! "
+        "refs/tags/paasta-cluster2.main-deploy failed to update",
+    ]
+
+
+@patch('paasta_tools.cli.cmds.mark_for_deployment.get_instance_config_for_service', autospec=True)
+def test_expand_deploy_groups(mock_get_instance_config_for_service):
+    mock_get_instance_config_for_service.return_value = [
+        Mock(get_deploy_group=Mock(return_value=deploy_group))
+        for deploy_group in ['cluster1.main', 'cluster2.main', 'cluster1.canary']
+    ]
+    assert mark_for_deployment.expand_deploy_groups('cluster*.main,other.group', 'fake_service', 'fake_soa_dir') == [
+        'cluster1.main', 'cluster2.main', 'other.group',
+    ]
+    with raises(ValueError):
+        mark_for_deployment.expand_deploy_groups('nothing.*', 'fake_service', 'fake_soa_dir')
+
+
+@patch('paasta_tools.cli.cmds.mark_for_deployment.get_instance_config_for_service', autospec=True)
+def test_expand_deploy_groups_without_globs_skips_soa_configs(mock_get_instance_config_for_service):
+    assert mark_for_deployment.expand_deploy_groups('b.main,a.main', 'fake_service', 'fake_soa_dir') == [
+        'a.main', 'b.main',
+    ]
+    assert not mock_get_instance_config_for_service.called
+
+
+@patch('paasta_tools.cli.cmds.mark_for_deployment.validate_service_name', autospec=True)
+@patch('paasta_tools.cli.cmds.mark_for_deployment.mark_for_deployment_in_groups', autospec=True)
+def test_paasta_mark_for_deployment_with_several_groups(
+    mock_mark_for_deployment_in_groups,
+    mock_validate_service_name,
+):
+    fake_args = Mock(
+        deploy_group='cluster2.main,cluster1.main',
+        service='services-test_service',
+        git_url='git://false.repo/services/test_services',
+        commit='fake-hash',
+        soa_dir='fake_soa_dir',
+    )
+    mock_mark_for_deployment_in_groups.return_value = 0
+    assert mark_for_deployment.paasta_mark_for_deployment(fake_args) == 0
+    mock_mark_for_deployment_in_groups.assert_called_once_with(
+        service='test_service',
+        deploy_groups=['cluster1.main', 'cluster2.main'],
+        commit='fake-hash',
+        git_url='git://false.repo/services/test_services',
+    )
@@ -14,7 +14,6 @@
 # limitations under the License.
 import contextlib
 
-from mock import call
 from mock import Mock
 from mock import patch
 
@@ -28,7 +27,7 @@ from paasta_tools.marathon_tools import MarathonServiceConfig
 @patch('paasta_tools.cli.cmds.rollback.get_instance_config_for_service', autospec=True)
 @patch('paasta_tools.cli.cmds.rollback.figure_out_service_name', autospec=True)
 @patch('paasta_tools.cli.cmds.rollback.get_git_url', autospec=True)
-@patch('paasta_tools.cli.cmds.rollback.mark_for_deployment', autospec=True)
+@patch('paasta_tools.cli.cmds.rollback.mark_for_deployment_in_groups', autospec=True)
 def test_paasta_rollback_mark_for_deployment_simple_invocation(
     mock_mark_for_deployment,
     mock_get_git_url,
@@ -57,18 +56,16 @@ def test_paasta_rollback_mark_for_deployment_simple_invocation(
 
     mock_mark_for_deployment.assert_called_once_with(
         git_url=mock_get_git_url.return_value,
-        deploy_group=fake_args.deploy_groups,
+        deploy_groups=[fake_args.deploy_groups],
         service=mock_figure_out_service_name.return_value,
         commit=fake_args.commit
     )
 
-    assert mock_mark_for_deployment.call_count == 1
-
 
 @patch('paasta_tools.cli.cmds.rollback.get_instance_config_for_service', autospec=True)
 @patch('paasta_tools.cli.cmds.rollback.figure_out_service_name', autospec=True)
 @patch('paasta_tools.cli.cmds.rollback.get_git_url', autospec=True)
-@patch('paasta_tools.cli.cmds.rollback.mark_for_deployment', autospec=True)
+@patch('paasta_tools.cli.cmds.rollback.mark_for_deployment_in_groups', autospec=True)
 def test_paasta_rollback_mark_for_deployment_no_deploy_group_arg(
     mock_mark_for_deployment,
     mock_get_git_url,
@@ -104,30 +101,18 @@ def test_paasta_rollback_mark_for_deployment_no_deploy_group_arg(
     mock_mark_for_deployment.return_value = 0
     assert paasta_rollback(fake_args) == 0
 
-    expected = [
-        call(
-            git_url=mock_get_git_url.return_value,
-            service=mock_figure_out_service_name.return_value,
-            commit=fake_args.commit,
-            deploy_group='fake_cluster.fake_instance',
-        ),
-        call(
-            git_url=mock_get_git_url.return_value,
-            service=mock_figure_out_service_name.return_value,
-            commit=fake_args.commit,
-            deploy_group='fake_deploy_group',
-        ),
-    ]
-
-    assert all([x in expected for x in mock_mark_for_deployment.mock_calls])
-    assert len(expected) == len(mock_mark_for_deployment.mock_calls)
-    assert mock_mark_for_deployment.call_count == 2
+    mock_mark_for_deployment.assert_called_once_with(
+        git_url=mock_get_git_url.return_value,
+        service=mock_figure_out_service_name.return_value,
+        commit=fake_args.commit,
+        deploy_groups=['fake_cluster.fake_instance', 'fake_deploy_group'],
+    )
 
 
 @patch('paasta_tools.cli.cmds.rollback.get_instance_config_for_service', autospec=True)
 @patch('paasta_tools.cli.cmds.rollback.figure_out_service_name', autospec=True)
 @patch('paasta_tools.cli.cmds.rollback.get_git_url', autospec=True)
-@patch('paasta_tools.cli.cmds.rollback.mark_for_deployment', autospec=True)
+@patch('paasta_tools.cli.cmds.rollback.mark_for_deployment_in_groups', autospec=True)
 def test_paasta_rollback_mark_for_deployment_wrong_deploy_group_args(
     mock_mark_for_deployment,
     mock_get_git_url,
@@ -160,7 +145,7 @@ def test_paasta_rollback_mark_for_deployment_wrong_deploy_group_args(
 @patch('paasta_tools.cli.cmds.rollback.get_instance_config_for_service', autospec=True)
 @patch('paasta_tools.cli.cmds.rollback.figure_out_service_name', autospec=True)
 @patch('paasta_tools.cli.cmds.rollback.get_git_url', autospec=True)
-@patch('paasta_tools.cli.cmds.rollback.mark_for_deployment', autospec=True)
+@patch('paasta_tools.cli.cmds.rollback.mark_for_deployment_in_groups', autospec=True)
 def test_paasta_rollback_mark_for_deployment_multiple_instance_args(
     mock_mark_for_deployment,
     mock_get_git_url,
@@ -196,23 +181,12 @@ def test_paasta_rollback_mark_for_deployment_multiple_instance_args(
     mock_mark_for_deployment.return_value = 0
     assert paasta_rollback(fake_args) == 0
 
-    expected = [
-        call(
-            git_url=mock_get_git_url.return_value,
-            service=mock_figure_out_service_name.return_value,
-            commit=fake_args.commit,
-            deploy_group='cluster.instance1',
-        ),
-        call(
-            git_url=mock_get_git_url.return_value,
-            service=mock_figure_out_service_name.return_value,
-            commit=fake_args.commit,
-            deploy_group='cluster.instance2',
-        ),
-    ]
-
-    mock_mark_for_deployment.assert_has_calls(expected, any_order=True)
-    assert mock_mark_for_deployment.call_count == 2
+    mock_mark_for_deployment.assert_called_once_with(
+        git_url=mock_get_git_url.return_value,
+        service=mock_figure_out_service_name.return_value,
+        commit=fake_args.commit,
+        deploy_groups=['cluster.instance1', 'cluster.instance2'],
+    )
 
 
 def test_validate_given_deploy_groups_no_arg():
@@ -293,7 +267,7 @@ def test_list_previously_deployed_shas():
         branch_dict={},
     )]
     with contextlib.nested(
-            patch('paasta_tools.cli.cmds.rollback.list_remote_refs', autospec=True, return_value=fake_refs),
+            patch('paasta_tools.cli.cmds.rollback.list_remote_paasta_refs', autospec=True, return_value=fake_refs),
             patch('paasta_tools.cli.cmds.rollback.get_instance_config_for_service', autospec=True,
                   return_value=fake_configs),
     ) as (
@@ -331,7 +305,7 @@ def test_list_previously_deployed_shas_no_deploy_groups():
         ),
     ]
     with contextlib.nested(
-            patch('paasta_tools.cli.cmds.rollback.list_remote_refs', autospec=True, return_value=fake_refs),
+            patch('paasta_tools.cli.cmds.rollback.list_remote_paasta_refs', autospec=True, return_value=fake_refs),
             patch('paasta_tools.cli.cmds.rollback.get_instance_config_for_service', autospec=True,
                   return_value=fake_configs),
     ) as (
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import contextlib
+import shlex
 from socket import gaierror
 
 import mock
@@ -202,6 +203,20 @@ def test_run_paasta_metastatus_verbose(mock_run):
     assert actual == mock_run.return_value[1]
 
 
+@patch('paasta_tools.cli.utils._run', autospec=True)
+def test_run_paasta_metastatus_fit(mock_run):
+    mock_run.return_value = ('unused', 'fake_output')
+    actual = utils.run_paasta_metastatus('fake_master', fit='2,4096,0,region', pool='default',
+                                         constraints=['region:LIKE:a b'])
+    command = mock_run.call_args[0][0]
+    # The arguments are quoted once for the local shlex split and once more for the remote shell
+    assert shlex.split(command) == [
+        'ssh', '-A', '-n', 'fake_master', 'sudo', 'paasta_metastatus',
+        '--fit', '2,4096,0,region', '--pool', 'default', '--constraint', "'region:LIKE:a b'",
+    ]
+    assert actual == mock_run.return_value[1]
+
+
 @patch('paasta_tools.cli.utils.calculate_remote_masters', autospec=True)
 @patch('paasta_tools.cli.utils.find_connectable_master', autospec=True)
 @patch('paasta_tools.cli.utils.run_paasta_serviceinit', autospec=True)
@@ -16,6 +16,7 @@ from datetime import datetime
 from datetime import timedelta
 
 import mock
+from kazoo.client import KazooState
 from kazoo.exceptions import NoNodeError
 from pytest import raises
 
@@ -434,3 +435,229 @@ def test_autoscale_services_bespoke_doesnt_autoscale():
     ):
         autoscaling_lib.autoscale_services()
         assert not mock_autoscale_marathon_instance.called
+
+
+def test_get_autoscaling_interval():
+    def fake_config(autoscaling):
+        return marathon_tools.MarathonServiceConfig(
+            service='fake-service',
+            instance='fake-instance',
+            cluster='fake-cluster',
+            config_dict={'min_instances': 1, 'max_instances': 10, 'autoscaling': autoscaling},
+            branch_dict={},
+        )
+    assert autoscaling_lib.get_autoscaling_interval(fake_config({})) == autoscaling_lib.AUTOSCALING_DELAY
+    assert autoscaling_lib.get_autoscaling_interval(fake_config({'interval': 60})) == 60
+    assert autoscaling_lib.get_autoscaling_interval(fake_config({'interval': 1})) == 30
+    assert autoscaling_lib.get_autoscaling_interval(fake_config({'interval': 3600})) == 600
+    with mock.patch('paasta_tools.autoscaling_lib._log', autospec=True) as mock_log:
+        assert autoscaling_lib.get_autoscaling_interval(fake_config({'interval': 'often'})) == \
+            autoscaling_lib.AUTOSCALING_DELAY
+    assert "Invalid autoscaling interval 'often'" in mock_log.call_args[1]['line']
+
+
+def test_autoscale_marathon_instance_doesnt_pass_interval():
+    fake_marathon_service_config = marathon_tools.MarathonServiceConfig(
+        service='fake-service',
+        instance='fake-instance',
+        cluster='fake-cluster',
+        config_dict={'min_instances': 1, 'max_instances': 10, 'autoscaling': {'interval': 30}},
+        branch_dict={},
+    )
+    mock_metrics_provider = mock.Mock(return_value=0.8)
+    mock_decision_policy = mock.Mock(return_value=0)
+    with contextlib.nested(
+        mock.patch('paasta_tools.autoscaling_lib.get_autoscaling_metrics_provider', autospec=True,
+                   return_value=mock_metrics_provider),
+        mock.patch('paasta_tools.autoscaling_lib.get_autoscaling_decision_policy', autospec=True,
+                   return_value=mock_decision_policy),
+        mock.patch.object(marathon_tools.MarathonServiceConfig, 'get_instances', autospec=True, return_value=5),
+        mock.patch('paasta_tools.autoscaling_lib._log', autospec=True),
+    ):
+        autoscaling_lib.autoscale_marathon_instance(fake_marathon_service_config, [mock.Mock()], [mock.Mock()])
+        assert 'interval' not in mock_metrics_provider.call_args[1]
+        assert 'interval' not in mock_decision_policy.call_args[1]
+
+
+def test_task_snapshot_refreshes_when_stale():
+    with contextlib.nested(
+        mock.patch('paasta_tools.autoscaling_lib.get_all_marathon_tasks', autospec=True,
+                   return_value=['marathon_task']),
+        mock.patch('paasta_tools.autoscaling_lib.get_running_tasks_from_active_frameworks', autospec=True,
+                   return_value=['mesos_task']),
+    ) as (
+        mock_get_all_marathon_tasks,
+        mock_get_running_tasks_from_active_frameworks,
+    ):
+        snapshot = autoscaling_lib.TaskSnapshot(max_age=30)
+        assert snapshot.get(100) == (['marathon_task'], ['mesos_task'])
+        assert snapshot.get(129) == (['marathon_task'], ['mesos_task'])
+        assert mock_get_all_marathon_tasks.call_count == 1
+        assert mock_get_running_tasks_from_active_frameworks.call_count == 1
+        snapshot.get(130)
+        assert mock_get_all_marathon_tasks.call_count == 2
+        assert mock_get_running_tasks_from_active_frameworks.call_count == 2
+
+
+def test_autoscale_due_services():
+    fast_config = marathon_tools.MarathonServiceConfig(
+        service='fake-service',
+        instance='fast',
+        cluster='fake-cluster',
+        config_dict={'min_instances': 1, 'max_instances': 10, 'autoscaling': {'interval': 30}},
+        branch_dict={},
+    )
+    slow_config = marathon_tools.MarathonServiceConfig(
+        service='fake-service',
+        instance='slow',
+        cluster='fake-cluster',
+        config_dict={'min_instances': 1, 'max_instances': 10, 'autoscaling': {'interval': 600}},
+        branch_dict={},
+    )
+    configs = {
+        ('fake-service', 'fast'): fast_config,
+        ('fake-service', 'slow'): slow_config,
+    }
+    mock_snapshot = mock.Mock(get=mock.Mock(return_value=([], [])))
+    schedule = []
+    with mock.patch('paasta_tools.autoscaling_lib.autoscale_service_config', autospec=True) as mock_autoscale:
+        autoscaling_lib.schedule_autoscaled_configs(schedule, configs, {}, 1000)
+        assert autoscaling_lib.autoscale_due_services(schedule, configs, mock_snapshot, 1001) == 2
+        assert sorted(schedule) == [(1031, ('fake-service', 'fast')), (1601, ('fake-service', 'slow'))]
+
+        mock_autoscale.reset_mock()
+        assert autoscaling_lib.autoscale_due_services(schedule, configs, mock_snapshot, 1031) == 1
+        mock_autoscale.assert_called_once_with(fast_config, [], [])
+
+        del configs[('fake-service', 'fast')]
+        mock_autoscale.reset_mock()
+        assert autoscaling_lib.autoscale_due_services(schedule, configs, mock_snapshot, 1061) == 0
+        assert not mock_autoscale.called
+        assert schedule == [(1601, ('fake-service', 'slow'))]
+
+
+def fake_autoscaled_config(instance, interval=30):
+    return marathon_tools.MarathonServiceConfig(
+        service='fake-service',
+        instance=instance,
+        cluster='fake-cluster',
+        config_dict={'min_instances': 1, 'max_instances': 10, 'autoscaling': {'interval': interval}},
+        branch_dict={},
+    )
+
+
+def test_autoscale_due_services_stops_without_leadership():
+    configs = {('fake-service', 'fast'): fake_autoscaled_config('fast')}
+    schedule = [(1000, ('fake-service', 'fast'))]
+    leadership = autoscaling_lib.AutoscalingLeadership()
+    leadership.listener(KazooState.SUSPENDED)
+    mock_snapshot = mock.Mock(get=mock.Mock(return_value=([], [])))
+    with mock.patch('paasta_tools.autoscaling_lib.autoscale_service_config', autospec=True) as mock_autoscale:
+        assert autoscaling_lib.autoscale_due_services(schedule, configs, mock_snapshot, 1001,
+                                                      leadership=leadership) == 0
+        assert not mock_autoscale.called
+        assert schedule == [(1000, ('fake-service', 'fast'))]
+
+
+def test_autoscaling_leadership_listener():
+    leadership = autoscaling_lib.AutoscalingLeadership()
+    assert leadership.is_leader()
+    leadership.listener(KazooState.SUSPENDED)
+    assert not leadership.is_leader()
+    assert leadership.state_changed.is_set()
+    leadership.listener(KazooState.CONNECTED)
+    assert leadership.is_leader()
+    leadership.listener(KazooState.SUSPENDED)
+    leadership.listener(KazooState.LOST)
+    assert leadership.lost
+    assert not leadership.is_leader()
+
+
+class FakeLeadership(autoscaling_lib.AutoscalingLeadership):
+    """An AutoscalingLeadership that replays zookeeper states instead of waiting, and is
+    lost once they run out."""
+
+    def __init__(self, states):
+        super(FakeLeadership, self).__init__()
+        self.states = list(states)
+        self.waits = []
+
+    def wait(self, seconds):
+        self.waits.append(seconds)
+        self.listener(self.states.pop(0) if self.states else KazooState.LOST)
+
+
+def test_autoscale_while_leader_survives_failed_fetch():
+    config = fake_autoscaled_config('fast')
+    leadership = FakeLeadership([KazooState.CONNECTED])
+    with contextlib.nested(
+        mock.patch('paasta_tools.autoscaling_lib.get_autoscaled_configs', autospec=True, return_value=[config]),
+        mock.patch('paasta_tools.autoscaling_lib.TaskSnapshot.get', autospec=True,
+                   side_effect=[ValueError('marathon is down'), (['marathon_task'], ['mesos_task'])]),
+        mock.patch('paasta_tools.autoscaling_lib.autoscale_service_config', autospec=True),
+        mock.patch('paasta_tools.autoscaling_lib.log', autospec=True),
+    ) as (
+        _,
+        _,
+        mock_autoscale,
+        mock_log,
+    ):
+        autoscaling_lib.autoscale_while_leader(leadership)
+    mock_autoscale.assert_called_once_with(config, ['marathon_task'], ['mesos_task'])
+    assert mock_log.exception.call_count == 1
+    assert leadership.waits[0] == autoscaling_lib.MIN_AUTOSCALING_INTERVAL
+    assert 0 < leadership.waits[1] <= 30
+
+
+def test_autoscale_while_leader_survives_failed_config_load():
+    leadership = FakeLeadership([KazooState.CONNECTED, KazooState.CONNECTED])
+    with contextlib.nested(
+        mock.patch('paasta_tools.autoscaling_lib.get_autoscaled_configs', autospec=True,
+                   side_effect=[IOError('soa configs unavailable'), IOError('soa configs unavailable'), []]),
+        mock.patch('paasta_tools.autoscaling_lib.log', autospec=True),
+    ) as (
+        mock_get_autoscaled_configs,
+        _,
+    ):
+        autoscaling_lib.autoscale_while_leader(leadership)
+    assert mock_get_autoscaled_configs.call_count == 3
+    assert leadership.waits[:2] == [30, 60]
+
+
+def test_autoscale_while_leader_pauses_while_suspended():
+    leadership = FakeLeadership([KazooState.CONNECTED])
+    leadership.listener(KazooState.SUSPENDED)
+    with contextlib.nested(
+        mock.patch('paasta_tools.autoscaling_lib.get_autoscaled_configs', autospec=True,
+                   return_value=[fake_autoscaled_config('fast')]),
+        mock.patch('paasta_tools.autoscaling_lib.TaskSnapshot.get', autospec=True, return_value=([], [])),
+        mock.patch('paasta_tools.autoscaling_lib.autoscale_service_config', autospec=True),
+        mock.patch('paasta_tools.autoscaling_lib.log', autospec=True),
+    ) as (
+        mock_get_autoscaled_configs,
+        _,
+        mock_autoscale,
+        _,
+    ):
+        autoscaling_lib.autoscale_while_leader(leadership)
+    # nothing ran until the session was reconnected by the first wait
+    assert leadership.waits[0] == autoscaling_lib.MIN_AUTOSCALING_INTERVAL
+    assert mock_get_autoscaled_configs.call_count == 1
+    assert mock_autoscale.call_count == 1
+
+
+def test_get_backoff_delay():
+    assert [autoscaling_lib.get_backoff_delay(failures) for failures in (1, 2, 3, 5, 100)] == [30, 60, 120, 480, 600]
+
+
+def test_get_autoscaled_configs_skips_broken_configs():
+    good_config = fake_autoscaled_config('good')
+    with contextlib.nested(
+        mock.patch('paasta_tools.autoscaling_lib.load_system_paasta_config', autospec=True),
+        mock.patch('paasta_tools.autoscaling_lib.get_services_for_cluster', autospec=True,
+                   return_value=[('fake-service', 'broken'), ('fake-service', 'good')]),
+        mock.patch('paasta_tools.autoscaling_lib.load_marathon_service_config', autospec=True,
+                   side_effect=[ValueError('invalid yaml'), good_config]),
+        mock.patch('paasta_tools.autoscaling_lib.log', autospec=True),
+    ):
+        assert autoscaling_lib.get_autoscaled_configs() == [good_config]
@@ -13,9 +13,11 @@
 # limitations under the License.
 import contextlib
 import datetime
+import threading
 
 import marathon
 import mock
+from pytest import raises
 
 from paasta_tools import bounce_lib
 from paasta_tools.smartstack_tools import DEFAULT_SYNAPSE_PORT
@@ -92,6 +94,29 @@ class TestBounceLib:
             assert actual_config.id == 'fake_creation'
             wait_patch.assert_called_once_with(fake_config['id'], fake_client)
 
+    def test_create_marathon_app_calls_marathon_while_holding_the_lock(self):
+        fake_client = mock.create_autospec(marathon.MarathonClient)
+        marathon_threads = []
+        fake_client.create_app.side_effect = lambda *args: marathon_threads.append(threading.current_thread())
+        with contextlib.nested(
+            mock.patch('paasta_tools.bounce_lib.create_app_lock', spec=contextlib.contextmanager),
+            mock.patch('paasta_tools.bounce_lib.wait_for_create'),
+        ):
+            bounce_lib.create_marathon_app('fake_creation', {'id': 'fake_creation'}, fake_client)
+        assert marathon_threads == [threading.current_thread()]
+
+    def test_create_marathon_app_gives_up_waiting_at_the_time_limit(self):
+        fake_client = mock.create_autospec(marathon.MarathonClient)
+        real_time_limit = bounce_lib.time_limit
+        with contextlib.nested(
+            mock.patch('paasta_tools.bounce_lib.create_app_lock', spec=contextlib.contextmanager),
+            mock.patch('paasta_tools.bounce_lib.time_limit', side_effect=lambda minutes: real_time_limit(0)),
+            mock.patch('paasta_tools.bounce_lib.marathon_tools.is_app_id_running', return_value=False),
+        ):
+            with raises(bounce_lib.TimeoutException):
+                bounce_lib.create_marathon_app('fake_creation', {'id': 'fake_creation'}, fake_client)
+        assert fake_client.create_app.call_count == 1
+
     def test_delete_marathon_app(self):
         fake_client = mock.Mock(delete_app=mock.Mock())
         fake_id = 'fake_deletion'
@@ -136,6 +161,21 @@ class TestBounceLib:
         assert sleep_patch.call_count == 2
         assert is_app_id_running_patch.call_count == 3
 
+    def test_wait_for_create_respects_time_limit(self):
+        fake_id = 'my_created'
+        fake_client = mock.Mock(spec='paasta_tools.setup_marathon_job.MarathonClient')
+        with contextlib.nested(
+            mock.patch('paasta_tools.marathon_tools.is_app_id_running', return_value=False),
+            mock.patch('time.sleep'),
+        ) as (
+            is_app_id_running_patch,
+            sleep_patch,
+        ):
+            with raises(bounce_lib.TimeoutException):
+                with bounce_lib.time_limit(0):
+                    bounce_lib.wait_for_create(fake_id, fake_client)
+        assert sleep_patch.call_count == 0
+
     def test_wait_for_create_fast(self):
         fake_id = 'my_created'
         fake_client = mock.Mock(spec='paasta_tools.setup_marathon_job.MarathonClient')
@@ -127,7 +127,7 @@ def test_build_service_job_mapping(mock_last_run_state, mock_filter_enabled_jobs
     ] * 3)
 
     fake_configured_jobs = [('service1', 'main'), ('service2', 'main'), ('service3', 'main')]
-    fake_client = Mock(list=Mock(return_value=[('service1', 'main'), ('service2', 'main'), ('service3', 'main')]))
+    fake_client = Mock(list=Mock(return_value=[]))
 
     expected_job_states = [
         ({'name': 'foo'}, chronos_tools.LastRunState.Success),
@@ -141,6 +141,9 @@ def test_build_service_job_mapping(mock_last_run_state, mock_filter_enabled_jobs
         ('service3', 'main'): expected_job_states,
     }
     assert check_chronos_jobs.build_service_job_mapping(fake_client, fake_configured_jobs) == expected
+    fake_client.list.assert_called_once_with()
+    job_indexes = set(id(call[1]['job_index']) for call in mock_lookup_chronos_jobs.call_args_list)
+    assert len(job_indexes) == 1
 
 
 def test_message_for_status_fail():
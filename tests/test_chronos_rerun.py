@@ -11,10 +11,13 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import argparse
+import contextlib
 import datetime
 import re
 
 import mock
+from pytest import raises
 
 from paasta_tools import chronos_rerun
 from paasta_tools import chronos_tools
@@ -71,3 +74,124 @@ def test_clone_job_dependent(mock_remove_parents, mock_set_default_schedule,
     assert mock_set_default_schedule.called_once()
     assert mock_modify_command_for_date.called_once()
     assert mock_set_tmp_naming_scheme.called_once()
+
+
+def test_parse_step():
+    assert chronos_rerun.parse_step('1d') == datetime.timedelta(days=1)
+    assert chronos_rerun.parse_step('6h') == datetime.timedelta(hours=6)
+    assert chronos_rerun.parse_step('30m') == datetime.timedelta(minutes=30)
+    assert chronos_rerun.parse_step('45s') == datetime.timedelta(seconds=45)
+    for bad_step in ['0d', '1w', 'd', '-1d', '1.5h']:
+        with raises(argparse.ArgumentTypeError):
+            chronos_rerun.parse_step(bad_step)
+
+
+def test_get_backfill_dates():
+    start = datetime.datetime(2016, 3, 1)
+    assert chronos_rerun.get_backfill_dates(start, datetime.datetime(2016, 3, 3), datetime.timedelta(days=1)) == [
+        datetime.datetime(2016, 3, 1), datetime.datetime(2016, 3, 2), datetime.datetime(2016, 3, 3),
+    ]
+    assert chronos_rerun.get_backfill_dates(start, datetime.datetime(2016, 3, 1, 23), datetime.timedelta(hours=12)) \
+        == [datetime.datetime(2016, 3, 1), datetime.datetime(2016, 3, 1, 12)]
+    assert chronos_rerun.get_backfill_dates(start, datetime.datetime(2016, 2, 1), datetime.timedelta(days=1)) == []
+
+
+def test_count_unfinished_clones():
+    mock_client = mock.Mock()
+    mock_client.list.return_value = [
+        {'name': 'tmp-1 foo bar'},
+        {'name': 'tmp-2 foo bar', 'lastSuccess': '2016-03-01T00:00:00Z'},
+        {'name': 'tmp-3 foo bar', 'lastError': '2016-03-01T00:00:00Z'},
+        {'name': 'tmp-4 foo other'},
+        {'name': 'foo bar'},
+    ]
+    clone_names = set(['tmp-1 foo bar', 'tmp-2 foo bar', 'tmp-3 foo bar'])
+    assert chronos_rerun.count_unfinished_clones(mock_client, 'foo', 'bar', clone_names) == 1
+
+
+def test_count_unfinished_clones_ignores_other_clones():
+    mock_client = mock.Mock()
+    mock_client.list.return_value = [
+        {'name': 'tmp-0 foo bar'},
+        {'name': 'tmp-1 foo bar'},
+    ]
+    assert chronos_rerun.count_unfinished_clones(mock_client, 'foo', 'bar', set(['tmp-1 foo bar'])) == 1
+    assert chronos_rerun.count_unfinished_clones(mock_client, 'foo', 'bar', set()) == 0
+
+
+def test_backfill_throttles_on_unfinished_clones():
+    mock_client = mock.Mock()
+    fake_job = {'name': 'foo bar', 'command': 'echo %(shortdate)s', 'schedule': 'R/2016-01-01T00:00:00Z/PT1H'}
+    dates = [datetime.datetime(2016, 3, day) for day in range(1, 6)]
+    with contextlib.nested(
+        mock.patch('paasta_tools.chronos_rerun.count_unfinished_clones', autospec=True, side_effect=[1, 2, 2, 0, 0]),
+        mock.patch('paasta_tools.chronos_rerun.time.sleep', autospec=True),
+    ) as (
+        mock_count_unfinished_clones,
+        mock_sleep,
+    ):
+        clones = chronos_rerun.backfill(mock_client, fake_job, 'foo', 'bar', dates, max_running=2, poll_interval=7)
+    assert [clone['command'] for clone in clones] == ['echo 2016-03-0%d' % day for day in range(1, 6)]
+    assert [call[0][0]['command'] for call in mock_client.add.call_args_list] == \
+        [clone['command'] for clone in clones]
+    assert mock_count_unfinished_clones.call_count == 5
+    assert mock_sleep.call_args_list == [mock.call(7)] * 4
+    assert fake_job['command'] == 'echo %(shortdate)s'
+
+
+def test_backfill_ignores_preexisting_clones():
+    mock_client = mock.Mock()
+    added = []
+    mock_client.add.side_effect = added.append
+    # a clone left over from an earlier rerun that never ran
+    mock_client.list.side_effect = lambda: [{'name': 'tmp-leftover foo bar'}] + added
+    fake_job = {'name': 'foo bar', 'command': 'echo %(shortdate)s', 'schedule': 'R/2016-01-01T00:00:00Z/PT1H'}
+    dates = [datetime.datetime(2016, 3, 1)]
+    with mock.patch('paasta_tools.chronos_rerun.time.sleep', autospec=True) as mock_sleep:
+        clones = chronos_rerun.backfill(mock_client, fake_job, 'foo', 'bar', dates, max_running=1, max_wait=1)
+    assert [clone['command'] for clone in clones] == ['echo 2016-03-01']
+    assert mock_sleep.call_count == 0
+
+
+def test_backfill_gives_up_after_max_wait():
+    mock_client = mock.Mock()
+    fake_job = {'name': 'foo bar', 'command': 'echo %(shortdate)s', 'schedule': 'R/2016-01-01T00:00:00Z/PT1H'}
+    dates = [datetime.datetime(2016, 3, day) for day in range(1, 4)]
+    with contextlib.nested(
+        mock.patch('paasta_tools.chronos_rerun.count_unfinished_clones', autospec=True, side_effect=[0, 1, 1, 1]),
+        mock.patch('paasta_tools.chronos_rerun.time.sleep', autospec=True),
+        mock.patch('paasta_tools.chronos_rerun.time.time', autospec=True, side_effect=[0, 0, 30, 60]),
+    ) as (
+        _,
+        mock_sleep,
+        _,
+    ):
+        with raises(chronos_rerun.BackfillTimeoutError):
+            chronos_rerun.backfill(mock_client, fake_job, 'foo', 'bar', dates, max_running=1, poll_interval=30,
+                                   max_wait=60)
+    assert mock_client.add.call_count == 1
+    assert mock_sleep.call_args_list == [mock.call(30)] * 2
+
+
+def test_main_backfill_timeout(capsys):
+    fake_args = mock.Mock(
+        service_instance='foo bar', soa_dir='/fake/soa', execution_date=None,
+        start=datetime.datetime(2016, 3, 1), end=datetime.datetime(2016, 3, 2), step=datetime.timedelta(days=1),
+        max_running=1, poll_interval=1, max_wait=1,
+    )
+    with contextlib.nested(
+        mock.patch('paasta_tools.chronos_rerun.parse_args', autospec=True, return_value=fake_args),
+        mock.patch('paasta_tools.chronos_rerun.load_system_paasta_config', autospec=True),
+        mock.patch('paasta_tools.chronos_rerun.chronos_tools.load_chronos_config', autospec=True),
+        mock.patch('paasta_tools.chronos_rerun.chronos_tools.get_chronos_client', autospec=True),
+        mock.patch('paasta_tools.chronos_rerun.chronos_tools.load_chronos_job_config', autospec=True),
+        mock.patch('paasta_tools.chronos_rerun.chronos_tools.create_complete_config', autospec=True,
+                   return_value={'name': 'foo bar'}),
+        mock.patch('paasta_tools.chronos_rerun.backfill', autospec=True,
+                   side_effect=chronos_rerun.BackfillTimeoutError('gave up')),
+    ):
+        with raises(SystemExit) as excinfo:
+            chronos_rerun.main()
+    assert excinfo.value.code == 1
+    out, err = capsys.readouterr()
+    assert err == 'gave up\n'
@@ -14,7 +14,10 @@
 import contextlib
 import copy
 import datetime
+import random
+import re
 
+import dateutil.tz
 import mock
 from mock import Mock
 from pytest import raises
@@ -902,6 +905,92 @@ class TestChronosTools:
                                                                 dummy_config.get_dockercfg_location())
             assert actual == expected
 
+    def test_format_chronos_job_dict_resolves_parents_from_job_graph(self):
+        chronos_job_config = chronos_tools.ChronosJobConfig(
+            service='test_service',
+            cluster='',
+            instance='child',
+            config_dict={
+                'cmd': 'true',
+                'parents': ['test_service.parent'],
+                'epsilon': 'PT60S',
+            },
+            branch_dict={},
+        )
+        fake_job_graph = mock.Mock(spec_set=chronos_tools.ChronosJobGraph)
+        fake_job_graph.resolve_parent.return_value = 'test_service parent'
+        with contextlib.nested(
+            mock.patch('paasta_tools.monitoring_tools.get_team', return_value='fake_team', autospec=True),
+            mock.patch('paasta_tools.chronos_tools.get_job_for_service_instance', autospec=True),
+        ) as (
+            _,
+            mock_get_job_for_service_instance,
+        ):
+            actual = chronos_job_config.format_chronos_job_dict(
+                'fake_docker_url', [], 'file:///root/.dockercfg', job_graph=fake_job_graph)
+        assert actual['parents'] == ['test_service parent']
+        fake_job_graph.resolve_parent.assert_called_once_with('test_service.parent')
+        assert not mock_get_job_for_service_instance.called
+
+        fake_job_graph.resolve_parent.return_value = None
+        with mock.patch('paasta_tools.monitoring_tools.get_team', return_value='fake_team', autospec=True):
+            with raises(chronos_tools.InvalidParentError):
+                chronos_job_config.format_chronos_job_dict(
+                    'fake_docker_url', [], 'file:///root/.dockercfg', job_graph=fake_job_graph)
+
+    def test_chronos_job_graph_load(self):
+        fake_client = mock.Mock(list=mock.Mock(return_value=[]))
+        fake_jobs = {
+            'service1': {
+                'parent': {'schedule': 'R/2015-03-25T19:36:35Z/PT5M', 'parents': ['ignored.job']},
+                'child': {'parents': ['service1.parent', 'badparent']},
+            },
+            'service2': {'grandchild': {'parents': 'service1.child'}},
+        }
+        with contextlib.nested(
+            mock.patch('paasta_tools.chronos_tools.get_chronos_jobs_for_cluster', autospec=True, return_value=[
+                ('service1', 'parent'), ('service1', 'child'), ('service2', 'grandchild'),
+            ]),
+            mock.patch('paasta_tools.chronos_tools.read_chronos_jobs_for_service', autospec=True,
+                       side_effect=lambda service, cluster, soa_dir: fake_jobs[service]),
+        ) as (
+            _,
+            mock_read_chronos_jobs_for_service,
+        ):
+            job_graph = chronos_tools.ChronosJobGraph.load(fake_client, 'fake_cluster', soa_dir='fake_dir')
+        assert job_graph.parents == {
+            ('service1', 'parent'): [],
+            ('service1', 'child'): [('service1', 'parent')],
+            ('service2', 'grandchild'): [('service1', 'child')],
+        }
+        assert mock_read_chronos_jobs_for_service.call_count == 2
+        fake_client.list.assert_called_once_with()
+
+    def test_chronos_job_graph_resolve_parent(self):
+        job_index = chronos_tools.ChronosJobIndex([
+            {'name': 'service1 deployed', 'disabled': False, 'lastSuccess': '2016-01-01T00:00:00Z'},
+        ])
+        job_graph = chronos_tools.ChronosJobGraph({('service1', 'configured'): []}, job_index)
+        assert job_graph.resolve_parent('service1.deployed') == 'service1 deployed'
+        assert job_graph.resolve_parent('service1.configured') == 'service1 configured'
+        assert job_graph.resolve_parent('service1.missing') is None
+
+    def test_chronos_job_graph_topological_levels(self):
+        job_graph = chronos_tools.ChronosJobGraph({
+            ('s', 'c'): [('s', 'b')],
+            ('s', 'b'): [('s', 'a'), ('other', 'external')],
+            ('s', 'a'): [],
+            ('s', 'd'): [('s', 'a')],
+            ('s', 'x'): [('s', 'y')],
+            ('s', 'y'): [('s', 'x')],
+        }, chronos_tools.ChronosJobIndex([]))
+        assert job_graph.topological_levels() == [
+            [('s', 'a')],
+            [('s', 'b'), ('s', 'd')],
+            [('s', 'c')],
+            [('s', 'x'), ('s', 'y')],
+        ]
+
     def test_format_chronos_job_dict_uses_net(self):
         fake_service = 'test_service'
         fake_job_name = 'test_job'
@@ -991,6 +1080,36 @@ class TestChronosTools:
                 include_disabled=False,
             )
 
+    def test_lookup_chronos_jobs_with_job_index(self):
+        fake_client = mock.Mock()
+        fake_job_index = mock.Mock(spec_set=chronos_tools.ChronosJobIndex)
+        assert chronos_tools.lookup_chronos_jobs(
+            client=fake_client,
+            service='fake_service',
+            instance='fake_instance',
+            job_index=fake_job_index,
+        ) == fake_job_index.lookup.return_value
+        fake_job_index.lookup.assert_called_once_with(
+            service='fake_service', instance='fake_instance', include_disabled=False)
+        assert not fake_client.list.called
+
+    def test_chronos_job_index(self):
+        fake_jobs = [
+            {'name': 'fake_service fake_instance', 'disabled': False},
+            {'name': 'tmp-2016 fake_service fake_instance', 'disabled': True},
+            {'name': 'fake_service other_instance', 'disabled': True},
+            {'name': 'not a valid name at all', 'disabled': False},
+        ]
+        job_index = chronos_tools.ChronosJobIndex.from_client(mock.Mock(list=mock.Mock(return_value=fake_jobs)))
+        for service, instance in [('fake_service', 'fake_instance'), ('fake_service', None), (None, None)]:
+            for include_disabled in (True, False):
+                assert job_index.lookup(service, instance, include_disabled) == chronos_tools.filter_chronos_jobs(
+                    fake_jobs, service, instance, include_disabled)
+        assert job_index.lookup('fake_service', 'missing_instance') == []
+        assert job_index.get_temporary_jobs('fake_service', 'fake_instance') == [fake_jobs[1]]
+        assert chronos_tools.get_temporary_jobs_for_service_instance(
+            None, 'fake_service', 'other_instance', job_index=job_index) == []
+
     def test_filter_chronos_jobs_with_no_filters(self):
         fake_jobs = [
             {
@@ -1397,16 +1516,6 @@ class TestChronosTools:
         actual = chronos_tools.parse_time_variables(input_string=test_input, parse_time=input_time)
         assert actual == expected
 
-    def test_cmp_datetimes(self):
-        before = '2015-09-22T16:46:25.111Z'
-        after = '2015-09-24T16:54:38.917Z'
-        assert chronos_tools.cmp_datetimes(before, after) == 1
-
-    def test_cmp_datetimes_with_empty_value(self):
-        before = ''
-        after = '2015-09-24T16:54:38.917Z'
-        assert chronos_tools.cmp_datetimes(before, after) == 1
-
     def test_last_success_for_job(self):
         fake_job = {
             'foo': 'bar',
@@ -1498,6 +1607,77 @@ class TestChronosTools:
         jobs = [early_job, late_job, unrun_job]
         assert chronos_tools.sort_jobs(jobs) == [late_job, early_job, unrun_job]
 
+    def test_sort_jobs_with_job_index(self):
+        jobs = [
+            {'name': 'early_job', 'lastError': '2015-04-20T16:20:00.000Z', 'lastSuccess': ''},
+            {'name': 'late_job', 'lastError': '', 'lastSuccess': '2015-04-20T16:40:00.000Z'},
+        ]
+        job_index = chronos_tools.ChronosJobIndex(jobs)
+        with mock.patch('paasta_tools.chronos_tools.parse_chronos_job', autospec=True) as mock_parse_chronos_job:
+            assert chronos_tools.sort_jobs(jobs, job_index=job_index) == [jobs[1], jobs[0]]
+            assert chronos_tools.get_status_last_run(jobs[0], job_index=job_index) == \
+                ('2015-04-20T16:20:00.000Z', chronos_tools.LastRunState.Fail)
+        assert not mock_parse_chronos_job.called
+
+    def test_sort_jobs_orders_by_most_recent_run(self):
+        timestamps = [
+            '', None, 'not a date', '2015-04-20T16:20:00.000Z', '2015-04-20T16:20:00Z',
+            '2015-04-20T18:20:00+02:00', '2015-04-20T16:20:00.001Z', '1969-12-31T00:00:00.000Z',
+        ]
+        jobs = [
+            {'name': 'job%d' % i, 'lastSuccess': success, 'lastError': failure}
+            for i, (success, failure) in enumerate(
+                (success, failure) for success in timestamps for failure in timestamps
+            )
+        ]
+
+        def parse(timestamp):
+            # unparseable timestamps count as the epoch
+            return chronos_tools.parse_chronos_timestamp(timestamp) or 0
+
+        def newest_run(job):
+            return max(parse(job['lastSuccess']), parse(job['lastError']))
+
+        assert chronos_tools.sort_jobs(jobs) == sorted(jobs, key=newest_run, reverse=True)
+        for job in jobs:
+            if job['lastSuccess'] and job['lastError']:
+                expected_state = (
+                    chronos_tools.LastRunState.Success
+                    if parse(job['lastSuccess']) >= parse(job['lastError'])
+                    else chronos_tools.LastRunState.Fail
+                )
+                assert chronos_tools.get_status_last_run(job)[1] == expected_state
+
+    def test_parse_chronos_timestamp(self):
+        assert chronos_tools.parse_chronos_timestamp('2015-10-14T19:02:31.085Z') == 1444849351.085
+        assert chronos_tools.parse_chronos_timestamp('2015-10-14T19:02:31Z') == 1444849351
+        assert chronos_tools.parse_chronos_timestamp('2015-10-14T21:02:31+02:00') == 1444849351
+        assert chronos_tools.parse_chronos_timestamp('2015-10-14T19:02:31') == 1444849351
+        assert chronos_tools.parse_chronos_timestamp('not a date') is None
+        assert chronos_tools.parse_chronos_timestamp(None) is None
+        assert chronos_tools.parse_chronos_timestamp('') is None
+
+    def test_parse_chronos_timestamp_orders_timestamps(self):
+        before = chronos_tools.parse_chronos_timestamp('2015-09-22T16:46:25.111Z')
+        after = chronos_tools.parse_chronos_timestamp('2015-09-24T16:54:38.917Z')
+        assert before < after
+        assert chronos_tools.parse_chronos_timestamp('2015-09-22T18:46:25.111+02:00') == before
+
+    def test_parse_chronos_job(self):
+        record = chronos_tools.parse_chronos_job({
+            'name': 'myjob',
+            'lastError': '2015-10-14T19:02:31.085Z',
+            'lastSuccess': 'not a date',
+        })
+        assert record == chronos_tools.ChronosJobRecord(
+            name='myjob',
+            last_success=None,
+            last_failure=1444849351.085,
+            last_run_time='2015-10-14T19:02:31.085Z',
+            last_run_state=chronos_tools.LastRunState.Fail,
+            sort_key=1444849351.085,
+        )
+
     def test_disable_job(self):
         fake_client_class = mock.Mock(spec='chronos.ChronosClient')
         fake_client = fake_client_class(servers=[])
@@ -1591,3 +1771,78 @@ class TestChronosTools:
         fake_chronos_job_config = copy.deepcopy(self.fake_chronos_job_config)
         fake_chronos_job_config.config_dict['cmd'] = '/usr/bin/printf %(shortdate)s'
         assert chronos_tools.uses_time_variables(fake_chronos_job_config)
+
+
+TIME_VARIABLE_CORPUS_TOKENS = [
+    '%(shortdate)s', '%(shortdate-1)s', '%(shortdate+40)s', '%(year)s', '%(year+2)s', '%(month-13)s',
+    '%(month)s', '%(day)s', '%(day-31)s', '%(unixtime)s', '%(unixtime-60)d', '%(daynumber)s',
+    '%(daynumber+1)05d', '%(year)d', '%(year)r', '%(year)-8s|', '%(bogus)s', '%(shortdate_x)s', '%(-1)s',
+    '%(a(b))s', '%%', '%s', '%d', '%*d', '%', '%(', '%(year)', '%-10s', 'echo ', 'foo', ' ', '-', '/tmp/',
+    '.log', u'caf\xe9 ', '100', ')s', '(',
+]
+
+
+def render_or_error(render, input_string, parse_time):
+    try:
+        # specifiers without a variable name render the context object itself
+        return 'ok', re.sub(' at 0x[0-9a-f]+', '', render(input_string, parse_time))
+    except Exception as e:
+        return 'error', type(e)
+
+
+def test_parse_time_variables_matches_tron_on_corpus():
+    rng = random.Random(0)
+    timezones = [None, dateutil.tz.tzutc(), dateutil.tz.tzoffset(None, -5 * 3600)]
+    for _ in range(3000):
+        input_string = ''.join(rng.choice(TIME_VARIABLE_CORPUS_TOKENS) for _ in range(rng.randint(0, 6)))
+        parse_time = datetime.datetime(
+            rng.randint(1990, 2030), rng.randint(1, 12), rng.randint(1, 28),
+            rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59), rng.randint(0, 999999),
+            tzinfo=rng.choice(timezones),
+        )
+        # the second render in the same minute may come from the cache
+        for render_time in (parse_time, parse_time.replace(second=rng.randint(0, 59)), parse_time):
+            assert render_or_error(chronos_tools.parse_time_variables, input_string, render_time) == \
+                render_or_error(chronos_tools.render_time_variables_with_tron, input_string, render_time), \
+                (input_string, render_time)
+
+
+def test_time_variable_template_names():
+    assert chronos_tools.TimeVariableTemplate('echo hi').names == frozenset()
+    assert chronos_tools.TimeVariableTemplate('echo 100%%').names == frozenset()
+    assert chronos_tools.TimeVariableTemplate('ls %(shortdate-1)s %(year)s %(year)s').names == \
+        frozenset(['shortdate-1', 'year'])
+    assert chronos_tools.TimeVariableTemplate('echo %s').names is None
+    assert chronos_tools.TimeVariableTemplate('echo %').names is None
+
+
+def test_parse_time_variables_skips_tron_without_variables():
+    with contextlib.nested(
+        mock.patch('paasta_tools.chronos_tools.command_context', autospec=True),
+        mock.patch.object(chronos_tools.timeutils.DateArithmetic, 'parse'),
+    ) as (
+        mock_command_context,
+        mock_parse,
+    ):
+        assert chronos_tools.parse_time_variables('echo no variables here') == 'echo no variables here'
+        assert chronos_tools.parse_time_variables('echo %(year)s', datetime.datetime(2016, 1, 1)) == \
+            'echo %s' % mock_parse.return_value
+    assert not mock_command_context.JobRunContext.called
+
+
+def test_time_variable_template_caches_per_minute():
+    template = chronos_tools.TimeVariableTemplate('ls %(shortdate)s')
+    with mock.patch.object(chronos_tools.timeutils.DateArithmetic, 'parse',
+                           side_effect=['2016-01-01', '2016-01-01']) as mock_parse:
+        assert template.render(datetime.datetime(2016, 1, 1, 10, 0, 1)) == 'ls 2016-01-01'
+        assert template.render(datetime.datetime(2016, 1, 1, 10, 0, 59)) == 'ls 2016-01-01'
+        assert mock_parse.call_count == 1
+        template.render(datetime.datetime(2016, 1, 1, 10, 1, 0))
+        assert mock_parse.call_count == 2
+
+
+def test_time_variable_template_does_not_cache_unixtime():
+    template = chronos_tools.TimeVariableTemplate('%(unixtime)s')
+    assert not template.cacheable
+    first = template.render(datetime.datetime(2016, 1, 1, 10, 0, 1))
+    assert template.render(datetime.datetime(2016, 1, 1, 10, 0, 2)) == str(int(first) + 1)
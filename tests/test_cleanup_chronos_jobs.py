@@ -11,20 +11,24 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import contextlib
 import datetime
+import threading
+import time
 
 import dateutil
 import mock
 
+from paasta_tools import chronos_tools
 from paasta_tools import cleanup_chronos_jobs
 
 
 def test_cleanup_jobs():
     chronos_client = mock.Mock()
-    returns = [None, None, Exception('boom')]
+    returns = {'foo': None, 'bar': None, 'baz': Exception('boom')}
 
-    def side_effect(*args):
-        result = returns.pop(0)
+    def side_effect(job):
+        result = returns[job]
         if isinstance(result, Exception):
             raise result
         return result
@@ -39,6 +43,28 @@ def test_cleanup_jobs():
     assert isinstance(result[2][1], Exception)
 
 
+def test_cleanup_tasks_bounds_concurrency():
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def delete_tasks(job):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+    chronos_client = mock.Mock(delete_tasks=mock.Mock(side_effect=delete_tasks))
+    jobs = ['job%d' % i for i in range(10)]
+    result = cleanup_chronos_jobs.cleanup_tasks(chronos_client, jobs, max_workers=3)
+    assert result == [(job, None) for job in jobs]
+    assert 1 <= in_flight[1] <= 3
+
+
+def test_cleanup_jobs_no_jobs():
+    assert cleanup_chronos_jobs.cleanup_jobs(mock.Mock(), []) == []
+
+
 def test_format_list_output():
     assert cleanup_chronos_jobs.format_list_output("Successfully Removed:", ['foo', 'bar', 'baz']) \
         == "Successfully Removed:\n  foo\n  bar\n  baz"
@@ -50,19 +76,65 @@ def test_deployed_job_names():
     assert cleanup_chronos_jobs.deployed_job_names(mock_client) == ['foo', 'bar']
 
 
-@mock.patch('paasta_tools.cleanup_chronos_jobs.chronos_tools.get_temporary_jobs_for_service_instance')
-def test_filter_expired_tmp_jobs(mock_get_temporary_jobs):
-    two_days_ago = datetime.datetime.now(dateutil.tz.tzutc()) - datetime.timedelta(days=2)
-    one_hour_ago = datetime.datetime.now(dateutil.tz.tzutc()) - datetime.timedelta(hours=1)
-    mock_get_temporary_jobs.side_effect = [
-                                          [{'name': 'tmp foo bar',
-                                            'lastSuccess': two_days_ago.isoformat()}],
-                                          [{'name': 'tmp anotherservice anotherinstance',
-                                            'lastSuccess': one_hour_ago.isoformat()}]]
-    actual = cleanup_chronos_jobs.filter_expired_tmp_jobs(mock.Mock(), ['foo bar', 'anotherservice anotherinstance'])
-    assert actual == ['foo bar']
+def test_filter_expired_tmp_jobs():
+    now = datetime.datetime.now(dateutil.tz.tzutc())
+    two_days_ago = now - datetime.timedelta(days=2)
+    one_hour_ago = now - datetime.timedelta(hours=1)
+    mock_client = mock.Mock()
+    mock_client.list.return_value = [
+        {'name': 'tmp foo bar', 'lastSuccess': two_days_ago.isoformat()},
+        {'name': 'tmp anotherservice anotherinstance', 'lastSuccess': one_hour_ago.isoformat()},
+        {'name': 'tmp2 anotherservice anotherinstance', 'lastError': two_days_ago.strftime('%Y-%m-%dT%H:%M:%S.%fZ')},
+        {'name': 'tmp notrun instance'},
+        {'name': 'foo bar', 'lastSuccess': two_days_ago.isoformat()},
+    ]
+    actual = cleanup_chronos_jobs.filter_expired_tmp_jobs(mock_client, [
+        'tmp foo bar', 'tmp anotherservice anotherinstance', 'tmp2 anotherservice anotherinstance',
+        'tmp notrun instance',
+    ])
+    assert actual == ['tmp foo bar', 'tmp2 anotherservice anotherinstance']
+    mock_client.list.assert_called_once_with()
+
+
+def test_filter_expired_tmp_jobs_uses_job_index():
+    mock_client = mock.Mock()
+    job_index = chronos_tools.ChronosJobIndex([{'name': 'tmp foo bar', 'lastSuccess': '2016-01-01T00:00:00.000Z'}])
+    now = datetime.datetime(2016, 1, 3, tzinfo=dateutil.tz.tzutc())
+    assert cleanup_chronos_jobs.filter_expired_tmp_jobs(
+        mock_client, ['tmp foo bar'], job_index=job_index, now=now) == ['tmp foo bar']
+    assert not mock_client.list.called
 
 
 def test_filter_paasta_jobs():
     expected = ['foo bar']
     assert cleanup_chronos_jobs.filter_paasta_jobs(['foo bar', 'madeupchronosjob']) == expected
+
+
+def test_main_dry_run(capsys):
+    mock_client = mock.Mock()
+    mock_client.list.return_value = [{'name': 'foo bar'}, {'name': 'old job'}]
+    with contextlib.nested(
+        mock.patch('paasta_tools.cleanup_chronos_jobs.parse_args', autospec=True),
+        mock.patch('paasta_tools.cleanup_chronos_jobs.chronos_tools.load_chronos_config', autospec=True),
+        mock.patch('paasta_tools.cleanup_chronos_jobs.chronos_tools.get_chronos_client', autospec=True,
+                   return_value=mock_client),
+        mock.patch('paasta_tools.cleanup_chronos_jobs.chronos_tools.get_chronos_jobs_for_cluster', autospec=True,
+                   return_value=[('foo', 'bar')]),
+        mock.patch('paasta_tools.cleanup_chronos_jobs.cleanup_tasks', autospec=True),
+        mock.patch('paasta_tools.cleanup_chronos_jobs.cleanup_jobs', autospec=True),
+    ) as (
+        mock_parse_args,
+        _,
+        _,
+        _,
+        mock_cleanup_tasks,
+        mock_cleanup_jobs,
+    ):
+        mock_parse_args.return_value.dry_run = True
+        cleanup_chronos_jobs.main()
+    out, _ = capsys.readouterr()
+    assert "Would Remove Jobs and their Tasks:\n  old job" in out
+    assert "Phase timings:" in out
+    assert "list jobs: " in out
+    assert not mock_cleanup_tasks.called
+    assert not mock_cleanup_jobs.called
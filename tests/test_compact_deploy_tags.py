@@ -0,0 +1,115 @@
+# Copyright 2015 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import contextlib
+
+import dulwich.errors
+import mock
+from pytest import raises
+
+from paasta_tools import compact_deploy_tags
+from paasta_tools import generate_deployments_for_service
+from paasta_tools.utils import DeploymentsJson
+
+
+FAKE_REFS = {
+    'refs/heads/master': 'master',
+    'refs/tags/v1.0': 'release',
+    'refs/tags/paasta-cluster.main-20160101T000000-deploy': 'sha1',
+    'refs/tags/paasta-cluster.main-20160102T000000-deploy': 'sha2',
+    'refs/tags/paasta-cluster.main-20160103T000000-deploy': 'sha3',
+    'refs/tags/paasta-cluster.main-20160104T000000-deploy': 'sha4',
+    'refs/tags/paasta-cluster.canary-20160101T000000-deploy': 'sha1',
+    # sha2 was stopped, then started and stopped again
+    'refs/tags/paasta-cluster.main-20160102T010000-stop': 'sha2',
+    'refs/tags/paasta-cluster.main-20160102T020000-start': 'sha2',
+    'refs/tags/paasta-paasta-cluster.main-20160102T030000-stop': 'sha2',
+    'refs/tags/paasta-cluster.main-20160104T010000-stop': 'sha4',
+    'refs/tags/paasta-cluster.main-20160104T020000-start': 'sha4',
+}
+
+
+def test_find_compactable_tags():
+    assert compact_deploy_tags.find_compactable_tags(FAKE_REFS, keep=2) == {
+        'refs/tags/paasta-cluster.main-20160101T000000-deploy': 'sha1',
+        'refs/tags/paasta-cluster.main-20160102T000000-deploy': 'sha2',
+        'refs/tags/paasta-cluster.main-20160102T010000-stop': 'sha2',
+        'refs/tags/paasta-cluster.main-20160102T020000-start': 'sha2',
+    }
+
+
+def test_find_compactable_tags_keeps_deployed_shas():
+    compactable = compact_deploy_tags.find_compactable_tags(FAKE_REFS, keep=1, keep_shas={'sha2'})
+    assert not [sha for sha in compactable.values() if sha == 'sha2']
+    assert 'refs/tags/paasta-cluster.main-20160103T000000-deploy' in compactable
+
+
+def test_find_compactable_tags_keeps_desired_states():
+    remaining = dict(FAKE_REFS)
+    for ref_name in compact_deploy_tags.find_compactable_tags(FAKE_REFS, keep=1):
+        del remaining[ref_name]
+    for sha in ('sha1', 'sha2', 'sha3', 'sha4'):
+        # as if sha were deployed again
+        refs = dict(FAKE_REFS, **{'refs/tags/paasta-cluster.main-20170101T000000-deploy': sha})
+        compacted_refs = dict(remaining, **{'refs/tags/paasta-cluster.main-20170101T000000-deploy': sha})
+        assert generate_deployments_for_service.get_desired_state('cluster.main', compacted_refs, 'cluster.main') == \
+            generate_deployments_for_service.get_desired_state('cluster.main', refs, 'cluster.main')
+
+
+def test_compact_deploy_tags(tmpdir):
+    with contextlib.nested(
+        mock.patch('paasta_tools.compact_deploy_tags.load_deployments_json', autospec=True,
+                   return_value=DeploymentsJson({
+                       'fake_service:paasta-cluster.main': {'docker_image': 'services-fake_service:paasta-sha4'},
+                   })),
+        mock.patch('paasta_tools.compact_deploy_tags.get_git_url', autospec=True, return_value='fake_git_url'),
+        mock.patch('paasta_tools.compact_deploy_tags.remote_git.list_remote_refs', autospec=True,
+                   return_value=FAKE_REFS),
+        mock.patch('paasta_tools.compact_deploy_tags.remote_git.delete_remote_refs', autospec=True),
+    ) as (
+        _,
+        _,
+        _,
+        mock_delete_remote_refs,
+    ):
+        compacted = compact_deploy_tags.compact_deploy_tags('fake_service', '/fake/soa/dir', keep=1, dry_run=True)
+        # sha4 is deployed, so even its superseded stop tag is kept
+        assert 'refs/tags/paasta-cluster.main-20160104T010000-stop' not in compacted
+        assert 'refs/tags/paasta-cluster.main-20160103T000000-deploy' in compacted
+        assert not mock_delete_remote_refs.called
+        assert not tmpdir.listdir()
+
+        assert compact_deploy_tags.compact_deploy_tags(
+            'fake_service', '/fake/soa/dir', keep=1, archive_dir=str(tmpdir)) == compacted
+        mock_delete_remote_refs.assert_called_once_with('fake_git_url', compacted)
+    archive = tmpdir.join('fake_service.packed-refs').read().splitlines()
+    assert archive[0].startswith('# deleted from fake_git_url at ')
+    assert archive[1:] == ['%s %s' % (sha, ref_name) for ref_name, sha in sorted(compacted.items())]
+
+
+def test_main_continues_after_failed_delete():
+    fake_args = mock.Mock(services=['a', 'b'], soa_dir='/fake/soa', keep=1, archive_dir='/fake/archive', dry_run=False)
+    with contextlib.nested(
+        mock.patch('paasta_tools.compact_deploy_tags.parse_args', autospec=True, return_value=fake_args),
+        mock.patch('paasta_tools.compact_deploy_tags.compact_deploy_tags', autospec=True, side_effect=[
+            dulwich.errors.UpdateRefsError('rejected', ref_status={'refs/tags/paasta-x': 'denied'}),
+            {'refs/tags/paasta-y': 'sha'},
+        ]),
+    ) as (
+        _,
+        mock_compact_deploy_tags,
+    ):
+        with raises(SystemExit) as excinfo:
+            compact_deploy_tags.main()
+    assert excinfo.value.code == 1
+    assert [call[1]['service'] for call in mock_compact_deploy_tags.call_args_list] == ['a', 'b']
@@ -0,0 +1,155 @@
+# Copyright 2015 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import contextlib
+import os
+
+import mock
+from pytest import raises
+
+from paasta_tools import generate_deployments_for_all_services
+
+
+def fake_generate_deployments_for_service(service, soa_dir):
+    if service == 'broken':
+        raise ValueError('no git server')
+    return service == 'changed'
+
+
+def test_generate_all_deployments():
+    with mock.patch(
+        'paasta_tools.generate_deployments_for_all_services.generate_deployments_for_service',
+        autospec=True,
+        side_effect=fake_generate_deployments_for_service,
+    ):
+        results = generate_deployments_for_all_services.generate_all_deployments(
+            ['changed', 'broken', 'unchanged'], '/fake/soa/dir', max_workers=2)
+    assert [(service, changed) for service, changed, _, _ in results] == [
+        ('changed', True),
+        ('broken', False),
+        ('unchanged', False),
+    ]
+    assert isinstance(results[1][3], ValueError)
+    assert results[0][3] is None
+    assert results[2][3] is None
+
+
+def test_delete_old_deployments(tmpdir):
+    for service in ('old', 'new'):
+        tmpdir.mkdir(service).join('deployments.json').write('{}')
+    tmpdir.mkdir('nodeployments')
+    old_path = str(tmpdir.join('old', 'deployments.json'))
+    os.utime(old_path, (0, 0))
+    assert generate_deployments_for_all_services.delete_old_deployments(str(tmpdir)) == [old_path]
+    assert not tmpdir.join('old', 'deployments.json').check()
+    assert tmpdir.join('new', 'deployments.json').check()
+
+
+def test_format_report():
+    results = [
+        ('fast', False, 0.1, None),
+        ('slow', True, 2.0, None),
+        ('broken', False, 1.0, ValueError('no git server')),
+    ]
+    assert generate_deployments_for_all_services.format_report(results) == (
+        "broken: 1.00s FAILED: no git server\n"
+        "3 services, 1 changed, 1 failed, slowest 2.00s"
+    )
+    assert generate_deployments_for_all_services.format_report(results, verbose=True) == (
+        "slow: 2.00s\n"
+        "broken: 1.00s FAILED: no git server\n"
+        "fast: 0.10s\n"
+        "3 services, 1 changed, 1 failed, slowest 2.00s"
+    )
+
+
+def test_main_prints_changed_services(capsys):
+    with contextlib.nested(
+        mock.patch('paasta_tools.generate_deployments_for_all_services.parse_args', autospec=True,
+                   return_value=mock.Mock(soa_dir='/fake/soa/dir', workers=4, verbose=False)),
+        mock.patch('paasta_tools.generate_deployments_for_all_services.service_configuration_lib'
+                   '.read_services_configuration', autospec=True,
+                   return_value={'changed': {}, 'unchanged': {}}),
+        mock.patch('paasta_tools.generate_deployments_for_all_services.generate_deployments_for_service',
+                   autospec=True, side_effect=fake_generate_deployments_for_service),
+        mock.patch('paasta_tools.generate_deployments_for_all_services.delete_old_deployments', autospec=True,
+                   return_value=[]),
+        mock.patch('paasta_tools.generate_deployments_for_all_services.get_deployments_store_path', autospec=True,
+                   return_value=None),
+    ) as (
+        _,
+        _,
+        _,
+        mock_delete_old_deployments,
+        _,
+    ):
+        generate_deployments_for_all_services.main()
+    out, err = capsys.readouterr()
+    assert out == "changed\n"
+    assert "2 services, 1 changed, 0 failed" in err
+    mock_delete_old_deployments.assert_called_once_with('/fake/soa/dir')
+
+
+def test_main_keeps_old_deployments_on_failure(capsys):
+    with contextlib.nested(
+        mock.patch('paasta_tools.generate_deployments_for_all_services.parse_args', autospec=True,
+                   return_value=mock.Mock(soa_dir='/fake/soa/dir', workers=4, verbose=False)),
+        mock.patch('paasta_tools.generate_deployments_for_all_services.service_configuration_lib'
+                   '.read_services_configuration', autospec=True,
+                   return_value={'changed': {}, 'broken': {}}),
+        mock.patch('paasta_tools.generate_deployments_for_all_services.generate_deployments_for_service',
+                   autospec=True, side_effect=fake_generate_deployments_for_service),
+        mock.patch('paasta_tools.generate_deployments_for_all_services.delete_old_deployments', autospec=True),
+        mock.patch('paasta_tools.generate_deployments_for_all_services.get_deployments_store_path', autospec=True,
+                   return_value=None),
+    ) as (
+        _,
+        _,
+        _,
+        mock_delete_old_deployments,
+        _,
+    ):
+        with raises(SystemExit) as excinfo:
+            generate_deployments_for_all_services.main()
+    assert excinfo.value.code == 1
+    out, err = capsys.readouterr()
+    assert out == "changed\n"
+    assert "broken: " in err
+    assert not mock_delete_old_deployments.called
+
+
+def test_main_writes_deployments_store(capsys, tmpdir):
+    store_path = str(tmpdir.join('deployments.sqlite'))
+    with contextlib.nested(
+        mock.patch('paasta_tools.generate_deployments_for_all_services.parse_args', autospec=True,
+                   return_value=mock.Mock(soa_dir='/fake/soa/dir', workers=4, verbose=False)),
+        mock.patch('paasta_tools.generate_deployments_for_all_services.service_configuration_lib'
+                   '.read_services_configuration', autospec=True,
+                   return_value={'changed': {}, 'unchanged': {}}),
+        mock.patch('paasta_tools.generate_deployments_for_all_services.generate_deployments_for_service',
+                   autospec=True, side_effect=fake_generate_deployments_for_service),
+        mock.patch('paasta_tools.generate_deployments_for_all_services.delete_old_deployments', autospec=True,
+                   return_value=[]),
+        mock.patch('paasta_tools.generate_deployments_for_all_services.get_deployments_store_path', autospec=True,
+                   return_value=store_path),
+        mock.patch('paasta_tools.generate_deployments_for_all_services.write_deployments_store', autospec=True),
+    ) as (
+        _,
+        _,
+        _,
+        _,
+        _,
+        mock_write_deployments_store,
+    ):
+        generate_deployments_for_all_services.main()
+    mock_write_deployments_store.assert_called_once_with(store_path, '/fake/soa/dir', ['changed', 'unchanged'])
@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import contextlib
+import json
+import os
 
 import mock
 
@@ -64,7 +66,7 @@ def test_get_deploy_group_mappings():
     with contextlib.nested(
         mock.patch('paasta_tools.generate_deployments_for_service.get_instance_config_for_service',
                    return_value=fake_service_configs),
-        mock.patch('paasta_tools.remote_git.list_remote_refs',
+        mock.patch('paasta_tools.remote_git.list_remote_paasta_refs',
                    return_value=fake_remote_refs),
     ) as (
         get_instance_config_for_service_patch,
@@ -122,7 +124,7 @@ def test_main():
         ),
 
         join_patch.assert_any_call('ABSOLUTE', 'fake_service', generate_deployments_for_service.TARGET_FILE),
-        assert join_patch.call_count == 2
+        assert join_patch.call_count == 1
 
         atomic_file_write_patch.assert_called_once_with('JOIN')
         open_patch.assert_called_once_with('JOIN', 'r')
@@ -137,6 +139,30 @@ def test_main():
         json_load_patch.assert_called_once_with(file_mock.__enter__())
 
 
+def test_generate_deployments_for_service_skips_unchanged(tmpdir):
+    tmpdir.mkdir('fake_service')
+    deployments_json = tmpdir.join('fake_service', generate_deployments_for_service.TARGET_FILE)
+    mappings = {'fake_service:paasta-cluster.main': {
+        'docker_image': 'services-fake_service:paasta-123456',
+        'desired_state': 'start',
+        'force_bounce': None,
+    }}
+    with mock.patch(
+        'paasta_tools.generate_deployments_for_service.get_deploy_group_mappings',
+        return_value=mappings,
+        autospec=True,
+    ):
+        assert generate_deployments_for_service.generate_deployments_for_service('fake_service', str(tmpdir))
+        os.utime(str(deployments_json), (0, 0))
+        with mock.patch(
+            'paasta_tools.generate_deployments_for_service.atomic_file_write', autospec=True,
+        ) as atomic_file_write_patch:
+            assert not generate_deployments_for_service.generate_deployments_for_service('fake_service', str(tmpdir))
+        assert not atomic_file_write_patch.called
+    assert deployments_json.mtime() > 0
+    assert json.loads(deployments_json.read()) == {'v1': mappings}
+
+
 def test_get_deployments_dict():
     branch_mappings = {
         'app1': {
@@ -191,3 +217,37 @@ def test_get_desired_state_fails_gracefully_with_start():
     actual = generate_deployments_for_service.get_desired_state(branch, remote_refs, deploy_group)
 
     assert actual == expected_desired_state
+
+
+def test_deploy_tag_index():
+    remote_refs = {
+        'refs/tags/paasta-cluster.instance-20160101T000000-deploy': 'AAAA',
+        'refs/tags/paasta-cluster.instance-20160308T053933-deploy': 'BBBB',
+        'refs/tags/paasta-cluster.instance-canary-20160401T000000-deploy': 'CCCC',
+        'refs/tags/paasta-cluster.instance-20160309T000000-start': 'BBBB',
+        'refs/tags/paasta-paasta-cluster.instance-20160310T000000-stop': 'BBBB',
+        'refs/tags/paasta-cluster.instance-canary-20160402T000000-stop': 'CCCC',
+    }
+    tag_index = generate_deployments_for_service.DeployTagIndex(remote_refs)
+    assert tag_index.get_latest_deployment_tag('cluster.instance') == (
+        'refs/tags/paasta-cluster.instance-20160308T053933-deploy', 'BBBB')
+    assert tag_index.get_latest_deployment_tag('cluster.instance-canary') == (
+        'refs/tags/paasta-cluster.instance-canary-20160401T000000-deploy', 'CCCC')
+    assert tag_index.get_latest_deployment_tag('cluster') == (None, None)
+    assert sorted(tag_index.get_states('cluster.instance', 'BBBB')) == [
+        ('start', '20160309T000000'),
+        ('stop', '20160310T000000'),
+    ]
+    assert tag_index.get_states('cluster.instance', 'CCCC') == []
+    assert generate_deployments_for_service.get_desired_state(
+        'cluster.instance', remote_refs, 'cluster.instance', tag_index=tag_index) == ('stop', '20160310T000000')
+
+
+def test_get_latest_deployment_tag():
+    remote_refs = {
+        'refs/tags/paasta-cluster.instance-20160101T000000-deploy': 'AAAA',
+        'refs/tags/paasta-cluster.instance-20160308T053933-deploy': 'BBBB',
+        'refs/heads/master': 'CCCC',
+    }
+    assert generate_deployments_for_service.get_latest_deployment_tag(remote_refs, 'cluster.instance') == (
+        'refs/tags/paasta-cluster.instance-20160308T053933-deploy', 'BBBB')
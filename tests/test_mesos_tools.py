@@ -13,7 +13,11 @@
 # limitations under the License.
 import contextlib
 import datetime
+import io
+import json
 import random
+import threading
+import time
 
 import docker
 import mesos
@@ -25,6 +29,7 @@ from pytest import raises
 import paasta_tools.mesos_tools as mesos_tools
 from paasta_tools.marathon_tools import format_job_id
 from paasta_tools.utils import PaastaColors
+from paasta_tools.utils import Timeout
 
 
 def test_filter_running_tasks():
@@ -48,40 +53,54 @@ def test_filter_not_running_tasks():
 
 
 @mark.parametrize('test_case', [
-    [False, 0],
-    [True, 1 + 10]  # 1 running task, 10 non-running taks (truncated)
+    [False, 0, 1],
+    [True, 1 + 10, 2]  # 1 running task, 10 non-running taks (truncated)
 ])
 def test_status_mesos_tasks_verbose(test_case):
-    tail_stdstreams, expected_format_tail_call_count = test_case
+    tail_stdstreams, expected_format_tail_call_count, expected_slave_fetch_count = test_case
     with contextlib.nested(
         mock.patch('paasta_tools.mesos_tools.get_running_tasks_from_active_frameworks', autospec=True,),
         mock.patch('paasta_tools.mesos_tools.get_non_running_tasks_from_active_frameworks', autospec=True,),
         mock.patch('paasta_tools.mesos_tools.format_running_mesos_task_row', autospec=True,),
         mock.patch('paasta_tools.mesos_tools.format_non_running_mesos_task_row', autospec=True,),
         mock.patch('paasta_tools.mesos_tools.format_stdstreams_tail_for_task', autospec=True,),
+        mock.patch('paasta_tools.mesos_tools.fetch_slave_task_data', autospec=True,),
     ) as (
         get_running_mesos_tasks_patch,
         get_non_running_mesos_tasks_patch,
         format_running_mesos_task_row_patch,
         format_non_running_mesos_task_row_patch,
         format_stdstreams_tail_for_task_patch,
+        fetch_slave_task_data_patch,
     ):
-        get_running_mesos_tasks_patch.return_value = ['doing a lap']
+        running_task = gen_fake_mesos_task('doing a lap', 'running_slave')
+        get_running_mesos_tasks_patch.return_value = [running_task]
 
-        template_task_return = {
-            'statuses': [{'timestamp': '##########'}],
-            'state': 'NOT_RUNNING',
-        }
         non_running_mesos_tasks = []
-        for _ in xrange(15):  # excercise the code that sorts/truncates the list of non running tasks
-            task_return = template_task_return.copy()
-            task_return['statuses'][0]['timestamp'] = str(1457109986 + random.randrange(-60 * 60 * 24, 60 * 60 * 24))
+        for i in xrange(15):  # excercise the code that sorts/truncates the list of non running tasks
+            task_return = gen_fake_mesos_task('not running %d' % i, 'non_running_slave', 'NOT_RUNNING')
+            task_return.__getitem__.side_effect = {
+                'id': 'not running %d' % i,
+                'slave_id': 'non_running_slave',
+                'state': 'NOT_RUNNING',
+                'statuses': [{'timestamp': str(1457109986 + random.randrange(-60 * 60 * 24, 60 * 60 * 24))}],
+            }.__getitem__
             non_running_mesos_tasks.append(task_return)
         get_non_running_mesos_tasks_patch.return_value = non_running_mesos_tasks
 
-        format_running_mesos_task_row_patch.return_value = ['id', 'host', 'mem', 'cpu', 'time']
+        # The running rows and the tails look up the slave data, like the real ones do
+        def format_running_mesos_task_row(task, get_short_task_id):
+            task.stats
+            return ['id', 'host', 'mem', 'cpu', 'time']
+
+        def format_stdstreams_tail_for_task(task, get_short_task_id):
+            task.directory
+            return ['tail']
+
+        format_running_mesos_task_row_patch.side_effect = format_running_mesos_task_row
         format_non_running_mesos_task_row_patch.return_value = ['id', 'host', 'time', 'state']
-        format_stdstreams_tail_for_task_patch.return_value = ['tail']
+        format_stdstreams_tail_for_task_patch.side_effect = format_stdstreams_tail_for_task
+        fetch_slave_task_data_patch.return_value = {}
         job_id = format_job_id('fake_service', 'fake_instance'),
 
         def get_short_task_id(_):
@@ -90,9 +109,12 @@ def test_status_mesos_tasks_verbose(test_case):
         actual = mesos_tools.status_mesos_tasks_verbose(job_id, get_short_task_id, tail_stdstreams)
         assert 'Running Tasks' in actual
         assert 'Non-Running Tasks' in actual
-        format_running_mesos_task_row_patch.assert_called_once_with('doing a lap', get_short_task_id)
+        assert format_running_mesos_task_row_patch.call_count == 1
+        prefetched_task, _ = format_running_mesos_task_row_patch.call_args[0]
+        assert prefetched_task.task is running_task
         assert format_non_running_mesos_task_row_patch.call_count == 10  # maximum n of tasks we display
         assert format_stdstreams_tail_for_task_patch.call_count == expected_format_tail_call_count
+        assert fetch_slave_task_data_patch.call_count == expected_slave_fetch_count
 
 
 def test_get_cpu_usage_good():
@@ -164,6 +186,30 @@ def test_get_mem_usage_divide_by_zero():
     assert actual == "Undef"
 
 
+def test_format_running_mesos_task_row_blocked_past_deadline():
+    release = threading.Event()
+
+    class BlockingTask(dict):
+        @property
+        def slave(self):
+            return {'hostname': 'host1.fake.domain'}
+
+        @property
+        def mem_limit(self):
+            release.wait(10)
+            return 0
+
+        cpu_limit = mem_limit
+
+    task = BlockingTask(id='task1', statuses=[{'timestamp': 1457109986}])
+    try:
+        with Timeout(0.1):
+            row = mesos_tools.format_running_mesos_task_row(task, lambda task_id: task_id)
+    finally:
+        release.set()
+    assert row[2:4] == ('Timed Out', 'Timed Out')
+
+
 def test_get_zookeeper_config():
     zk_hosts = '1.1.1.1:1111,2.2.2.2:2222,3.3.3.3:3333'
     zk_path = 'fake_path'
@@ -300,13 +346,8 @@ def test_slave_passes_whitelist():
 
 
 @mock.patch('paasta_tools.mesos_tools.get_mesos_state_from_leader', autospec=True)
-@mock.patch('paasta_tools.mesos_tools.filter_mesos_slaves_by_blacklist', autospec=True)
-def test_get_mesos_slaves_grouped_by_attribute_uses_blacklist(
-    mock_filter_mesos_slaves_by_blacklist,
-    mock_fetch_state
-):
-    fake_blacklist = ['fake_blacklist']
-    fake_whitelist = []
+def test_get_mesos_slaves_grouped_by_attribute_uses_blacklist(mock_fetch_state):
+    fake_blacklist = [['fake_attribute', 'fake_value_1']]
     fake_slaves = [
         {
             'hostname': 'fake_host_1',
@@ -317,15 +358,93 @@ def test_get_mesos_slaves_grouped_by_attribute_uses_blacklist(
         {
             'hostname': 'fake_host_2',
             'attributes': {
-                'fake_attribute': 'fake_value_1',
+                'fake_attribute': 'fake_value_2',
             }
         }
     ]
     mock_fetch_state.return_value = {'slaves': fake_slaves}
-    mock_filter_mesos_slaves_by_blacklist.return_value = fake_slaves
-    mesos_tools.get_mesos_slaves_grouped_by_attribute('fake_attribute', blacklist=fake_blacklist)
-    mock_filter_mesos_slaves_by_blacklist.assert_called_once_with(slaves=fake_slaves, blacklist=fake_blacklist,
-                                                                  whitelist=fake_whitelist)
+    actual = mesos_tools.get_mesos_slaves_grouped_by_attribute('fake_attribute', blacklist=fake_blacklist)
+    assert actual == {'fake_value_2': ['fake_host_2']}
+
+
+@mock.patch('paasta_tools.mesos_tools._slave_attribute_index', (None, None))
+@mock.patch('paasta_tools.mesos_tools.get_mesos_state_from_leader', autospec=True)
+def test_get_mesos_slaves_grouped_by_attribute_reuses_index(mock_fetch_state):
+    mock_fetch_state.return_value = {'slaves': [
+        {'hostname': 'fake_host_1', 'attributes': {'fake_attribute': 'fake_value_1'}},
+    ]}
+    with mock.patch('paasta_tools.mesos_tools.SlaveAttributeIndex', autospec=True) as mock_index:
+        mesos_tools.get_mesos_slaves_grouped_by_attribute('fake_attribute')
+        mesos_tools.get_mesos_slaves_grouped_by_attribute('fake_attribute')
+        assert mock_index.call_count == 1
+
+
+@mock.patch('paasta_tools.mesos_tools._slave_attribute_index', (None, None))
+@mock.patch('paasta_tools.mesos_tools.get_mesos_state_from_leader', autospec=True)
+def test_get_mesos_slaves_grouped_by_attribute_reuses_index_for_refetched_state(mock_fetch_state):
+    def fake_state(value):
+        return {'slaves': [{'hostname': 'fake_host_1', 'attributes': {'fake_attribute': value}}]}
+    with mock.patch('paasta_tools.mesos_tools.SlaveAttributeIndex', autospec=True) as mock_index:
+        mock_fetch_state.return_value = fake_state('fake_value_1')
+        mesos_tools.get_mesos_slaves_grouped_by_attribute('fake_attribute')
+        mock_fetch_state.return_value = fake_state('fake_value_1')
+        mesos_tools.get_mesos_slaves_grouped_by_attribute('fake_attribute')
+        assert mock_index.call_count == 1
+        mock_fetch_state.return_value = fake_state('fake_value_2')
+        mesos_tools.get_mesos_slaves_grouped_by_attribute('fake_attribute')
+        assert mock_index.call_count == 2
+
+
+def test_slave_attribute_index_grouped_by_attribute_returns_copies():
+    index = mesos_tools.SlaveAttributeIndex([
+        {'hostname': 'host_a', 'attributes': {'region': 'west'}},
+    ])
+    index.grouped_by_attribute('region')['west'].append('host_b')
+    assert index.grouped_by_attribute('region') == {'west': ['host_a']}
+
+
+def test_slave_attribute_index_grouped_by_attribute():
+    fake_slaves = [
+        {'hostname': 'host_c', 'attributes': {'region': 'west', 'habitat': 'c1', 'pool': 'default'}},
+        {'hostname': 'host_a', 'attributes': {'region': 'west', 'habitat': 'a1', 'pool': 'default'}},
+        {'hostname': 'host_b', 'attributes': {'region': 'east', 'habitat': 'b1', 'pool': 'batch'}},
+        {'hostname': 'host_d', 'attributes': {'region': 'east', 'habitat': 'd1'}},
+    ]
+    index = mesos_tools.SlaveAttributeIndex(fake_slaves)
+    assert index.grouped_by_attribute('region') == {
+        'west': ['host_a', 'host_c'],
+        'east': ['host_b', 'host_d'],
+    }
+    assert index.grouped_by_attribute('pool') == {
+        'default': ['host_a', 'host_c'],
+        'batch': ['host_b'],
+    }
+    assert index.grouped_by_attribute('region', blacklist=[['habitat', 'a1'], ['habitat', 'd1']]) == {
+        'west': ['host_c'],
+        'east': ['host_b'],
+    }
+    assert index.grouped_by_attribute('habitat', whitelist=['region', ['east']]) == {
+        'b1': ['host_b'],
+        'd1': ['host_d'],
+    }
+    assert index.grouped_by_attribute('fake_attribute') == {}
+    with raises(mesos_tools.NoSlavesAvailable):
+        index.grouped_by_attribute('region', whitelist=['region', ['north']])
+
+
+def test_slave_attribute_index_matches_filter_functions():
+    fake_slaves = [
+        {'hostname': 'host_%d' % i, 'attributes': {'region': 'region_%d' % (i % 3), 'habitat': 'habitat_%d' % (i % 5)}}
+        for i in xrange(30)
+    ]
+    fake_blacklist = [['habitat', 'habitat_1'], ['region', 'region_2']]
+    fake_whitelist = ['habitat', ['habitat_0', 'habitat_1', 'habitat_3']]
+    expected = {}
+    for slave in mesos_tools.filter_mesos_slaves_by_blacklist(fake_slaves, fake_blacklist, fake_whitelist):
+        expected.setdefault(slave['attributes']['region'], []).append(slave['hostname'])
+    index = mesos_tools.SlaveAttributeIndex(fake_slaves)
+    actual = index.grouped_by_attribute('region', blacklist=fake_blacklist, whitelist=fake_whitelist)
+    assert actual == {value: sorted(hosts) for value, hosts in expected.items()}
 
 
 @mock.patch('paasta_tools.mesos_tools.slave_passes_blacklist', autospec=True)
@@ -430,42 +549,144 @@ def test_get_mesos_state_from_leader_raises_on_non_elected_leader():
         assert mesos_tools.get_mesos_state_from_leader() == un_elected_fake_state
 
 
-def test_get_paasta_execute_docker_healthcheck():
+def fake_docker_client(container_infos, events=()):
     mock_docker_client = mock.MagicMock(spec_set=docker.Client)
+    mock_docker_client.containers.return_value = [{'Id': container_id} for container_id in container_infos]
+    mock_docker_client.inspect_container.side_effect = lambda container_id: container_infos[container_id]
+    mock_docker_client.events.return_value = list(events)
+    return mock_docker_client
+
+
+def test_get_paasta_execute_docker_healthcheck():
     fake_container_id = 'fake_container_id'
     fake_mesos_id = 'fake_mesos_id'
-    fake_container_info = [
-        {'Config': {'Env': None}},
-        {'Config': {'Env': ['fake_key1=fake_value1', 'MESOS_TASK_ID=fake_other_mesos_id']}, 'Id': '11111'},
-        {'Config': {'Env': ['fake_key2=fake_value2', 'MESOS_TASK_ID=%s' % fake_mesos_id]}, 'Id': fake_container_id},
-    ]
-    mock_docker_client.containers = mock.MagicMock(
-        spec_set=docker.Client,
-        return_value=['fake_container_1', 'fake_container_2', 'fake_container_3'],
-    )
-    mock_docker_client.inspect_container = mock.MagicMock(
-        spec_set=docker.Client,
-        side_effect=fake_container_info,
-    )
-    assert mesos_tools.get_container_id_for_mesos_id(mock_docker_client, fake_mesos_id) == fake_container_id
+    mock_docker_client = fake_docker_client({
+        'fake_container_1': {'Config': {'Env': None}},
+        '11111': {'Config': {'Env': ['fake_key1=fake_value1', 'MESOS_TASK_ID=fake_other_mesos_id']}},
+        fake_container_id: {'Config': {'Env': ['fake_key2=fake_value2', 'MESOS_TASK_ID=%s' % fake_mesos_id]}},
+    })
+    index = mesos_tools.ContainerIdIndex(path=None)
+    assert mesos_tools.get_container_id_for_mesos_id(mock_docker_client, fake_mesos_id, index) == fake_container_id
 
 
 def test_get_paasta_execute_docker_healthcheck_when_not_found():
-    mock_docker_client = mock.MagicMock(spec_set=docker.Client)
     fake_mesos_id = 'fake_mesos_id'
-    fake_container_info = [
-        {'Config': {'Env': ['fake_key1=fake_value1', 'MESOS_TASK_ID=fake_other_mesos_id']}, 'Id': '11111'},
-        {'Config': {'Env': ['fake_key2=fake_value2', 'MESOS_TASK_ID=fake_other_mesos_id2']}, 'Id': '2222'},
-    ]
-    mock_docker_client.containers = mock.MagicMock(
-        spec_set=docker.Client,
-        return_value=['fake_container_1', 'fake_container_2'],
-    )
-    mock_docker_client.inspect_container = mock.MagicMock(
-        spec_set=docker.Client,
-        side_effect=fake_container_info,
+    mock_docker_client = fake_docker_client({
+        '11111': {'Config': {'Env': ['fake_key1=fake_value1', 'MESOS_TASK_ID=fake_other_mesos_id']}},
+        '2222': {'Config': {'Env': ['fake_key2=fake_value2', 'MESOS_TASK_ID=fake_other_mesos_id2']}},
+    })
+    index = mesos_tools.ContainerIdIndex(path=None)
+    assert mesos_tools.get_container_id_for_mesos_id(mock_docker_client, fake_mesos_id, index) is None
+
+
+@mark.parametrize(('env', 'expected'), [
+    (None, None),
+    (['fake_key=fake_value'], None),
+    (['fake_key=fake_value', 'MESOS_TASK_ID=fake_task_id'], 'fake_task_id'),
+    (['mesos_task_id=fake_chronos_task_id'], 'fake_chronos_task_id'),
+])
+def test_get_mesos_id_from_env(env, expected):
+    assert mesos_tools.get_mesos_id_from_env(env) == expected
+
+
+def test_inspect_containers_skips_containers_that_went_away():
+    def fake_inspect_container(container_id):
+        if container_id == 'gone':
+            raise requests.exceptions.HTTPError('404 Client Error: Not Found')
+        return {'Config': {'Env': None}}
+    mock_docker_client = mock.MagicMock(spec_set=docker.Client)
+    mock_docker_client.inspect_container.side_effect = fake_inspect_container
+    assert mesos_tools.inspect_containers(mock_docker_client, ['alive', 'gone']) == {
+        'alive': {'Config': {'Env': None}},
+    }
+
+
+def test_container_id_index_applies_events(tmpdir):
+    path = str(tmpdir.join('index.json'))
+    with open(path, 'w') as f:
+        json.dump({'containers': {'old': 'old_task', 'dead': 'dead_task'}, 'updated_at': 1000}, f)
+    mock_docker_client = fake_docker_client(
+        {'new': {'Config': {'Env': ['MESOS_TASK_ID=new_task']}}},
+        events=[
+            {'status': 'start', 'id': 'new'},
+            {'status': 'die', 'id': 'dead'},
+            {'status': 'start', 'id': 'short_lived'},
+            {'status': 'destroy', 'id': 'short_lived'},
+        ],
     )
-    assert mesos_tools.get_container_id_for_mesos_id(mock_docker_client, fake_mesos_id) is None
+    index = mesos_tools.ContainerIdIndex(path=path)
+    with mock.patch('paasta_tools.mesos_tools.time.time', autospec=True, return_value=1010):
+        assert index.get_container_id(mock_docker_client, 'new_task') == 'new'
+    mock_docker_client.events.assert_called_once_with(since=1000, until=1010, decode=True)
+    assert not mock_docker_client.containers.called
+    mock_docker_client.inspect_container.assert_called_once_with('new')
+    with open(path) as f:
+        assert json.load(f) == {'containers': {'old': 'old_task', 'new': 'new_task'}, 'updated_at': 1010}
+
+
+def test_container_id_index_rebuilds_when_stale(tmpdir):
+    path = str(tmpdir.join('index.json'))
+    with open(path, 'w') as f:
+        json.dump({'containers': {'old': 'old_task'}, 'updated_at': 1000}, f)
+    mock_docker_client = fake_docker_client({'new': {'Config': {'Env': ['MESOS_TASK_ID=new_task']}}})
+    index = mesos_tools.ContainerIdIndex(path=path, max_age=60)
+    with mock.patch('paasta_tools.mesos_tools.time.time', autospec=True, return_value=2000):
+        assert index.get_container_id(mock_docker_client, 'old_task') is None
+    assert not mock_docker_client.events.called
+    assert index.containers == {'new': 'new_task'}
+
+
+def test_container_id_index_rebuilds_on_miss():
+    mock_docker_client = fake_docker_client({'new': {'Config': {'Env': ['MESOS_TASK_ID=new_task']}}})
+    index = mesos_tools.ContainerIdIndex(path=None)
+    index.containers, index.updated_at = {}, 1000
+    with mock.patch('paasta_tools.mesos_tools.time.time', autospec=True, return_value=1010):
+        assert index.get_container_id(mock_docker_client, 'new_task') == 'new'
+    assert mock_docker_client.events.call_count == 1
+    assert mock_docker_client.containers.call_count == 1
+
+
+def test_container_id_index_rebuilds_when_events_fail():
+    mock_docker_client = fake_docker_client({'new': {'Config': {'Env': ['MESOS_TASK_ID=new_task']}}})
+    mock_docker_client.events.side_effect = requests.exceptions.ConnectionError()
+    index = mesos_tools.ContainerIdIndex(path=None)
+    index.containers, index.updated_at = {'old': 'old_task'}, 1000
+    with mock.patch('paasta_tools.mesos_tools.time.time', autospec=True, return_value=1010):
+        index.refresh(mock_docker_client)
+    assert index.containers == {'new': 'new_task'}
+
+
+def test_container_id_index_find_container_id_builds_lookup_once():
+    class CountingDict(dict):
+        scans = 0
+
+        def iteritems(self):
+            CountingDict.scans += 1
+            return super(CountingDict, self).iteritems()
+
+    index = mesos_tools.ContainerIdIndex(path=None)
+    index.containers = CountingDict({'a': 'task_a', 'b': 'task_b', 'unmanaged': None})
+    assert index.find_container_id('task_a') == 'a'
+    assert index.find_container_id('task_b') == 'b'
+    assert index.find_container_id(None) is None
+    assert index.find_container_id('missing_task') is None
+    assert CountingDict.scans == 1
+
+    mock_docker_client = fake_docker_client({'c': {'Config': {'Env': ['MESOS_TASK_ID=task_c']}}})
+    assert index.get_mesos_task_id(mock_docker_client, 'c') == 'task_c'
+    assert index.find_container_id('task_c') == 'c'
+
+
+def test_get_mesos_id_from_container():
+    mock_docker_client = fake_docker_client({
+        'fake_container': {'Config': {'Env': ['mesos_task_id=fake_task_id']}},
+        'not_mesos': {'Config': {'Env': None}},
+    })
+    index = mesos_tools.ContainerIdIndex(path=None)
+    assert mesos_tools.get_mesos_id_from_container({'Id': 'fake_container'}, mock_docker_client, index) == \
+        'fake_task_id'
+    assert mesos_tools.get_mesos_id_from_container({'Id': 'not_mesos'}, mock_docker_client, index) is None
+    assert mock_docker_client.containers.call_count == 1
 
 
 @mark.parametrize('test_case', [
@@ -511,8 +732,8 @@ def test_zip_tasks_verbose_output(test_case):
 ])
 def test_format_stdstreams_tail_for_task(test_case):
     def gen_mesos_cli_fobj(file_path, file_lines):
-        """mesos.cli.cluster.files (0.1.5),
-        returns a list of mesos.cli.mesos_file.File
+        """mesos.cli.task.Task.file (0.1.5),
+        returns a mesos.cli.mesos_file.File
         `File` is an iterator-like object.
         """
         fake_iter = mock.MagicMock()
@@ -525,20 +746,19 @@ def test_format_stdstreams_tail_for_task(test_case):
     def get_short_task_id(task_id):
         return task_id
 
-    def gen_mock_cluster_files(file1, file2, raise_what):
-        def retfunc(*args, **kwargs):
+    def gen_fake_task(task_id, file1, file2, raise_what):
+        def retfunc(path):
             # If we're asked to raise a particular exception we do so.
             # .message is set to the exception class name.
             if raise_what:
                 exception_class = getattr(mesos_tools, raise_what)
                 raise exception_class(exception_class.__name__)
-            return [
-                gen_mesos_cli_fobj(file1[0], file1[1]),
-                gen_mesos_cli_fobj(file2[0], file2[1])
-            ]
-        mock_cluster_files = mock.MagicMock()
-        mock_cluster_files.side_effect = retfunc
-        return mock_cluster_files
+            return gen_mesos_cli_fobj(path, dict([file1, file2])[path])
+        fake_task = mock.MagicMock()
+        fake_task.__getitem__.side_effect = {'id': task_id}.__getitem__
+        fake_task.file.side_effect = retfunc
+        fake_task.file_list.return_value = [{'path': '/fake/sandbox/%s' % name} for name in ('stderr', 'stdout')]
+        return fake_task
 
     def gen_output(task_id, file1, file2, nlines, raise_what):
         error_message = PaastaColors.red("      couldn't read stdout/stderr for %s (%s)")
@@ -559,9 +779,367 @@ def test_format_stdstreams_tail_for_task(test_case):
 
     task_id, file1, file2, nlines, raise_what = test_case
 
-    mock_cluster_files = gen_mock_cluster_files(file1, file2, raise_what)
-    fake_task = {'id': task_id}
+    fake_task = gen_fake_task(task_id, file1, file2, raise_what)
     expected = gen_output(task_id, file1, file2, nlines, raise_what)
-    with mock.patch('paasta_tools.mesos_tools.mesos.cli.cluster.files', mock_cluster_files):
-        result = mesos_tools.format_stdstreams_tail_for_task(fake_task, get_short_task_id)
-        assert result == expected
+    result = mesos_tools.format_stdstreams_tail_for_task(fake_task, get_short_task_id)
+    assert result == expected
+
+
+def test_format_stdstreams_tail_for_task_without_files():
+    fake_task = mock.MagicMock()
+    fake_task.__getitem__.side_effect = {'id': 'a_task'}.__getitem__
+    fake_task.file_list.return_value = [{'path': '/fake/sandbox/other'}]
+    result = mesos_tools.format_stdstreams_tail_for_task(fake_task, lambda task_id: task_id)
+    assert result == [PaastaColors.blue("      no stdout/stderrr for a_task")]
+    assert fake_task.file.call_count == 0
+
+
+def test_format_stdstreams_tail_for_task_stops_at_deadline():
+    fake_task = mock.MagicMock()
+    fake_task.__getitem__.side_effect = {'id': 'a_task'}.__getitem__
+    fake_task.file_list.return_value = [{'path': '/fake/sandbox/stdout'}]
+    fake_task.file.return_value.path = 'stdout'
+    fake_task.file.return_value.__reversed__ = mock.Mock(return_value=iter(['line']))
+    with Timeout(0):
+        result = mesos_tools.format_stdstreams_tail_for_task(fake_task, lambda task_id: task_id)
+    assert result == [
+        PaastaColors.blue("      stdout tail for a_task"),
+        PaastaColors.red("      couldn't read stdout/stderr for a_task (timeout)"),
+    ]
+
+
+def gen_fake_mesos_task(task_id, slave_id, state='TASK_RUNNING'):
+    fake_task = mock.MagicMock()
+    fake_task.__getitem__.side_effect = {
+        'id': task_id,
+        'slave_id': slave_id,
+        'state': state,
+        'statuses': [{'timestamp': 1457109986}],
+    }.__getitem__
+    fake_task.slave = {'hostname': '%s.fake.domain' % slave_id}
+    return fake_task
+
+
+FAKE_SLAVE_STATE = {
+    'frameworks': [{
+        'executors': [{
+            'id': 'executor1',
+            'directory': '/fake/sandbox/1',
+            'tasks': [{'id': 'task1'}],
+        }],
+        'completed_executors': [{
+            'id': 'executor2',
+            'directory': '/fake/sandbox/2',
+            'completed_tasks': [{'id': 'task2'}],
+        }],
+    }],
+    'completed_frameworks': [],
+}
+
+FAKE_SLAVE_STATS = [{
+    'executor_id': 'executor1',
+    'statistics': {'mem_limit_bytes': 1024 * 1024 * 100, 'mem_rss_bytes': 1024 * 1024 * 10},
+}]
+
+
+def test_fetch_slave_task_data():
+    fake_slave = mock.Mock(state=FAKE_SLAVE_STATE, stats=FAKE_SLAVE_STATS)
+    assert mesos_tools.fetch_slave_task_data(fake_slave) == {
+        'task1': (FAKE_SLAVE_STATE['frameworks'][0]['executors'][0], FAKE_SLAVE_STATS[0]['statistics'], None),
+        'task2': (FAKE_SLAVE_STATE['frameworks'][0]['completed_executors'][0], {}, None),
+    }
+    assert fake_slave.file_list.call_count == 0
+
+
+def test_fetch_slave_task_data_lists_sandboxes():
+    fake_slave = mock.Mock(state=FAKE_SLAVE_STATE, stats=FAKE_SLAVE_STATS)
+    fake_slave.file_list.return_value = [{'path': '/fake/sandbox/1/stdout'}]
+    slave_task_data = mesos_tools.fetch_slave_task_data(fake_slave, ['task1', 'task3'])
+    fake_slave.file_list.assert_called_once_with('/fake/sandbox/1')
+    assert slave_task_data['task1'][2] == [{'path': '/fake/sandbox/1/stdout'}]
+    assert slave_task_data['task2'][2] is None
+
+
+def test_prefetched_task():
+    fake_slave = mock.Mock(state=FAKE_SLAVE_STATE, stats=FAKE_SLAVE_STATS)
+    future = mesos_tools.futures.Future()
+    future.set_result(mesos_tools.fetch_slave_task_data(fake_slave))
+    task = mesos_tools.PrefetchedTask(gen_fake_mesos_task('task1', 'slave1'), fake_slave, future)
+    assert task['id'] == 'task1'
+    assert task.slave is fake_slave
+    assert task.directory == '/fake/sandbox/1'
+    assert mesos_tools.get_mem_usage(task) == '10/100MB'
+    assert task.file('stdout').key().endswith('/fake/sandbox/1/stdout')
+    fake_slave.file_list.return_value = []
+    assert task.file_list('') == []
+    fake_slave.file_list.assert_called_once_with('/fake/sandbox/1/')
+
+    missing_task = mesos_tools.PrefetchedTask(gen_fake_mesos_task('task3', 'slave1'), fake_slave, future)
+    assert missing_task.stats == {}
+    assert missing_task.directory == ''
+
+
+def test_prefetched_task_uses_sandbox_listing():
+    fake_slave = mock.Mock(state=FAKE_SLAVE_STATE, stats=FAKE_SLAVE_STATS)
+    fake_slave.file_list.return_value = [{'path': '/fake/sandbox/1/stdout'}]
+    future = mesos_tools.futures.Future()
+    future.set_result(mesos_tools.fetch_slave_task_data(fake_slave, ['task1']))
+    task = mesos_tools.PrefetchedTask(gen_fake_mesos_task('task1', 'slave1'), fake_slave, future)
+    assert task.file_list('') == [{'path': '/fake/sandbox/1/stdout'}]
+    assert task.file_list('') == [{'path': '/fake/sandbox/1/stdout'}]
+    assert fake_slave.file_list.call_count == 1
+
+
+def test_prefetched_task_deadline():
+    task = mesos_tools.PrefetchedTask(gen_fake_mesos_task('task1', 'slave1'), mock.Mock(),
+                                      mesos_tools.futures.Future(), deadline=Timeout(0))
+    with raises(mesos_tools.TimeoutError):
+        task.stats
+    assert mesos_tools.get_mem_usage(task) == 'Timed Out'
+    assert mesos_tools.get_cpu_usage(task) == 'Timed Out'
+
+
+def test_prefetched_task_missing_slave():
+    task = mesos_tools.PrefetchedTask(gen_fake_mesos_task('task1', 'slave1'), None, None)
+    with raises(mesos.cli.exceptions.SlaveDoesNotExist):
+        task.slave
+    assert mesos_tools.get_mem_usage(task) == 'None'
+    assert mesos_tools.get_short_hostname_from_task(task) == 'Unknown'
+
+
+def test_prefetch_tasks_fetches_once_per_slave():
+    tasks = [
+        gen_fake_mesos_task('task1', 'slave1'),
+        gen_fake_mesos_task('task2', 'slave1'),
+        gen_fake_mesos_task('task3', 'slave2'),
+    ]
+    type(tasks[2]).slave = mock.PropertyMock(side_effect=mesos.cli.exceptions.SlaveDoesNotExist)
+    fake_executor = mock.Mock()
+    deadline = Timeout(10)
+    prefetched = mesos_tools.prefetch_tasks(tasks, fake_executor, deadline)
+    fake_executor.submit.assert_called_once_with(deadline.run, mesos_tools.fetch_slave_task_data, tasks[0].slave, ())
+    assert [task.task for task in prefetched] == tasks
+    assert prefetched[0]._slave_task_data is prefetched[1]._slave_task_data
+    assert prefetched[2]._slave_task_data is None
+
+    fake_executor.reset_mock()
+    mesos_tools.prefetch_tasks(tasks, fake_executor, deadline, list_sandboxes=True)
+    fake_executor.submit.assert_called_once_with(
+        deadline.run, mesos_tools.fetch_slave_task_data, tasks[0].slave, ['task1', 'task2'])
+
+
+def test_prefetch_tasks_gives_up_on_slow_slaves():
+    release = threading.Event()
+
+    def fetch_slave_task_data(slave, sandbox_task_ids):
+        release.wait(10)
+        return {}
+
+    task = gen_fake_mesos_task('task1', 'slave1')
+    with contextlib.nested(
+        mock.patch('paasta_tools.mesos_tools.fetch_slave_task_data', fetch_slave_task_data),
+        mesos_tools.futures.ThreadPoolExecutor(max_workers=1),
+    ) as (_, executor):
+        prefetched, = mesos_tools.prefetch_tasks([task], executor, Timeout(0.1))
+        assert mesos_tools.get_mem_usage(prefetched) == 'Timed Out'
+        # the worker is freed at the deadline, so leaving the executor doesn't wait for the slave
+        start = time.time()
+    assert time.time() - start < 5
+    release.set()
+
+
+def test_format_task_list_partial_stdstreams_on_timeout():
+    tasks = [gen_fake_mesos_task('task1', 'slave1'), gen_fake_mesos_task('task2', 'slave1')]
+    fake_executor = mock.Mock()
+    done = mesos_tools.futures.Future()
+    done.set_result(['tail'])
+    fake_executor.submit.side_effect = [done, mesos_tools.futures.Future()]
+    output = mesos_tools.format_task_list(
+        tasks, 'Running Tasks:', ['Mesos Task ID'], lambda task_id: task_id,
+        lambda task, get_short_task_id: [task['id']], False, True, fake_executor, deadline=Timeout(0),
+    )
+    assert output == [
+        '  Running Tasks:',
+        '    Mesos Task ID',
+        '    task1',
+        'tail',
+        '    task2',
+        PaastaColors.red("      couldn't read stdout/stderr for task2 (timeout)"),
+    ]
+
+
+def test_mesos_state_snapshot_round_trip(tmpdir):
+    path = str(tmpdir.join('mesos_state.json.gz'))
+    fake_state = {'elected_time': 1.0, 'slaves': [{'hostname': 'fake_host'}]}
+    mesos_tools.write_mesos_state_snapshot(path, fake_state, 1000)
+    assert mesos_tools.read_mesos_state_snapshot(path) == (fake_state, 1000)
+
+
+def test_read_mesos_state_snapshot_missing(tmpdir):
+    path = str(tmpdir.join('mesos_state.json.gz'))
+    assert mesos_tools.read_mesos_state_snapshot(path) == (None, None)
+    tmpdir.join('mesos_state.json.gz').write('garbage')
+    assert mesos_tools.read_mesos_state_snapshot(path) == (None, None)
+
+
+def test_mesos_state_cache_without_ttl_always_fetches():
+    cache = mesos_tools.MesosStateCache()
+    mock_fetch = mock.Mock(side_effect=[{'a': 1}, {'a': 2}])
+    assert cache.get(mock_fetch) == {'a': 1}
+    assert cache.get(mock_fetch) == {'a': 2}
+
+
+def test_mesos_state_cache_reuses_state_within_ttl():
+    cache = mesos_tools.MesosStateCache(ttl=10)
+    mock_fetch = mock.Mock(side_effect=[{'a': 1}, {'a': 2}])
+    with mock.patch('paasta_tools.mesos_tools.time.time', autospec=True, side_effect=[100, 105, 111]):
+        assert cache.get(mock_fetch) == {'a': 1}
+        assert cache.get(mock_fetch) == {'a': 1}
+        assert cache.get(mock_fetch) == {'a': 2}
+    assert mock_fetch.call_count == 2
+
+
+def test_mesos_state_cache_shares_snapshot_between_caches(tmpdir):
+    path = str(tmpdir.join('mesos_state.json.gz'))
+    first_cache = mesos_tools.MesosStateCache(ttl=60, snapshot_path=path)
+    second_cache = mesos_tools.MesosStateCache(ttl=60, snapshot_path=path)
+    mock_fetch = mock.Mock(return_value={'elected_time': 1.0})
+    assert first_cache.get(mock_fetch) == {'elected_time': 1.0}
+    assert second_cache.get(mock_fetch) == {'elected_time': 1.0}
+    assert mock_fetch.call_count == 1
+
+
+def test_mesos_state_cache_refreshes_stale_snapshot(tmpdir):
+    path = str(tmpdir.join('mesos_state.json.gz'))
+    mesos_tools.write_mesos_state_snapshot(path, {'elected_time': 1.0}, 1000)
+    cache = mesos_tools.MesosStateCache(ttl=60, snapshot_path=path)
+    mock_fetch = mock.Mock(return_value={'elected_time': 2.0})
+    assert cache.get(mock_fetch) == {'elected_time': 2.0}
+    assert mesos_tools.read_mesos_state_snapshot(path)[0] == {'elected_time': 2.0}
+
+
+FAKE_MESOS_STATE = {
+    'elected_time': 1450000000.0,
+    'flags': {'quorum': '2', 'zk': 'zk://fake_host:2181/mesos', 'work_dir': '/var/lib/mesos'},
+    'slaves': [
+        {
+            'id': 'slave1',
+            'hostname': 'host1',
+            'attributes': {'region': 'fake_region', 'rack': 12},
+            'resources': {'cpus': 8, 'mem': 1024.5, 'disk': 2048, 'ports': '[31000-32000]'},
+            'used_resources': {'cpus': 100, 'mem': 100, 'disk': 100},
+        },
+        {
+            'id': 'slave2',
+            'hostname': 'host2',
+            'attributes': {},
+            'resources': {'cpus': 4.5, 'mem': 512, 'disk': 1024},
+        },
+    ],
+    'frameworks': [
+        {
+            'name': 'marathon',
+            'tasks': [
+                {
+                    'id': 'fake_service.main.1',
+                    'state': 'TASK_RUNNING',
+                    'slave_id': 'slave1',
+                    'resources': {'cpus': 1.1, 'mem': 100, 'disk': 10, 'ports': '[31001-31001]'},
+                    'statuses': [{'state': 'TASK_STAGING', 'timestamp': 1.0}],
+                    'discovery': {'name': 'fake_service', 'id': 'not_the_task_id'},
+                },
+            ],
+            'completed_tasks': [
+                {'id': 'fake_service.main.0', 'state': 'TASK_KILLED', 'slave_id': 'slave2', 'resources': {}},
+            ],
+        },
+    ],
+}
+
+EXPECTED_COMPACT_MESOS_STATE = {
+    'elected_time': 1450000000.0,
+    'flags': {'quorum': '2', 'zk': 'zk://fake_host:2181/mesos'},
+    'slaves': [
+        {
+            'id': 'slave1',
+            'hostname': 'host1',
+            'attributes': {'region': 'fake_region', 'rack': 12},
+            'resources': {'cpus': 8.0, 'mem': 1024.5, 'disk': 2048.0},
+        },
+        {
+            'id': 'slave2',
+            'hostname': 'host2',
+            'attributes': {},
+            'resources': {'cpus': 4.5, 'mem': 512.0, 'disk': 1024.0},
+        },
+    ],
+    'frameworks': [
+        {
+            'name': 'marathon',
+            'tasks': [
+                {
+                    'id': 'fake_service.main.1',
+                    'state': 'TASK_RUNNING',
+                    'slave_id': 'slave1',
+                    'resources': {'cpus': 1.1, 'mem': 100.0, 'disk': 10.0},
+                },
+            ],
+        },
+    ],
+}
+
+
+def test_compact_mesos_state():
+    assert mesos_tools.compact_mesos_state(FAKE_MESOS_STATE) == EXPECTED_COMPACT_MESOS_STATE
+
+
+@mark.skipif(mesos_tools.ijson is None, reason='ijson not available')
+def test_parse_compact_mesos_state_streaming():
+    fileobj = io.BytesIO(json.dumps(FAKE_MESOS_STATE))
+    assert mesos_tools.parse_compact_mesos_state(fileobj) == EXPECTED_COMPACT_MESOS_STATE
+
+
+def test_parse_compact_mesos_state_without_ijson():
+    fileobj = io.BytesIO(json.dumps(FAKE_MESOS_STATE))
+    with mock.patch('paasta_tools.mesos_tools.ijson', None):
+        assert mesos_tools.parse_compact_mesos_state(fileobj) == EXPECTED_COMPACT_MESOS_STATE
+
+
+def test_fetch_compact_mesos_state_from_leader():
+    mock_response = mock.Mock(raw=io.BytesIO(json.dumps(FAKE_MESOS_STATE)))
+    with mock.patch.object(mesos.cli.master.CURRENT, 'fetch', autospec=True,
+                           return_value=mock_response) as mock_fetch:
+        assert mesos_tools.fetch_compact_mesos_state_from_leader() == EXPECTED_COMPACT_MESOS_STATE
+        mock_fetch.assert_called_once_with('/master/state.json', stream=True)
+
+
+def test_fetch_compact_mesos_state_from_leader_raises_on_non_elected_leader():
+    un_elected_fake_state = dict(FAKE_MESOS_STATE)
+    del un_elected_fake_state['elected_time']
+    mock_response = mock.Mock(raw=io.BytesIO(json.dumps(un_elected_fake_state)))
+    with mock.patch.object(mesos.cli.master.CURRENT, 'fetch', autospec=True, return_value=mock_response):
+        with raises(mesos_tools.MasterNotAvailableException):
+            mesos_tools.fetch_compact_mesos_state_from_leader()
+
+
+def test_get_compact_mesos_state_from_leader_uses_its_own_cache(tmpdir):
+    fake_config = mock.Mock(
+        get_mesos_state_cache_ttl=mock.Mock(return_value=30),
+        get_mesos_state_snapshot_path=mock.Mock(return_value=str(tmpdir.join('state.json.gz'))),
+    )
+    with contextlib.nested(
+        mock.patch('paasta_tools.mesos_tools.load_system_paasta_config', autospec=True, return_value=fake_config),
+        mock.patch('paasta_tools.mesos_tools._compact_mesos_state_cache', None),
+        mock.patch('paasta_tools.mesos_tools.fetch_compact_mesos_state_from_leader', autospec=True,
+                   return_value=EXPECTED_COMPACT_MESOS_STATE),
+    ) as (
+        _,
+        _,
+        mock_fetch,
+    ):
+        assert mesos_tools.get_compact_mesos_state_from_leader() == EXPECTED_COMPACT_MESOS_STATE
+        assert mesos_tools.get_compact_mesos_state_from_leader() == EXPECTED_COMPACT_MESOS_STATE
+        assert mesos_tools.get_compact_mesos_state_cache().snapshot_path == str(tmpdir.join('state.json.gz.compact'))
+    assert mock_fetch.call_count == 1
+    assert tmpdir.join('state.json.gz.compact').check()
+    assert not tmpdir.join('state.json.gz').check()
@@ -12,13 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import contextlib
+import time
 
 import docker
 import mock
 import pytest
 
+from paasta_tools.paasta_execute_docker_command import ExecIdCache
 from paasta_tools.paasta_execute_docker_command import execute_in_container
 from paasta_tools.paasta_execute_docker_command import main
+from paasta_tools.paasta_execute_docker_command import time_limit
 from paasta_tools.paasta_execute_docker_command import TimeoutException
 
 
@@ -92,6 +95,68 @@ def test_execute_in_container_reuses_only_valid_exec():
     mock_docker_client.exec_start.assert_called_once_with(fake_execid, stream=False)
 
 
+def test_execute_in_container_uses_cached_exec(tmpdir):
+    exec_id_cache = ExecIdCache(path=str(tmpdir.join('exec_ids.json')))
+    exec_id_cache.update('fake_container_id', 'fake_cmd', 'fake_execid')
+    mock_docker_client = mock.MagicMock(spec_set=docker.Client)
+    mock_docker_client.exec_start.return_value = 'fake_output'
+    mock_docker_client.exec_inspect.return_value = {'ExitCode': 0}
+
+    assert execute_in_container(mock_docker_client, 'fake_container_id', 'fake_cmd', 1, exec_id_cache) == (
+        'fake_output', 0)
+    assert mock_docker_client.inspect_container.call_count == 0
+    assert mock_docker_client.exec_create.call_count == 0
+    mock_docker_client.exec_start.assert_called_once_with('fake_execid', stream=False)
+
+
+def test_execute_in_container_replaces_dead_cached_exec(tmpdir):
+    exec_id_cache = ExecIdCache(path=str(tmpdir.join('exec_ids.json')))
+    exec_id_cache.update('fake_container_id', 'fake_cmd', 'dead_execid')
+    mock_docker_client = mock.MagicMock(spec_set=docker.Client)
+    mock_docker_client.inspect_container.return_value = {'ExecIDs': None}
+    mock_docker_client.exec_create.return_value = {'Id': 'new_execid'}
+    mock_docker_client.exec_start.side_effect = [docker.errors.APIError('404', mock.Mock()), 'fake_output']
+    mock_docker_client.exec_inspect.return_value = {'ExitCode': 0}
+
+    assert execute_in_container(mock_docker_client, 'fake_container_id', 'fake_cmd', 1, exec_id_cache) == (
+        'fake_output', 0)
+    mock_docker_client.exec_start.assert_called_with('new_execid', stream=False)
+    assert exec_id_cache.get('fake_container_id', 'fake_cmd') == 'new_execid'
+
+
+def test_execute_in_container_creates_exec_when_none_match():
+    mock_docker_client = mock.MagicMock(spec_set=docker.Client)
+    mock_docker_client.inspect_container.return_value = {'ExecIDs': ['fake_other_exec']}
+    mock_docker_client.exec_create.return_value = {'Id': 'new_execid'}
+    mock_docker_client.exec_inspect.return_value = {
+        'ExitCode': 0,
+        'ProcessConfig': {'entrypoint': '/bin/sh', 'arguments': ['-c', 'some_other_command']},
+    }
+
+    execute_in_container(mock_docker_client, 'fake_container_id', 'fake_cmd', 1)
+    mock_docker_client.exec_start.assert_called_once_with('new_execid', stream=False)
+
+
+def test_exec_id_cache_prunes_old_entries(tmpdir):
+    exec_id_cache = ExecIdCache(path=str(tmpdir.join('exec_ids.json')), max_age=60)
+    with mock.patch('paasta_tools.paasta_execute_docker_command.time.time', autospec=True, return_value=1000):
+        exec_id_cache.update('old_container_id', 'fake_cmd', 'old_execid')
+    with mock.patch('paasta_tools.paasta_execute_docker_command.time.time', autospec=True, return_value=1100):
+        assert exec_id_cache.get('old_container_id', 'fake_cmd') is None
+        exec_id_cache.update('fake_container_id', 'fake_cmd', 'fake_execid')
+    assert exec_id_cache.load().keys() == ['fake_container_id']
+
+
+def test_exec_id_cache_unwritable_path():
+    exec_id_cache = ExecIdCache(path='/nonexistent/exec_ids.json')
+    exec_id_cache.update('fake_container_id', 'fake_cmd', 'fake_execid')
+    assert exec_id_cache.get('fake_container_id', 'fake_cmd') is None
+
+
+def call_through(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
 def test_main():
     fake_container_id = 'fake_container_id'
     fake_timeout = 3
@@ -110,6 +175,7 @@ def test_main():
     ):
         args_patch.return_value.mesos_id = 'fake_task_id'
         args_patch.return_value.timeout = fake_timeout
+        time_limit_patch.return_value.__enter__.return_value.run.side_effect = call_through
         with pytest.raises(SystemExit) as excinfo:
             main()
         time_limit_patch.assert_called_once_with(fake_timeout)
@@ -175,6 +241,7 @@ def test_main_cmd_unclean_exit_failure():
         time_limit_patch,
     ):
         args_patch.return_value.mesos_id = 'fake_task_id'
+        time_limit_patch.return_value.__enter__.return_value.run.side_effect = call_through
         with pytest.raises(SystemExit) as excinfo:
             main()
         assert excinfo.value.code == 2
@@ -202,3 +269,11 @@ def test_main_timeout_failure():
             main()
         time_limit_patch.assert_called_once_with(fake_timeout)
         assert excinfo.value.code == 1
+
+
+def test_time_limit():
+    with time_limit(10) as deadline:
+        assert deadline.run(lambda: 'fake_output') == 'fake_output'
+    with pytest.raises(TimeoutException):
+        with time_limit(0) as deadline:
+            deadline.run(time.sleep, 1)
@@ -12,10 +12,13 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import argparse
 import contextlib
+import json
 
 from mock import Mock
 from mock import patch
+from pytest import mark
 from pytest import raises
 
 from paasta_tools import paasta_metastatus
@@ -184,41 +187,26 @@ def test_duplicate_frameworks():
     assert not ok
 
 
-@patch('paasta_tools.marathon_tools.get_marathon_client')
-def test_ok_marathon_apps(mock_get_marathon_client):
-    client = mock_get_marathon_client.return_value
-    client.list_apps.return_value = [
-        "MarathonApp::1",
-        "MarathonApp::2"
-    ]
-    output, ok = paasta_metastatus.assert_marathon_apps(client)
+def test_ok_marathon_apps():
+    output, ok = paasta_metastatus.assert_marathon_apps({'apps': ["MarathonApp::1", "MarathonApp::2"]})
     assert "marathon apps: 2" in output
     assert ok
 
 
-@patch('paasta_tools.marathon_tools.get_marathon_client')
-def test_no_marathon_apps(mock_get_marathon_client):
-    client = mock_get_marathon_client.return_value
-    client.list_apps.return_value = []
-    output, ok = paasta_metastatus.assert_marathon_apps(client)
+def test_no_marathon_apps():
+    output, ok = paasta_metastatus.assert_marathon_apps({'apps': []})
     assert PaastaColors.red("CRITICAL: No marathon apps running") in output
     assert not ok
 
 
-@patch('paasta_tools.marathon_tools.get_marathon_client')
-def test_marathon_tasks(mock_get_marathon_client):
-    client = mock_get_marathon_client.return_value
-    client.list_tasks.return_value = ["MarathonTask:1"]
-    output, ok = paasta_metastatus.assert_marathon_tasks(client)
+def test_marathon_tasks():
+    output, ok = paasta_metastatus.assert_marathon_tasks({'tasks': ["MarathonTask:1"]})
     assert "marathon tasks: 1" in output
     assert ok
 
 
-@patch('paasta_tools.marathon_tools.get_marathon_client')
-def test_assert_marathon_deployments(mock_get_marathon_client):
-    client = mock_get_marathon_client.return_value
-    client.list_deployments.return_value = ["MarathonDeployment:1"]
-    output, ok = paasta_metastatus.assert_marathon_deployments(client)
+def test_assert_marathon_deployments():
+    output, ok = paasta_metastatus.assert_marathon_deployments({'deployments': ["MarathonDeployment:1"]})
     assert "marathon deployments: 1" in output
     assert ok
 
@@ -377,12 +365,10 @@ def test_get_marathon_client():
 
 
 def test_assert_chronos_scheduled_jobs():
-    mock_client = Mock()
-    mock_client.list.return_value = [
+    results = paasta_metastatus.assert_chronos_scheduled_jobs([
         {'name': 'myjob', 'disabled': False},
         {'name': 'myjob', 'disabled': True},
-    ]
-    results = paasta_metastatus.assert_chronos_scheduled_jobs(mock_client)
+    ])
     assert results == ('Enabled chronos jobs: 1', True)
 
 
@@ -402,7 +388,7 @@ def test_main_no_marathon_config():
     with contextlib.nested(
         patch('paasta_tools.marathon_tools.load_marathon_config', autospec=True),
         patch('paasta_tools.chronos_tools.load_chronos_config', autospec=True),
-        patch('paasta_tools.paasta_metastatus.get_mesos_state_from_leader', autospec=True),
+        patch('paasta_tools.paasta_metastatus.get_compact_mesos_state_from_leader', autospec=True),
         patch('paasta_tools.paasta_metastatus.get_mesos_status', autospec=True,
               return_value=([('fake_output', True)])),
         patch('paasta_tools.paasta_metastatus.get_marathon_status', autospec=True,
@@ -411,13 +397,16 @@ def test_main_no_marathon_config():
     ) as (
         load_marathon_config_patch,
         load_chronos_config_patch,
-        load_get_mesos_state_from_leader_patch,
+        load_get_compact_mesos_state_from_leader_patch,
         load_get_mesos_status_patch,
         load_get_marathon_status_patch,
         parse_args_patch,
     ):
         fake_args = Mock(
             verbose=0,
+            json=False,
+            exporter=False,
+            fit=None,
         )
         parse_args_patch.return_value = fake_args
         load_marathon_config_patch.side_effect = MarathonNotConfigured
@@ -430,7 +419,7 @@ def test_main_no_chronos_config():
     with contextlib.nested(
         patch('paasta_tools.marathon_tools.load_marathon_config', autospec=True),
         patch('paasta_tools.chronos_tools.load_chronos_config', autospec=True),
-        patch('paasta_tools.paasta_metastatus.get_mesos_state_from_leader', autospec=True),
+        patch('paasta_tools.paasta_metastatus.get_compact_mesos_state_from_leader', autospec=True),
         patch('paasta_tools.paasta_metastatus.get_mesos_status', autospec=True,
               return_value=([('fake_output', True)])),
         patch('paasta_tools.paasta_metastatus.get_marathon_status', autospec=True,
@@ -439,7 +428,7 @@ def test_main_no_chronos_config():
     ) as (
         load_marathon_config_patch,
         load_chronos_config_patch,
-        load_get_mesos_state_from_leader_patch,
+        load_get_compact_mesos_state_from_leader_patch,
         load_get_mesos_status_patch,
         load_get_marathon_status_patch,
         parse_args_patch,
@@ -447,6 +436,9 @@ def test_main_no_chronos_config():
 
         fake_args = Mock(
             verbose=0,
+            json=False,
+            exporter=False,
+            fit=None,
         )
         parse_args_patch.return_value = fake_args
         load_chronos_config_patch.side_effect = ChronosNotConfigured
@@ -552,20 +544,6 @@ def test_critical_events_in_outputs():
             [('myservice_false', False)])
 
 
-def test_filter_mesos_state_metrics():
-    test_resource_dictionary = {
-        'cpus': 0,
-        'mem': 1,
-        'MEM': 2,
-        'garbage_data': 3,
-    }
-    expected = {
-        'cpus': 0,
-        'mem': 1,
-    }
-    assert paasta_metastatus.filter_mesos_state_metrics(test_resource_dictionary) == expected
-
-
 def test_get_mesos_slave_data():
     mesos_state = {
         'slaves': [
@@ -702,6 +680,55 @@ def test_get_mesos_habitat_data():
     assert (tuple(extra_mesos_habitat_data) == expected_free_resources)
 
 
+def test_get_extra_mesos_data_matches_with_and_without_numpy():
+    mesos_state = {
+        'slaves': [
+            {
+                'id': 'slave%d' % i,
+                'hostname': 'host%d' % i,
+                'resources': {'cpus': 10 + i, 'mem': 1000.5, 'disk': 300},
+                'attributes': {'region': 'region%d' % (i % 2), 'habitat': 'habitat%d' % (i % 3)},
+            } for i in xrange(6)
+        ],
+        'frameworks': [
+            {'tasks': [
+                {'slave_id': 'slave%d' % (i % 6), 'resources': {'cpus': 0.1 * i, 'mem': 10, 'disk': 1, 'ports': 'x'}}
+                for i in xrange(20)
+            ]},
+        ],
+    }
+    with patch('paasta_tools.paasta_metastatus.numpy', None):
+        expected_slave_data = paasta_metastatus.get_extra_mesos_slave_data(mesos_state)
+        expected_attribute_data = sorted(paasta_metastatus.get_extra_mesos_attribute_data(mesos_state))
+    with patch('paasta_tools.paasta_metastatus._slave_resource_vectors', (None, None)):
+        assert paasta_metastatus.get_extra_mesos_slave_data(mesos_state) == expected_slave_data
+        assert sorted(paasta_metastatus.get_extra_mesos_attribute_data(mesos_state)) == expected_attribute_data
+    assert len(expected_slave_data) == 6
+    assert [attribute for attribute, _ in expected_attribute_data] == ['habitat', 'region']
+
+
+def test_get_extra_mesos_slave_data_resource_only_used_by_tasks():
+    mesos_state = {
+        'slaves': [
+            {'id': 'test-slave', 'hostname': 'test.somewhere.www', 'resources': {'cpus': 10, 'mem': 100}},
+        ],
+        'frameworks': [
+            {'tasks': [{'slave_id': 'test-slave', 'resources': {'cpus': 1, 'disk': 5}}]},
+        ],
+    }
+    for numpy_module in [None, paasta_metastatus.numpy]:
+        with contextlib.nested(
+            patch('paasta_tools.paasta_metastatus.numpy', numpy_module),
+            patch('paasta_tools.paasta_metastatus._slave_resource_vectors', (None, None)),
+        ):
+            slave_data = paasta_metastatus.get_extra_mesos_slave_data(mesos_state)
+        assert slave_data == [{
+            'hostname': 'test.somewhere.www',
+            'total_resources': {'cpus': 10, 'mem': 100},
+            'free_resources': {'cpus': 9, 'mem': 100, 'disk': -5},
+        }]
+
+
 def test_get_mesos_habitat_data_humanized():
     mesos_state = {
         'slaves': [
@@ -823,3 +850,306 @@ def test_get_mesos_habitat_data_nonhumanized():
 
     assert extra_slave_data[0] == expected_slave_output
     assert extra_attribute_data[0] == expected_attribute_output
+
+
+def get_fake_metastatus_data():
+    return {
+        'ok': True,
+        'mesos': {
+            'ok': True,
+            'checks': [],
+            'masters': 3,
+            'quorum': 2,
+            'frameworks': {'marathon': 1},
+            'tasks': {'running': 3, 'staging': 0, 'starting': 0},
+            'slaves': {'active': 1, 'inactive': 0},
+            'cpus': {'total': 10, 'used': 1},
+            'mem': {'total': 100, 'used': 10},
+            'disk': {'total': 1000, 'used': 100},
+        },
+        'slaves': [{
+            'hostname': 'host"1',
+            'free': {'cpus': 9, 'mem': 90, 'disk': 900},
+            'total': {'cpus': 10, 'mem': 100, 'disk': 1000},
+        }],
+        'attributes': {
+            'region': {'a_region': {
+                'free': {'cpus': 9, 'mem': 90, 'disk': 900},
+                'total': {'cpus': 10, 'mem': 100, 'disk': 1000},
+            }},
+        },
+        'marathon': {'configured': True, 'ok': True, 'checks': [], 'apps': 2, 'tasks': 3, 'deployments': 0},
+        'chronos': {'configured': False, 'ok': True, 'checks': []},
+    }
+
+
+def test_get_metastatus_data():
+    mesos_state = {
+        'flags': {'zk': 'zk://1.1.1.1:2222/fake_cluster', 'quorum': 2},
+        'frameworks': [{'name': 'marathon'}],
+        'slaves': [{
+            'hostname': 'host1',
+            'id': 'slave1',
+            'resources': {'cpus': 10, 'mem': 100, 'disk': 1000},
+            'attributes': {'region': 'a_region'},
+        }],
+        'frameworks_tasks': [],
+    }
+    mesos_state['frameworks'][0]['tasks'] = [{
+        'slave_id': 'slave1', 'state': 'TASK_RUNNING', 'resources': {'cpus': 1, 'mem': 10, 'disk': 100},
+    }]
+    metrics = {
+        'master/cpus_total': 10, 'master/cpus_used': 1,
+        'master/mem_total': 100, 'master/mem_used': 10,
+        'master/disk_total': 1000, 'master/disk_used': 100,
+        'master/tasks_running': 1, 'master/tasks_staging': 0, 'master/tasks_starting': 0,
+        'master/slaves_active': 1, 'master/slaves_inactive': 0,
+    }
+    marathon_client = Mock()
+    marathon_client.list_apps.return_value = ['app']
+    marathon_client.list_tasks.return_value = ['task1', 'task2']
+    marathon_client.list_deployments.return_value = []
+    with contextlib.nested(
+        patch('paasta_tools.paasta_metastatus.get_mesos_stats', autospec=True, return_value=metrics),
+        patch('paasta_tools.paasta_metastatus.get_num_masters', autospec=True, return_value=3),
+    ) as (
+        mock_get_mesos_stats,
+        _,
+    ):
+        data = paasta_metastatus.get_metastatus_data(mesos_state, marathon_client, None)
+    assert mock_get_mesos_stats.call_count == 1
+    assert data['ok'] is True
+    assert data['mesos']['masters'] == 3
+    assert data['mesos']['cpus'] == {'total': 10, 'used': 1}
+    assert data['mesos']['tasks']['running'] == 1
+    assert all('\033' not in check['output'] for check in data['mesos']['checks'])
+    assert data['slaves'] == [{
+        'hostname': 'host1',
+        'free': {'cpus': 9, 'mem': 90, 'disk': 900},
+        'total': {'cpus': 10, 'mem': 100, 'disk': 1000},
+    }]
+    assert data['attributes']['region']['a_region']['free'] == {'cpus': 9, 'mem': 90, 'disk': 900}
+    assert data['marathon'] == {
+        'configured': True,
+        'ok': True,
+        'checks': [
+            {'output': 'marathon apps: 1', 'ok': True},
+            {'output': 'marathon tasks: 2', 'ok': True},
+            {'output': 'marathon deployments: 0', 'ok': True},
+        ],
+        'apps': 1,
+        'tasks': 2,
+        'deployments': 0,
+    }
+    assert marathon_client.list_tasks.call_count == 1
+    assert data['chronos'] == {
+        'configured': False,
+        'ok': True,
+        'checks': [{'output': 'chronos is not configured to run here', 'ok': True}],
+    }
+    json.dumps(data)
+
+
+def test_get_marathon_data_without_apps():
+    marathon_client = Mock()
+    marathon_client.list_apps.return_value = []
+    marathon_client.list_tasks.return_value = []
+    marathon_client.list_deployments.return_value = []
+    data = paasta_metastatus.get_marathon_data(marathon_client)
+    assert data['ok'] is False
+    assert data['checks'][0] == {'output': 'CRITICAL: No marathon apps running', 'ok': False}
+
+
+def test_get_chronos_data():
+    chronos_client = Mock()
+    chronos_client.list.return_value = [{'name': 'job1', 'disabled': False}, {'name': 'job2', 'disabled': True}]
+    data = paasta_metastatus.get_chronos_data(chronos_client)
+    assert data == {
+        'configured': True,
+        'ok': True,
+        'checks': [{'output': 'Enabled chronos jobs: 1', 'ok': True}],
+        'enabled_jobs': 1,
+    }
+    assert chronos_client.list.call_count == 1
+
+
+def test_get_marathon_data_error():
+    marathon_client = Mock()
+    marathon_client.list_apps.side_effect = paasta_metastatus.MarathonError('boom')
+    data = paasta_metastatus.get_marathon_data(marathon_client)
+    assert data['ok'] is False
+    assert data['configured'] is True
+    assert data['checks'] == [{'output': 'CRITICAL: Unable to contact Marathon! Error: boom', 'ok': False}]
+
+
+def test_format_prometheus_metrics():
+    metrics = paasta_metastatus.format_prometheus_metrics(get_fake_metastatus_data())
+    lines = metrics.splitlines()
+    assert '# TYPE paasta_mesos_resource_total gauge' in lines
+    assert 'paasta_mesos_resource_total{resource="cpus"} 10.0' in lines
+    assert 'paasta_mesos_tasks{state="running"} 3.0' in lines
+    assert 'paasta_mesos_slave_resource_free{hostname="host\\"1",resource="mem"} 90.0' in lines
+    assert 'paasta_mesos_attribute_resource_total{attribute="region",resource="disk",value="a_region"} 1000.0' in lines
+    assert 'paasta_marathon_apps 2.0' in lines
+    assert 'paasta_metastatus_ok{framework="chronos"} 1.0' in lines
+    assert not any(line.startswith('paasta_chronos_enabled_jobs') for line in lines)
+
+
+def test_metastatus_exporter_refresh_failure():
+    exporter = paasta_metastatus.MetastatusExporter()
+    with patch('paasta_tools.paasta_metastatus.collect_metastatus_data', autospec=True,
+               side_effect=paasta_metastatus.MasterNotAvailableException('down')):
+        exporter.refresh()
+    assert 'paasta_metastatus_up 0.0' in exporter.metrics.splitlines()
+
+
+def test_main_json(capsys):
+    with contextlib.nested(
+        patch('paasta_tools.paasta_metastatus.parse_args', autospec=True),
+        patch('paasta_tools.paasta_metastatus.collect_metastatus_data', autospec=True),
+    ) as (
+        parse_args_patch,
+        collect_metastatus_data_patch,
+    ):
+        parse_args_patch.return_value = Mock(verbose=0, json=True, exporter=False, fit=None)
+        collect_metastatus_data_patch.return_value = {'ok': False, 'mesos': {}}
+        with raises(SystemExit) as excinfo:
+            paasta_metastatus.main()
+    assert excinfo.value.code == 2
+    out, _ = capsys.readouterr()
+    assert json.loads(out) == {'ok': False, 'mesos': {}}
+
+
+def get_fit_mesos_state():
+    return {
+        'slaves': [
+            {
+                'id': 'slave1',
+                'hostname': 'host1',
+                'resources': {'cpus': 10, 'mem': 8192, 'disk': 1000},
+                'attributes': {'region': 'a_region', 'pool': 'default'},
+            },
+            {
+                'id': 'slave2',
+                'hostname': 'host2',
+                'resources': {'cpus': 10, 'mem': 8192, 'disk': 1000},
+                'attributes': {'region': 'b_region', 'pool': 'default'},
+            },
+            {
+                'id': 'slave3',
+                'hostname': 'host3',
+                'resources': {'cpus': 0.3, 'mem': 8192, 'disk': 1000},
+                'attributes': {'region': 'b_region', 'pool': 'batch'},
+            },
+        ],
+        'frameworks': [
+            {'tasks': [
+                {'slave_id': 'slave1', 'resources': {'cpus': 1, 'mem': 4096, 'disk': 10}},
+                {'slave_id': 'slave3', 'resources': {'cpus': 0.1, 'mem': 0, 'disk': 0}},
+            ]},
+        ],
+    }
+
+
+def test_parse_fit_spec():
+    assert paasta_metastatus.parse_fit_spec('2,4096,0') == ((2.0, 4096.0, 0.0), None)
+    assert paasta_metastatus.parse_fit_spec('0.5,1024,10,region') == ((0.5, 1024.0, 10.0), 'region')
+    for bad_spec in ('2,4096', '2,a,0', '0,0,0', '-1,1,1', '1,2,3,region,extra'):
+        with raises(argparse.ArgumentTypeError):
+            paasta_metastatus.parse_fit_spec(bad_spec)
+
+
+def test_parse_constraint():
+    assert paasta_metastatus.parse_constraint('pool:LIKE:a:b') == ['pool', 'LIKE', 'a:b']
+    assert paasta_metastatus.parse_constraint('hostname:UNIQUE') == ['hostname', 'UNIQUE']
+    for bad_constraint in ('pool', 'pool:EQUALS:default', 'pool:LIKE', 'region:UNIQUE'):
+        with raises(argparse.ArgumentTypeError):
+            paasta_metastatus.parse_constraint(bad_constraint)
+
+
+def test_slave_passes_constraints():
+    slave = {'hostname': 'host1', 'attributes': {'region': 'a_region', 'pool': 'default'}}
+    assert paasta_metastatus.slave_passes_constraints(slave, [])
+    assert paasta_metastatus.slave_passes_constraints(slave, [['pool', 'LIKE', 'def.*']])
+    assert not paasta_metastatus.slave_passes_constraints(slave, [['pool', 'LIKE', 'def']])
+    assert not paasta_metastatus.slave_passes_constraints(slave, [['region', 'UNLIKE', 'a_.*']])
+    assert paasta_metastatus.slave_passes_constraints(slave, [['habitat', 'UNLIKE', 'a_.*']])
+    assert not paasta_metastatus.slave_passes_constraints(slave, [['habitat', 'CLUSTER', 'a']])
+    assert paasta_metastatus.slave_passes_constraints(slave, [['hostname', 'CLUSTER', 'host1'],
+                                                              ['region', 'GROUP_BY']])
+
+
+@mark.parametrize('use_numpy', [True, False])
+def test_get_fit_data(use_numpy):
+    if use_numpy and paasta_metastatus.numpy is None:
+        return
+    with contextlib.nested(
+        patch('paasta_tools.paasta_metastatus._slave_resource_vectors', (None, None)),
+        patch('paasta_tools.paasta_metastatus.numpy', paasta_metastatus.numpy if use_numpy else None),
+    ):
+        mesos_state = get_fit_mesos_state()
+        fit_data = paasta_metastatus.get_fit_data(mesos_state, (0.1, 1024, 0), 'region')
+        assert fit_data['instances'] == 4 + 8 + 2
+        assert fit_data['slaves'] == 3
+        assert fit_data['groups'] == {
+            'a_region': {'instances': 4, 'slaves': 1},
+            'b_region': {'instances': 10, 'slaves': 2},
+        }
+
+        fit_data = paasta_metastatus.get_fit_data(mesos_state, (0.1, 1024, 0), 'region',
+                                                  [['pool', 'LIKE', 'default'], ['hostname', 'UNIQUE']])
+        assert fit_data['instances'] == 2
+        assert fit_data['groups'] == {
+            'a_region': {'instances': 1, 'slaves': 1},
+            'b_region': {'instances': 1, 'slaves': 1},
+        }
+
+        fit_data = paasta_metastatus.get_fit_data(mesos_state, (20, 0, 0))
+        assert fit_data['instances'] == 0
+        assert fit_data['groups'] == {}
+        json.dumps(fit_data)
+
+
+def test_format_fit_data():
+    output = paasta_metastatus.format_fit_data({
+        'shape': {'cpus': 0.5, 'mem': 1024, 'disk': 0},
+        'attribute': 'region',
+        'instances': 5,
+        'slaves': 2,
+        'groups': {'b_region': {'instances': 3, 'slaves': 1}, 'a_region': {'instances': 2, 'slaves': 1}},
+    })
+    lines = output.splitlines()
+    assert lines[0] == 'Additional instances of cpus=0.5, mem=1024, disk=0 that fit:'
+    assert lines[1].split() == ['Region', 'Instances', 'Slaves']
+    assert lines[2].split() == ['a_region', '2', '1']
+    assert lines[3].split() == ['b_region', '3', '1']
+    assert lines[4].split() == ['Total', '5', '2']
+
+
+def test_main_fit(capsys):
+    with contextlib.nested(
+        patch('paasta_tools.paasta_metastatus.parse_args', autospec=True),
+        patch('paasta_tools.paasta_metastatus.get_compact_mesos_state_from_leader', autospec=True),
+        patch('paasta_tools.paasta_metastatus.get_fit_data', autospec=True),
+    ) as (
+        parse_args_patch,
+        get_compact_mesos_state_from_leader_patch,
+        get_fit_data_patch,
+    ):
+        parse_args_patch.return_value = Mock(
+            verbose=0,
+            json=True,
+            exporter=False,
+            fit=paasta_metastatus.FitSpec(shape=(1, 2, 3), attribute=None),
+            pool='default',
+            constraints=[['hostname', 'UNIQUE']],
+        )
+        get_fit_data_patch.return_value = {'instances': 1}
+        with raises(SystemExit) as excinfo:
+            paasta_metastatus.main()
+    assert excinfo.value.code == 0
+    get_fit_data_patch.assert_called_once_with(
+        get_compact_mesos_state_from_leader_patch.return_value, (1, 2, 3), None,
+        [['hostname', 'UNIQUE'], ['pool', 'LIKE', 'default']])
+    out, _ = capsys.readouterr()
+    assert json.loads(out) == {'instances': 1}
@@ -11,6 +11,8 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import os
+
 import mock
 
 from paasta_tools import remote_git
@@ -102,3 +104,78 @@ def test_create_remote_refs_allows_force_and_uses_the_provided_mutator(mock_dulw
     )
     fake_git_client.send_pack.assert_called_once_with(
         'fake_path', ref_mutator, mock.ANY)
+
+
+def test_filter_paasta_refs():
+    refs = {
+        'refs/heads/master': 'a',
+        'refs/tags/paasta-cluster.main-20160101T000000-deploy': 'b',
+        'refs/tags/v1.0': 'c',
+    }
+    assert remote_git.filter_paasta_refs(refs) == {'refs/tags/paasta-cluster.main-20160101T000000-deploy': 'b'}
+
+
+@mock.patch('paasta_tools.remote_git.list_remote_refs', autospec=True)
+def test_remote_ref_cache_without_ttl_always_fetches(mock_list_remote_refs):
+    mock_list_remote_refs.return_value = {'refs/heads/master': 'a', 'refs/tags/paasta-foo-deploy': 'b'}
+    cache = remote_git.RemoteRefCache()
+    assert cache.get('fake_git_url') == {'refs/tags/paasta-foo-deploy': 'b'}
+    assert cache.get('fake_git_url') == {'refs/tags/paasta-foo-deploy': 'b'}
+    assert mock_list_remote_refs.call_count == 2
+
+
+@mock.patch('paasta_tools.remote_git.list_remote_refs', autospec=True)
+def test_remote_ref_cache_shares_mirror(mock_list_remote_refs, tmpdir):
+    mock_list_remote_refs.return_value = {'refs/tags/paasta-foo-deploy': 'b'}
+    first = remote_git.RemoteRefCache(ttl=60, cache_dir=str(tmpdir))
+    second = remote_git.RemoteRefCache(ttl=60, cache_dir=str(tmpdir))
+    assert first.get('fake_git_url') == {'refs/tags/paasta-foo-deploy': 'b'}
+    assert second.get('fake_git_url') == {'refs/tags/paasta-foo-deploy': 'b'}
+    assert mock_list_remote_refs.call_count == 1
+    assert remote_git.read_ref_mirror(first.get_mirror_path('fake_git_url'))[0] == \
+        {'refs/tags/paasta-foo-deploy': 'b'}
+
+
+@mock.patch('paasta_tools.remote_git.list_remote_refs', autospec=True)
+def test_remote_ref_cache_only_rewrites_changed_mirror(mock_list_remote_refs, tmpdir):
+    mock_list_remote_refs.return_value = {'refs/tags/paasta-foo-deploy': 'b'}
+    cache = remote_git.RemoteRefCache(ttl=60, cache_dir=str(tmpdir))
+    path = cache.get_mirror_path('fake_git_url')
+    with open(path, 'w') as f:
+        f.write('{"refs/tags/paasta-foo-deploy": "b"}')
+    os.utime(path, (0, 0))
+    with mock.patch('paasta_tools.remote_git.atomic_file_write', autospec=True) as mock_atomic_file_write:
+        assert cache.get('fake_git_url') == {'refs/tags/paasta-foo-deploy': 'b'}
+    assert not mock_atomic_file_write.called
+    assert os.stat(path).st_mtime > 0
+
+    cache = remote_git.RemoteRefCache(ttl=60, cache_dir=str(tmpdir))
+    os.utime(path, (0, 0))
+    mock_list_remote_refs.return_value = {'refs/tags/paasta-foo-deploy': 'c'}
+    assert cache.get('fake_git_url') == {'refs/tags/paasta-foo-deploy': 'c'}
+    assert remote_git.read_ref_mirror(path)[0] == {'refs/tags/paasta-foo-deploy': 'c'}
+
+
+def test_read_ref_mirror_missing(tmpdir):
+    assert remote_git.read_ref_mirror(str(tmpdir.join('missing.json'))) == (None, None)
+
+
+@mock.patch('dulwich.client', autospec=True)
+def test_delete_remote_refs_only_deletes_unchanged_refs(mock_dulwich_client):
+    fake_git_client = mock.Mock()
+    mock_dulwich_client.get_transport_and_path.return_value = fake_git_client, 'fake_path'
+    remote_git.delete_remote_refs('fake_git_url', {
+        'refs/tags/paasta-old-deploy': 'aaa',
+        'refs/tags/paasta-moved-deploy': 'bbb',
+    })
+    path, determine_wants, generate_pack_contents = fake_git_client.send_pack.call_args[0]
+    assert path == 'fake_path'
+    assert determine_wants({
+        'refs/heads/master': 'ccc',
+        'refs/tags/paasta-old-deploy': 'aaa',
+        'refs/tags/paasta-moved-deploy': 'ddd',
+    }) == {
+        'refs/heads/master': 'ccc',
+        'refs/tags/paasta-moved-deploy': 'ddd',
+    }
+    assert generate_pack_contents([], []) == []
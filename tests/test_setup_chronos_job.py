@@ -65,6 +65,7 @@ class TestSetupChronosJob:
         service_instance=compose_job_id(fake_service, fake_instance),
         soa_dir='no_more',
         verbose=False,
+        all_jobs=False,
     )
 
     def test_main_success(self):
@@ -109,6 +110,7 @@ class TestSetupChronosJob:
                 complete_job_config=fake_complete_job_config,
                 client=self.fake_client,
                 cluster=self.fake_cluster,
+                job_index=None,
             )
             send_event_patch.assert_called_once_with(
                 service=self.fake_service,
@@ -413,3 +415,169 @@ class TestSetupChronosJob:
             )
             assert not mock_log.called
             assert not mock_update_job.called
+
+    def test_deploy_in_topological_order(self):
+        job_graph = chronos_tools.ChronosJobGraph({
+            ('s', 'a'): [],
+            ('s', 'b'): [('s', 'a')],
+            ('s', 'c'): [('s', 'b')],
+            ('s', 'broken'): [],
+            ('s', 'orphan'): [('s', 'broken')],
+            ('s', 'grand_orphan'): [('s', 'orphan')],
+            ('s', 'unbuildable'): [],
+            ('s', 'unbuildable_child'): [('s', 'unbuildable')],
+            ('s', 'unknown_child'): [('s', 'unknown')],
+        }, chronos_tools.ChronosJobIndex([
+            {'name': 's unbuildable', 'disabled': False},
+        ]))
+        deploy_order = []
+        skipped = []
+
+        def fake_deploy(service, instance):
+            deploy_order.append(instance)
+            if instance == 'unbuildable':
+                return None
+            return instance != 'broken'
+
+        def fake_skip(service, instance, parent):
+            skipped.append((instance, parent))
+
+        assert setup_chronos_job.deploy_in_topological_order(job_graph, fake_deploy, fake_skip, max_workers=2) == {
+            ('s', 'a'): True,
+            ('s', 'b'): True,
+            ('s', 'c'): True,
+            ('s', 'broken'): False,
+            ('s', 'orphan'): None,
+            ('s', 'grand_orphan'): None,
+            ('s', 'unbuildable'): None,
+            ('s', 'unbuildable_child'): True,
+            ('s', 'unknown_child'): None,
+        }
+        assert deploy_order.index('a') < deploy_order.index('b') < deploy_order.index('c')
+        assert 'orphan' not in deploy_order
+        assert 'grand_orphan' not in deploy_order
+        assert sorted(skipped) == [
+            ('grand_orphan', ('s', 'orphan')),
+            ('orphan', ('s', 'broken')),
+            ('unknown_child', ('s', 'unknown')),
+        ]
+
+    def test_deploy_all(self):
+        fake_job_graph = chronos_tools.ChronosJobGraph({
+            ('s', 'unchanged'): [],
+            ('s', 'changed'): [('s', 'unchanged')],
+            ('s', 'new'): [],
+            ('s', 'broken'): [],
+        }, chronos_tools.ChronosJobIndex([
+            {'name': 's unchanged', 'description': 'hash1', 'disabled': False},
+            {'name': 's changed', 'description': 'old_hash', 'disabled': False},
+        ]))
+        fake_configs = {
+            'unchanged': {'name': 's unchanged', 'description': 'hash1'},
+            'changed': {'name': 's changed', 'description': 'hash2'},
+            'new': {'name': 's new', 'description': 'hash3'},
+            'broken': None,
+        }
+        with contextlib.nested(
+            mock.patch.object(chronos_tools.ChronosJobGraph, 'load', return_value=fake_job_graph),
+            mock.patch('paasta_tools.setup_chronos_job.create_complete_config_or_report', autospec=True,
+                       side_effect=lambda service, instance, cluster, soa_dir, job_graph: fake_configs[instance]),
+            mock.patch('paasta_tools.setup_chronos_job.bounce_chronos_job', autospec=True,
+                       return_value=(0, 'All chronos bouncing tasks finished.')),
+            mock.patch('paasta_tools.setup_chronos_job.send_event', autospec=True),
+        ) as (
+            mock_load,
+            mock_create_complete_config_or_report,
+            mock_bounce_chronos_job,
+            mock_send_event,
+        ):
+            assert setup_chronos_job.deploy_all(self.fake_client, self.fake_cluster, 'fake_dir') == {
+                ('s', 'unchanged'): True,
+                ('s', 'changed'): True,
+                ('s', 'new'): True,
+                ('s', 'broken'): None,
+            }
+            mock_load.assert_called_once_with(self.fake_client, self.fake_cluster, soa_dir='fake_dir')
+            assert mock_create_complete_config_or_report.call_count == 4
+            jobs_to_update = dict(
+                (call[1]['instance'], call[1]['job_to_update']) for call in mock_bounce_chronos_job.call_args_list
+            )
+            assert jobs_to_update == {
+                'unchanged': None,
+                'changed': fake_configs['changed'],
+                'new': fake_configs['new'],
+            }
+            assert sorted(call[1]['instance'] for call in mock_send_event.call_args_list) == [
+                'changed', 'new', 'unchanged']
+            assert set(call[1]['status'] for call in mock_send_event.call_args_list) == set([Status.OK])
+
+    def test_deploy_all_reports_failed_push(self):
+        fake_job_graph = chronos_tools.ChronosJobGraph({('s', 'a'): []}, chronos_tools.ChronosJobIndex([]))
+        with contextlib.nested(
+            mock.patch.object(chronos_tools.ChronosJobGraph, 'load', return_value=fake_job_graph),
+            mock.patch('paasta_tools.setup_chronos_job.create_complete_config_or_report', autospec=True,
+                       return_value={'name': 's a', 'description': 'hash'}),
+            mock.patch('paasta_tools.setup_chronos_job.bounce_chronos_job', autospec=True,
+                       side_effect=Exception('boom')),
+            mock.patch('paasta_tools.setup_chronos_job.send_event', autospec=True),
+        ) as (
+            _,
+            _,
+            _,
+            mock_send_event,
+        ):
+            assert setup_chronos_job.deploy_all(self.fake_client, self.fake_cluster, 'fake_dir') == {('s', 'a'): False}
+            assert not mock_send_event.called
+
+    def test_deploy_all_reports_skipped_children(self):
+        fake_job_graph = chronos_tools.ChronosJobGraph({
+            ('s', 'a'): [],
+            ('s', 'b'): [('s', 'a')],
+        }, chronos_tools.ChronosJobIndex([]))
+        with contextlib.nested(
+            mock.patch.object(chronos_tools.ChronosJobGraph, 'load', return_value=fake_job_graph),
+            mock.patch('paasta_tools.setup_chronos_job.create_complete_config_or_report', autospec=True,
+                       side_effect=lambda service, instance, cluster, soa_dir, job_graph: {
+                           'name': 's %s' % instance, 'description': 'hash'}),
+            mock.patch('paasta_tools.setup_chronos_job.bounce_chronos_job', autospec=True,
+                       side_effect=Exception('boom')),
+            mock.patch('paasta_tools.setup_chronos_job.send_event', autospec=True),
+        ) as (
+            _,
+            _,
+            mock_bounce_chronos_job,
+            mock_send_event,
+        ):
+            assert setup_chronos_job.deploy_all(self.fake_client, self.fake_cluster, 'fake_dir') == {
+                ('s', 'a'): False,
+                ('s', 'b'): None,
+            }
+            assert mock_bounce_chronos_job.call_count == 1
+            mock_send_event.assert_called_once_with(
+                service='s',
+                instance='b',
+                soa_dir='fake_dir',
+                status=Status.CRITICAL,
+                output="Not deploying s.b: its parent s.a failed to deploy or doesn't exist in Chronos",
+            )
+
+    def test_main_all(self):
+        fake_args = mock.MagicMock(service_instance=None, soa_dir='fake_dir', verbose=False, all_jobs=True, workers=3)
+        with contextlib.nested(
+            mock.patch('paasta_tools.setup_chronos_job.parse_args', return_value=fake_args, autospec=True),
+            mock.patch('paasta_tools.chronos_tools.load_chronos_config', autospec=True),
+            mock.patch('paasta_tools.chronos_tools.get_chronos_client', return_value=self.fake_client, autospec=True),
+            mock.patch('paasta_tools.setup_chronos_job.load_system_paasta_config', autospec=True),
+            mock.patch('paasta_tools.setup_chronos_job.deploy_all', autospec=True),
+        ) as (
+            _,
+            _,
+            _,
+            load_system_paasta_config_patch,
+            deploy_all_patch,
+        ):
+            load_system_paasta_config_patch.return_value.get_cluster.return_value = self.fake_cluster
+            with raises(SystemExit) as excinfo:
+                setup_chronos_job.main()
+            assert excinfo.value.code == 0
+            deploy_all_patch.assert_called_once_with(self.fake_client, self.fake_cluster, 'fake_dir', max_workers=3)
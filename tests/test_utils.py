@@ -16,8 +16,11 @@ import datetime
 import json
 import os
 import shutil
+import sqlite3
 import stat
 import tempfile
+import threading
+import time
 
 import mock
 from pytest import raises
@@ -360,6 +363,36 @@ def test_SystemPaastaConfig_get_sensu_port():
     assert actual == expected
 
 
+def test_SystemPaastaConfig_get_mesos_state_cache_defaults():
+    fake_config = utils.SystemPaastaConfig({}, '/some/fake/dir')
+    assert fake_config.get_mesos_state_cache_ttl() == 0
+    assert fake_config.get_mesos_state_snapshot_path() is None
+
+
+def test_SystemPaastaConfig_get_mesos_state_cache():
+    fake_config = utils.SystemPaastaConfig({
+        'mesos_state_cache_ttl': 30,
+        'mesos_state_snapshot_path': '/var/cache/paasta/mesos_state.json.gz',
+    }, '/some/fake/dir')
+    assert fake_config.get_mesos_state_cache_ttl() == 30
+    assert fake_config.get_mesos_state_snapshot_path() == '/var/cache/paasta/mesos_state.json.gz'
+
+
+def test_SystemPaastaConfig_get_git_ref_cache_defaults():
+    fake_config = utils.SystemPaastaConfig({}, '/some/fake/dir')
+    assert fake_config.get_git_ref_cache_ttl() == 0
+    assert fake_config.get_git_ref_cache_dir() is None
+
+
+def test_SystemPaastaConfig_get_git_ref_cache():
+    fake_config = utils.SystemPaastaConfig({
+        'git_ref_cache_ttl': 60,
+        'git_ref_cache_dir': '/var/cache/paasta/git_refs',
+    }, '/some/fake/dir')
+    assert fake_config.get_git_ref_cache_ttl() == 60
+    assert fake_config.get_git_ref_cache_dir() == '/var/cache/paasta/git_refs'
+
+
 def test_atomic_file_write():
     with mock.patch('tempfile.NamedTemporaryFile', autospec=True) as ntf_patch:
         file_patch = ntf_patch().__enter__()
@@ -724,10 +757,12 @@ def test_DeploymentsJson_read():
         mock.patch('paasta_tools.utils.open', create=True, return_value=file_mock),
         mock.patch('json.load', autospec=True, return_value=fake_json),
         mock.patch('paasta_tools.utils.os.path.isfile', autospec=True, return_value=True),
+        mock.patch('paasta_tools.utils.get_deployments_store', autospec=True, return_value=None),
     ) as (
         open_patch,
         json_patch,
         isfile_patch,
+        _,
     ):
         actual = utils.load_deployments_json('fake_service', fake_dir)
         open_patch.assert_called_once_with(fake_path)
@@ -735,6 +770,129 @@ def test_DeploymentsJson_read():
         assert actual == fake_json['v1']
 
 
+def write_fake_deployments(soa_dir, service, deployments):
+    soa_dir.mkdir(service).join('deployments.json').write(json.dumps({'v1': deployments}))
+
+
+def test_deployments_store(tmpdir):
+    soa_dir = tmpdir.mkdir('soa')
+    write_fake_deployments(soa_dir, 'fake_service', {
+        'fake_service:paasta-cluster.main': {'docker_image': 'services-fake_service:paasta-abc'},
+    })
+    soa_dir.mkdir('undeployed_service')
+    store_path = str(tmpdir.join('deployments.sqlite'))
+    utils.write_deployments_store(store_path, str(soa_dir), ['fake_service', 'undeployed_service'])
+
+    store = utils.DeploymentsStore(store_path)
+    deployments_json = store.get_deployments_json('fake_service', str(soa_dir))
+    assert deployments_json == {
+        'fake_service:paasta-cluster.main': {'docker_image': 'services-fake_service:paasta-abc'},
+    }
+    assert deployments_json.get_branch_dict('fake_service', 'paasta-cluster.main') == \
+        {'docker_image': 'services-fake_service:paasta-abc'}
+    assert store.get_deployments_json('undeployed_service', str(soa_dir)) is None
+    assert store.get_deployments_json('fake_service', '/other/soa/dir') is None
+
+    write_fake_deployments(soa_dir, 'other_service', {
+        'other_service:paasta-cluster.main': {'docker_image': 'services-other_service:paasta-def'},
+    })
+    utils.write_deployments_store(store_path, str(soa_dir), ['fake_service', 'other_service'])
+    assert store.get_deployments_json('other_service', str(soa_dir)) == {
+        'other_service:paasta-cluster.main': {'docker_image': 'services-other_service:paasta-def'},
+    }
+
+
+def test_deployments_store_falls_back_to_regenerated_deployments_json(tmpdir):
+    soa_dir = tmpdir.mkdir('soa')
+    write_fake_deployments(soa_dir, 'fake_service', {
+        'fake_service:paasta-cluster.main': {'docker_image': 'services-fake_service:paasta-abc'},
+    })
+    deployments_path = str(soa_dir.join('fake_service', 'deployments.json'))
+    os.utime(deployments_path, (1000, 1000))
+    store_path = str(tmpdir.join('deployments.sqlite'))
+    utils.write_deployments_store(store_path, str(soa_dir), ['fake_service'])
+    store = utils.DeploymentsStore(store_path)
+    assert store.get_deployments_json('fake_service', str(soa_dir)) is not None
+
+    # as a standalone generate_deployments_for_service run would
+    soa_dir.join('fake_service', 'deployments.json').write(json.dumps({'v1': {
+        'fake_service:paasta-cluster.main': {'docker_image': 'services-fake_service:paasta-def'},
+    }}))
+    os.utime(deployments_path, (2000, 2000))
+    assert store.get_deployments_json('fake_service', str(soa_dir)) is None
+    with mock.patch('paasta_tools.utils.get_deployments_store', autospec=True, return_value=store):
+        assert utils.load_deployments_json('fake_service', str(soa_dir)) == {
+            'fake_service:paasta-cluster.main': {'docker_image': 'services-fake_service:paasta-def'},
+        }
+
+    os.remove(deployments_path)
+    assert store.get_deployments_json('fake_service', str(soa_dir)) is None
+
+
+def test_deployments_store_closes_replaced_connection(tmpdir):
+    soa_dir = tmpdir.mkdir('soa')
+    write_fake_deployments(soa_dir, 'fake_service', {})
+    store_path = str(tmpdir.join('deployments.sqlite'))
+    utils.write_deployments_store(store_path, str(soa_dir), ['fake_service'])
+    store = utils.DeploymentsStore(store_path)
+    assert store.connect()
+    old_connection = store.connection
+
+    utils.write_deployments_store(store_path, str(soa_dir), [])
+    assert store.connect()
+    assert store.connection is not old_connection
+    with raises(sqlite3.ProgrammingError):
+        old_connection.execute("SELECT 1")
+
+    os.remove(store_path)
+    assert not store.connect()
+    assert store.connection is None
+
+
+def test_deployments_store_closes_connection_on_error(tmpdir):
+    store_path = str(tmpdir.join('deployments.sqlite'))
+    connection = sqlite3.connect(store_path)
+    with connection:
+        connection.execute("CREATE TABLE metadata (name TEXT PRIMARY KEY, value TEXT)")
+        connection.execute("INSERT INTO metadata VALUES ('soa_dir', ?)", (str(tmpdir),))
+    connection.close()
+    store = utils.DeploymentsStore(store_path)
+    assert store.connect()
+    broken_connection = store.connection
+
+    assert store.get_deployments_json('fake_service', str(tmpdir)) is None
+    assert store.connection is None
+    with raises(sqlite3.ProgrammingError):
+        broken_connection.execute("SELECT 1")
+
+
+def test_deployments_store_missing(tmpdir):
+    store = utils.DeploymentsStore(str(tmpdir.join('missing.sqlite')))
+    assert store.get_deployments_json('fake_service') is None
+    assert not tmpdir.join('missing.sqlite').check()
+
+
+def test_load_deployments_json_from_store(tmpdir):
+    fake_store = mock.Mock(get_deployments_json=mock.Mock(return_value=utils.DeploymentsJson({'a:b': {}})))
+    with contextlib.nested(
+        mock.patch('paasta_tools.utils.get_deployments_store', autospec=True, return_value=fake_store),
+        mock.patch('paasta_tools.utils.open', create=True),
+    ) as (
+        _,
+        open_patch,
+    ):
+        assert utils.load_deployments_json('fake_service', str(tmpdir)) == {'a:b': {}}
+    fake_store.get_deployments_json.assert_called_once_with('fake_service', str(tmpdir))
+    assert not open_patch.called
+
+
+def test_SystemPaastaConfig_get_deployments_store_path():
+    assert utils.SystemPaastaConfig({}, '/some/fake/dir').get_deployments_store_path() is None
+    assert utils.SystemPaastaConfig(
+        {'deployments_store_path': '/nail/etc/deployments.sqlite'}, '/some/fake/dir',
+    ).get_deployments_store_path() == '/nail/etc/deployments.sqlite'
+
+
 def test_get_docker_url_no_error():
     fake_registry = "im.a-real.vm"
     fake_image = "and-i-can-run:1.0"
@@ -1396,3 +1554,72 @@ def test_deep_merge_dictionaries():
         'overwriting_dict': {'test': 'value'},
     }
     assert utils.deep_merge_dictionaries(overrides, defaults) == expected
+
+
+def test_timeout_nests():
+    assert utils.get_current_timeout() is None
+    assert utils.remaining_time(default=5) == 5
+    with utils.Timeout(60) as outer:
+        assert utils.get_current_timeout() is outer
+        with utils.Timeout(120) as inner:
+            assert inner.expires_at == outer.expires_at
+            assert 0 < utils.remaining_time() <= 60
+        with utils.Timeout(0) as expired:
+            assert expired.expired()
+            with raises(utils.TimeoutError):
+                utils.check_deadline()
+        assert utils.get_current_timeout() is outer
+        utils.check_deadline()
+    assert utils.get_current_timeout() is None
+
+
+def test_timeout_is_per_thread():
+    results = []
+    with utils.Timeout(0):
+        thread = threading.Thread(target=lambda: results.append(utils.get_current_timeout()))
+        thread.start()
+        thread.join()
+    assert results == [None]
+
+
+def test_timeout_run():
+    with utils.Timeout(60) as deadline:
+        assert deadline.run(utils.get_current_timeout) is deadline
+        with raises(ValueError):
+            deadline.run(int, 'not a number')
+    with utils.Timeout(0.01, 'fake message') as deadline:
+        with raises(utils.TimeoutError) as excinfo:
+            deadline.run(time.sleep, 1)
+    assert excinfo.value.message == 'fake message'
+
+
+def test_timeout_decorator():
+    @utils.timeout(seconds=0)
+    def wait_forever():
+        while True:
+            utils.check_deadline()
+
+    with raises(utils.TimeoutError):
+        wait_forever()
+
+    @utils.timeout(seconds=60)
+    def get_remaining_time():
+        return utils.remaining_time()
+
+    assert 0 < get_remaining_time() <= 60
+
+
+def test_timeout_decorator_bounds_blocking_calls():
+    unblock = threading.Event()
+
+    @utils.timeout(seconds=0.05, error_message='fake message')
+    def block():
+        # like a request without a socket timeout, this never checks the deadline
+        unblock.wait(10)
+
+    try:
+        with raises(utils.TimeoutError) as excinfo:
+            block()
+        assert excinfo.value.message == 'fake message'
+    finally:
+        unblock.set()